@@ -1,10 +1,18 @@
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from utils.file_handler import FileHandler
+from utils.outline_store import OutlineStore, find_by_number
 from utils.logger import setup_logger
-from prompts_utils.content_prompts import content_generation_prompt, expand_prompt, enhance_prompt
+from utils.pass_controller import PassController
+from utils.continuation import ContinuationChain
+from utils.stream_monitor import prose_monitor, json_monitor
+from utils.chunked_polish import WindowedPolishChain, pass_prompt_tokens
+from utils.paragraph_patch import INSERT_OPS, patch_inputs, expand_inputs, apply_patch_response
+import utils.project_path  # noqa: F401
+from src.llm import get_llm
+from prompts_utils.content_prompts import (
+    content_generation_prompt, scene_generation_prompt, expand_prompt, expand_insert_prompt,
+    enhance_prompt, enhance_patch_prompt, enhance_window_prompt
+)
 import json
 import logging
 import os
@@ -17,46 +25,94 @@ logger = setup_logger()
 class ContentGenerator:
     """内容生成器类，负责基于大纲生成小说内容"""
     
-    def __init__(self, model_name: str = "claude-3-5-sonnet-20241022", base_dir: str = "demo"):
+    PASS_LABELS = {"expand": "扩展内容", "enhance": "优化内容"}
+    EXPAND_MODES = ("insert", "rewrite")
+    ENHANCE_MODES = ("patch", "rewrite", "window")
+    
+    def __init__(self, model_name: str = "claude-3-5-sonnet-20241022", base_dir: str = "demo",
+                 scene_parallel: bool = False, max_scene_concurrency: int = 5,
+                 expand_mode: str = "insert", enhance_mode: str = "patch"):
         """初始化内容生成器
         
         Args:
             model_name: 使用的模型名称
             base_dir: 基础目录
+            scene_parallel: 是否按场景拆分章节大纲并行生成初始内容
+            max_scene_concurrency: 同一章节同时生成的最大场景数
+            expand_mode: 扩展方式，insert 保留原文、只在选定位置插入新段落，rewrite 重新输出全文
+            enhance_mode: 优化方式，patch 只输出按段落编号的修改并在本地应用，rewrite 重新输出全文，
+                window 把章节拆为重叠的段落窗口并行重写后在本地合并
         """
-        self.llm = ChatAnthropic(
+        if expand_mode not in self.EXPAND_MODES:
+            raise ValueError(f"不支持的扩展方式: {expand_mode}")
+        if enhance_mode not in self.ENHANCE_MODES:
+            raise ValueError(f"不支持的优化方式: {enhance_mode}")
+        
+        self.llm = get_llm(
+            "anthropic",
             model=model_name,
-            api_key=os.getenv('ANTHROPIC_API_KEY'),
             temperature=0.75,
             max_tokens=8192,
         )
         
         self.file_handler = FileHandler(base_dir)
+        self.scene_parallel = scene_parallel
+        self.max_scene_concurrency = max_scene_concurrency
+        self.expand_mode = expand_mode
+        self.enhance_mode = enhance_mode
+        self.pass_controller = PassController()
         self.outline = None
+        self.outline_store = None
         self._init_chains()
         
         logger.info(f"内容生成器初始化完成，使用模型: {model_name}")
         
     def _init_chains(self):
         """初始化LangChain chains"""
-        self.content_generation_chain = (
-            content_generation_prompt
-            | self.llm
-            | StrOutputParser()
+        self.content_generation_chain = ContinuationChain(
+            content_generation_prompt,
+            self.llm,
+            monitor=prose_monitor("target_words"),
+            hedge="content_generation"
+        )
+        
+        self.scene_generation_chain = ContinuationChain(
+            scene_generation_prompt,
+            self.llm,
+            monitor=prose_monitor("target_words"),
+            hedge="scene_generation"
         )
         
-        self.expand_chain = (
-            expand_prompt 
-            | self.llm 
-            | StrOutputParser()
+        self.expand_chain = ContinuationChain(
+            expand_prompt,
+            self.llm,
+            monitor=prose_monitor("target_words")
+        )
+
+        self.expand_insert_chain = ContinuationChain(
+            expand_insert_prompt,
+            self.llm,
+            monitor=json_monitor
         )
 
-        self.enhance_chain = (
-            enhance_prompt 
-            | self.llm 
-            | StrOutputParser()
+        self.enhance_chain = ContinuationChain(
+            enhance_prompt,
+            self.llm,
+            monitor=prose_monitor(source_key="content")
         )
         
+        self.enhance_patch_chain = ContinuationChain(
+            enhance_patch_prompt,
+            self.llm,
+            monitor=json_monitor
+        )
+        
+        self.enhance_window_chain = WindowedPolishChain(ContinuationChain(
+            enhance_window_prompt,
+            self.llm,
+            monitor=prose_monitor(source_key="paragraphs")
+        ))
+        
     def load_outlines(self, book_outline_path: str, volume_outline_path: str, chapter_outline_path: str):
         """加载书籍、分卷和章节大纲
         
@@ -90,56 +146,286 @@ class ContentGenerator:
             logger.error(f"加载大纲文件时出错: {e}")
             raise
             
-    def generate_from_outlines(self, volume_number: int, chapter_number: int) -> str:
-        """基于已加载的大纲生成章节内容
+    def set_outline(self, outline: Dict):
+        """设置内存中的完整大纲
+        
+        Args:
+            outline: 大纲字典
+        """
+        self.outline = outline
+        self.outline_store = None
+        
+    def load_outline(self, outline_path: str):
+        """加载整本大纲
+        
+        路径为目录时按分片存储打开，只读取索引，章节大纲在需要时才读取对应分片；
+        路径为文件时读取整个大纲文件。
+        
+        Args:
+            outline_path: 大纲文件路径或分片大纲目录
+        """
+        try:
+            if os.path.isdir(outline_path):
+                self.outline_store = OutlineStore(outline_path)
+                self.outline = self.outline_store.get_book()
+            else:
+                with open(outline_path, 'r', encoding='utf-8') as f:
+                    self.outline = json.load(f)
+                self.outline_store = None
+            logger.info(f"成功加载大纲: {outline_path}")
+            
+        except Exception as e:
+            logger.error(f"加载大纲文件时出错: {e}")
+            raise
+            
+    def get_chapter_outline(self, volume_number: int, chapter_number: int) -> Dict:
+        """获取指定章节的详细大纲
         
         Args:
             volume_number: 卷号
             chapter_number: 章节号
             
         Returns:
-            str: 生成的章节文件路径
+            Dict: 章节大纲字典
         """
-        if not all([self.book_outline, self.volume_outline, self.chapter_outline]):
-            raise ValueError("请先加载所有必要的大纲文件")
+        if self.outline_store is not None:
+            chapter = self.outline_store.get_chapter(volume_number, chapter_number)
+        elif self.outline is not None:
+            volume = find_by_number(self.outline["volumes"], "volume_number", volume_number)
+            chapter = find_by_number(volume.get("chapters", []), "chapter_number", chapter_number) if volume else None
+        else:
+            raise ValueError("请先加载大纲")
             
-        logger.info(f"开始生成第 {volume_number} 卷第 {chapter_number} 章内容")
+        if chapter is None:
+            raise ValueError(f"未找到第 {volume_number} 卷第 {chapter_number} 章")
+        return chapter
         
-        try:
-            # 生成初始内容
-            initial_content = self.content_generation_chain.invoke({
-                "chapter_title": self.chapter_outline["chapter_title"],
-                "chapter_outline": json.dumps(self.chapter_outline, ensure_ascii=False, indent=2),
-                "target_words": 3000  # 默认字数
+    def _use_scenes(self, chapter_outline: Dict) -> bool:
+        """是否按场景并行生成该章节，只有多个场景时才拆分"""
+        return self.scene_parallel and len(chapter_outline.get("scenes") or []) > 1
+        
+    @staticmethod
+    def _scene_handoff(scenes: List[Dict], index: int) -> str:
+        """根据相邻场景的大纲构造衔接提示"""
+        lines = []
+        if index > 0:
+            previous = scenes[index - 1]
+            lines.append(f"上一场景《{previous.get('scene_title', '')}》：{previous.get('scene_description', '')}")
+        else:
+            lines.append("本场景是章节开头")
+        if index + 1 < len(scenes):
+            following = scenes[index + 1]
+            lines.append(f"下一场景《{following.get('scene_title', '')}》：{following.get('scene_description', '')}")
+        else:
+            lines.append("本场景是章节结尾")
+        return "\n".join(lines)
+        
+    def _scene_inputs(self, chapter_outline: Dict, target_words: int) -> List[Dict]:
+        """把章节大纲拆成各场景的chain输入，共享同一份章节概况"""
+        scenes = chapter_outline["scenes"]
+        chapter_context = {key: value for key, value in chapter_outline.items() if key != "scenes"}
+        chapter_context["scene_titles"] = [scene.get("scene_title", "") for scene in scenes]
+        chapter_context = json.dumps(chapter_context, ensure_ascii=False, indent=2)
+        default_words = max(target_words // len(scenes), 1)
+        
+        inputs = []
+        for i, scene in enumerate(scenes):
+            expected_words = str(scene.get("expected_words", "")).strip()
+            inputs.append({
+                "chapter_title": chapter_outline["chapter_title"],
+                "chapter_context": chapter_context,
+                "scene": json.dumps(scene, ensure_ascii=False, indent=2),
+                "handoff": self._scene_handoff(scenes, i),
+                "target_words": expected_words if expected_words.isdigit() else default_words
             })
-            logger.info(f"初始内容: {initial_content}")
-            # 扩展内容
-            expanded_content = self.expand_chain.invoke({
-                "scenes": initial_content
+        return inputs
+        
+    @staticmethod
+    def _join_scenes(scene_contents: List[str]) -> str:
+        """按场景顺序拼接各场景内容"""
+        return "\n\n".join(content.strip() for content in scene_contents)
+        
+    def _pass_chain(self, name: str, content: str, target_words: int):
+        """返回步骤对应的chain、输入，以及把模型回复转换为正文的函数
+        
+        续写模式下模型只返回在选定位置插入的新段落，补丁模式下模型只返回被标记段落
+        （以及它认为需要修改的段落）的修改，两者都在本地应用到原文。
+        """
+        if name == "expand":
+            if self.expand_mode == "rewrite":
+                return self.expand_chain, {"scenes": content, "target_words": target_words}, lambda response: response
+            paragraphs, chain_input = expand_inputs(content, target_words)
+            return (self.expand_insert_chain, chain_input,
+                    lambda response: apply_patch_response(content, paragraphs, response, INSERT_OPS))
+        if self.enhance_mode == "window":
+            return self.enhance_window_chain, content, lambda response: response
+        if self.enhance_mode == "patch":
+            paragraphs, chain_input = patch_inputs(
+                content,
+                self.pass_controller.flag_paragraphs(content),
+                self.pass_controller.quality_issues(content)
+            )
+            return (self.enhance_patch_chain, chain_input,
+                    lambda response: apply_patch_response(content, paragraphs, response))
+        return self.enhance_chain, {"content": content}, lambda response: response
+        
+    def _run_pass(self, name: str, content: str, target_words: int) -> str:
+        """执行或跳过扩展、优化步骤，返回之后使用的内容"""
+        if not self.pass_controller.should_run(name, content, target_words):
+            self.pass_controller.record_skip(name, content, target_words)
+            return content
+        chain, chain_input, to_content = self._pass_chain(name, content, target_words)
+        response = chain.invoke(chain_input)
+        self.pass_controller.record_run(name, content, response, pass_prompt_tokens(chain, content))
+        output = to_content(response)
+        logger.info(f"{self.PASS_LABELS[name]}: {output}")
+        return output
+        
+    async def _arun_pass(self, name: str, content: str, target_words: int) -> str:
+        """异步执行或跳过扩展、优化步骤，参见 _run_pass"""
+        if not self.pass_controller.should_run(name, content, target_words):
+            self.pass_controller.record_skip(name, content, target_words)
+            return content
+        chain, chain_input, to_content = self._pass_chain(name, content, target_words)
+        response = await chain.ainvoke(chain_input)
+        self.pass_controller.record_run(name, content, response, pass_prompt_tokens(chain, content))
+        output = to_content(response)
+        logger.info(f"{self.PASS_LABELS[name]}: {output}")
+        return output
+        
+    def _generate_content(self, chapter_outline: Dict, target_words: int = 3000) -> str:
+        """按生成、扩展、优化三步生成章节正文，扩展和优化只在需要时执行
+        
+        Args:
+            chapter_outline: 章节大纲字典
+            target_words: 目标字数
+            
+        Returns:
+            str: 章节正文
+        """
+        # 生成初始内容
+        if self._use_scenes(chapter_outline):
+            scene_inputs = self._scene_inputs(chapter_outline, target_words)
+            initial_content = self._join_scenes(self.scene_generation_chain.batch(
+                scene_inputs, config={"max_concurrency": self.max_scene_concurrency}
+            ))
+            prompt_tokens = self.scene_generation_chain.prompt_tokens * len(scene_inputs)
+        else:
+            initial_content = self.content_generation_chain.invoke({
+                "chapter_title": chapter_outline["chapter_title"],
+                "chapter_outline": json.dumps(chapter_outline, ensure_ascii=False, indent=2),
+                "target_words": target_words
             })
-            logger.info(f"扩展内容: {expanded_content}")
-            # 优化内容
-            enhanced_content = self.enhance_chain.invoke({
-                "content": expanded_content
+            prompt_tokens = self.content_generation_chain.prompt_tokens
+        logger.info(f"初始内容: {initial_content}")
+        self.pass_controller.record_run(
+            "generate", json.dumps(chapter_outline, ensure_ascii=False), initial_content, prompt_tokens
+        )
+        # 扩展、优化内容，由控制器决定是否需要
+        content = self._run_pass("expand", initial_content, target_words)
+        return self._run_pass("enhance", content, target_words)
+        
+    async def _agenerate_content(self, chapter_outline: Dict, target_words: int = 3000) -> str:
+        """异步生成章节正文，参见 _generate_content"""
+        if self._use_scenes(chapter_outline):
+            scene_inputs = self._scene_inputs(chapter_outline, target_words)
+            initial_content = self._join_scenes(await self.scene_generation_chain.abatch(
+                scene_inputs, config={"max_concurrency": self.max_scene_concurrency}
+            ))
+            prompt_tokens = self.scene_generation_chain.prompt_tokens * len(scene_inputs)
+        else:
+            initial_content = await self.content_generation_chain.ainvoke({
+                "chapter_title": chapter_outline["chapter_title"],
+                "chapter_outline": json.dumps(chapter_outline, ensure_ascii=False, indent=2),
+                "target_words": target_words
             })
-            logger.info(f"优化内容: {enhanced_content}")
-            # 保存章节内容
-            chapter_path = self.file_handler.get_chapter_path(
-                volume_number=volume_number,
-                chapter_number=chapter_number
-            )
+            prompt_tokens = self.content_generation_chain.prompt_tokens
+        logger.info(f"初始内容: {initial_content}")
+        self.pass_controller.record_run(
+            "generate", json.dumps(chapter_outline, ensure_ascii=False), initial_content, prompt_tokens
+        )
+        content = await self._arun_pass("expand", initial_content, target_words)
+        return await self._arun_pass("enhance", content, target_words)
+        
+    def _save_chapter_content(self, volume_number: int, chapter_number: int,
+                              chapter_title: str, content: str) -> str:
+        """保存章节内容
+        
+        Returns:
+            str: 章节文件路径
+        """
+        chapter_path = self.file_handler.get_chapter_path(
+            volume_number=volume_number,
+            chapter_number=chapter_number
+        )
+        
+        chapter_content = f"## 第{chapter_number}章 {chapter_title}\n\n{content}\n\n"
+        
+        with open(chapter_path, 'w', encoding='utf-8') as f:
+            f.write(chapter_content)
+            
+        logger.info(f"章节内容已保存到: {chapter_path}")
+        return chapter_path
+        
+    def generate_chapter_content(self, volume_number: int, chapter: Dict,
+                                 chapter_number: Optional[int] = None) -> str:
+        """基于章节大纲生成章节内容
+        
+        Args:
+            volume_number: 卷号
+            chapter: 章节大纲字典
+            chapter_number: 章节号，默认取大纲中的 chapter_number
             
-            chapter_content = f"## 第{chapter_number}章 {self.chapter_outline['chapter_title']}\n\n{enhanced_content}\n\n"
+        Returns:
+            str: 生成的章节文件路径
+        """
+        if chapter_number is None:
+            chapter_number = chapter.get("chapter_number", "")
+        logger.info(f"开始生成第 {volume_number} 卷第 {chapter_number} 章内容")
+        
+        try:
+            content = self._generate_content(chapter)
+            logger.info(f"生成步骤统计: {self.pass_controller.report()}")
+            return self._save_chapter_content(
+                volume_number, chapter_number, chapter["chapter_title"], content
+            )
             
-            with open(chapter_path, 'w', encoding='utf-8') as f:
-                f.write(chapter_content)
+        except Exception as e:
+            logger.error(f"生成章节内容时出错: {e}")
+            raise
             
-            logger.info(f"章节内容已保存到: {chapter_path}")
-            return chapter_path
+    async def agenerate_chapter_content(self, volume_number: int, chapter: Dict,
+                                        chapter_number: Optional[int] = None) -> str:
+        """异步基于章节大纲生成章节内容，参见 generate_chapter_content"""
+        if chapter_number is None:
+            chapter_number = chapter.get("chapter_number", "")
+        logger.info(f"开始生成第 {volume_number} 卷第 {chapter_number} 章内容")
+        
+        try:
+            content = await self._agenerate_content(chapter)
+            logger.info(f"生成步骤统计: {self.pass_controller.report()}")
+            return self._save_chapter_content(
+                volume_number, chapter_number, chapter["chapter_title"], content
+            )
             
         except Exception as e:
             logger.error(f"生成章节内容时出错: {e}")
             raise
+            
+    def generate_from_outlines(self, volume_number: int, chapter_number: int) -> str:
+        """基于已加载的大纲生成章节内容
+        
+        Args:
+            volume_number: 卷号
+            chapter_number: 章节号
+            
+        Returns:
+            str: 生成的章节文件路径
+        """
+        if not all([self.book_outline, self.volume_outline, self.chapter_outline]):
+            raise ValueError("请先加载所有必要的大纲文件")
+            
+        return self.generate_chapter_content(volume_number, self.chapter_outline, chapter_number)
 
 if __name__ == "__main__":
     # 记录开始时间
@@ -1,4 +1,3 @@
-from langchain_openai import ChatOpenAI
 import json
 from langchain_core.tools import tool
 import logging
@@ -12,7 +11,8 @@ from prompts import extract_twitter_username_prompt, mock_system_message,extract
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, FunctionMessage, ToolMessage
 from pydantic import BaseModel, Field
 from langchain.chains import LLMChain
-from langchain_anthropic import ChatAnthropic
+import utils.project_path  # noqa: F401
+from src.llm import get_llm
 import re
 from dotenv import load_dotenv
 load_dotenv()
@@ -25,13 +25,13 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
-# llm = ChatOpenAI(
+# llm = get_llm(
+#     "openai",
 #     model = 'gpt-4o',
-#     api_key=os.getenv('OPENAI_API_KEY'),
 # )
-llm = ChatAnthropic(
+llm = get_llm(
+    "anthropic",
     model='claude-3-5-sonnet-20241022',
-    api_key=os.getenv('ANTHROPIC_API_KEY'),
     temperature=0.75,
     max_tokens=8192,
 )
@@ -1,6 +1,10 @@
 from outline_generator import OutlineGenerator
 from content_generator import ContentGenerator
 from utils.file_handler import FileHandler
+from utils.pipeline import cancel_tasks, run_pipeline
+import utils.project_path  # noqa: F401
+from src.llm import registry
+import asyncio
 import logging
 import os
 from datetime import datetime
@@ -50,20 +54,24 @@ class NovelGenerator:
             model_name: 使用的模型名称
             base_dir: 基础目录
         """
-        self.outline_generator = OutlineGenerator(model_name)
+        self.outline_generator = OutlineGenerator(model_name, base_dir=base_dir)
         self.content_generator = ContentGenerator(model_name, base_dir)
         self.file_handler = FileHandler(base_dir)
         logger.info("小说生成器初始化完成")
         
     def generate_chapter(self, topic: str, description: str, 
-                        volume_number: int, chapter_number: int) -> Dict:
+                        volume_number: int, chapter_number: int,
+                        refresh_outline: bool = False) -> Dict:
         """生成单个章节
         
+        相同主题和描述的大纲会被缓存复用，同一本书的各章节来自同一份大纲。
+        
         Args:
             topic: 小说主题
             description: 小说描述
             volume_number: 卷号
             chapter_number: 章节号
+            refresh_outline: 是否丢弃已缓存的大纲重新生成
             
         Returns:
             Dict: 包含生成信息的字典
@@ -72,36 +80,20 @@ class NovelGenerator:
         logger.info(f"开始生成第 {volume_number} 卷第 {chapter_number} 章")
         
         try:
-            # 生成或加载大纲
-            outline = self.outline_generator.generate_complete_outline(
-                topic=topic,
-                description=description,
-                save=True
+            # 按需展开大纲：只生成书籍大纲、目标分卷的章节列表和目标章节的详细大纲
+            outline = self.outline_generator.lazy_outline(
+                topic, description, refresh=refresh_outline
             )
+            target_chapter = outline.get_chapter(volume_number, chapter_number)
             
             # 设置大纲
-            self.content_generator.set_outline(outline)
-            
-            # 找到指定章节
-            target_volume = None
-            target_chapter = None
-            
-            for volume in outline["volumes"]:
-                if volume["volume_number"] == volume_number:
-                    target_volume = volume
-                    for chapter in volume["chapters"]:
-                        if chapter["chapter_number"] == chapter_number:
-                            target_chapter = chapter
-                            break
-                    break
-            
-            if not target_volume or not target_chapter:
-                raise ValueError(f"未找到第 {volume_number} 卷第 {chapter_number} 章")
+            self.content_generator.set_outline(outline.to_dict())
             
             # 生成章节内容
             chapter_file = self.content_generator.generate_chapter_content(
                 volume_number=volume_number,
-                chapter=target_chapter
+                chapter=target_chapter,
+                chapter_number=chapter_number
             )
             
             # 计算用时
@@ -111,6 +103,7 @@ class NovelGenerator:
             result = {
                 "status": "success",
                 "topic": topic,
+                "outline_file": self.outline_generator.get_cached_outline_path(topic, description),
                 "volume_number": volume_number,
                 "chapter_number": chapter_number,
                 "chapter_title": target_chapter["chapter_title"],
@@ -127,13 +120,103 @@ class NovelGenerator:
             logger.error(f"生成章节时出错: {e}")
             raise
             
+    def generate_volume(self, topic: str, description: str, volume_number: int,
+                        chapter_limit: Optional[int] = None, num_workers: int = 2,
+                        max_pending: int = 2, refresh_outline: bool = False) -> Dict:
+        """生成一整卷的章节，大纲生成与正文生成流水线并行
+        
+        参见 agenerate_volume。
+        """
+        return asyncio.run(self.agenerate_volume(
+            topic, description, volume_number, chapter_limit, num_workers, max_pending, refresh_outline
+        ))
+        
+    async def agenerate_volume(self, topic: str, description: str, volume_number: int,
+                               chapter_limit: Optional[int] = None, num_workers: int = 2,
+                               max_pending: int = 2, refresh_outline: bool = False) -> Dict:
+        """异步生成一整卷的章节
+        
+        逐章生成详细大纲，每完成一章就放入有界队列，正文生成任务立即开始处理该章，
+        不必等整卷大纲完成。队列满时暂停大纲生成，一卷的总耗时接近大纲与正文两者中较慢的一方。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            volume_number: 卷号
+            chapter_limit: 最多生成的章节数，为None时生成整卷
+            num_workers: 同时生成正文的章节数
+            max_pending: 已生成大纲、等待生成正文的最大章节数
+            refresh_outline: 是否丢弃已缓存的大纲重新生成
+            
+        Returns:
+            Dict: 包含生成信息的字典
+        """
+        start_time = datetime.now()
+        logger.info(f"开始生成第 {volume_number} 卷")
+        # 大纲与正文共用同一个连接池，在后台预热，之后的并行请求不必再建立连接
+        warmup = asyncio.create_task(registry.awarmup())
+        
+        try:
+            outline = self.outline_generator.lazy_outline(
+                topic, description, refresh=refresh_outline
+            )
+            volume = await outline.aget_volume(volume_number)
+            chapter_count = len(volume["chapters"])
+            if chapter_limit:
+                chapter_count = min(chapter_count, chapter_limit)
+                
+            async def produce_outlines():
+                for chapter_number in range(1, chapter_count + 1):
+                    chapter = await outline.aget_chapter(volume_number, chapter_number)
+                    yield chapter_number, chapter
+                    
+            async def generate_content(item):
+                chapter_number, chapter = item
+                chapter_file = await self.content_generator.agenerate_chapter_content(
+                    volume_number=volume_number,
+                    chapter=chapter,
+                    chapter_number=chapter_number
+                )
+                return {
+                    "chapter_number": chapter_number,
+                    "chapter_title": chapter["chapter_title"],
+                    "chapter_file": chapter_file
+                }
+                
+            chapters = await run_pipeline(produce_outlines(), generate_content, num_workers, max_pending)
+            
+            # 计算用时
+            end_time = datetime.now()
+            duration = end_time - start_time
+            
+            result = {
+                "status": "success",
+                "topic": topic,
+                "outline_file": self.outline_generator.get_cached_outline_path(topic, description),
+                "volume_number": volume_number,
+                "chapters": chapters,
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "duration": str(duration)
+            }
+            
+            logger.info(f"分卷生成完成，共 {len(chapters)} 章，用时: {duration}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"生成分卷时出错: {e}")
+            raise
+        finally:
+            # 等待预热结束，生成提前出错时取消，不留下悬空的任务
+            await cancel_tasks([warmup])
+            
     def generate_from_outline(self, outline_path: str,
                             volume_number: int,
                             chapter_number: int) -> Dict:
         """从已有大纲生成章节内容
         
         Args:
-            outline_path: 大纲文件路径
+            outline_path: 大纲文件路径或分片大纲目录
             volume_number: 卷号
             chapter_number: 章节号
             
@@ -144,30 +227,15 @@ class NovelGenerator:
         logger.info(f"开始从大纲生成 {volume_number} 第 {chapter_number} 章")
         
         try:
-            # 加载大纲
+            # 加载大纲，分片大纲只读取索引和目标章节的分片
             self.content_generator.load_outline(outline_path)
-            outline = self.content_generator.outline
-            
-            # 找到指定章节
-            target_volume = None
-            target_chapter = None
-            
-            for volume in outline["volumes"]:
-                if volume["volume_number"] == volume_number:
-                    target_volume = volume
-                    for chapter in volume["chapters"]:
-                        if chapter["chapter_number"] == chapter_number:
-                            target_chapter = chapter
-                            break
-                    break
-            
-            if not target_volume or not target_chapter:
-                raise ValueError(f"未找到第 {volume_number} 卷第 {chapter_number} 章")
+            target_chapter = self.content_generator.get_chapter_outline(volume_number, chapter_number)
             
             # 生成章节内容
             chapter_file = self.content_generator.generate_chapter_content(
                 volume_number=volume_number,
-                chapter=target_chapter
+                chapter=target_chapter,
+                chapter_number=chapter_number
             )
             
             # 计算用时
@@ -195,6 +263,8 @@ class NovelGenerator:
 
 def main():
     """主函数，用于测试"""
+    # 重跑时相同的请求（书籍大纲、未变化的分卷和章节大纲等）直接使用缓存的响应
+    registry.enable_cache(os.path.join("demo", "cache", "llm_cache.db"))
     generator = NovelGenerator()
     
     # 测试参数
@@ -1,11 +1,23 @@
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from typing import List, Dict
+from utils.json_handler import parse_json_response
+from utils.pipeline import cancel_tasks, run_pipeline, run_worker_pool
+from utils.pass_controller import PassController
+from utils.continuation import ContinuationChain
+from utils.stream_monitor import prose_monitor, json_monitor
+from utils.chunked_polish import WindowedPolishChain, pass_prompt_tokens
+from utils.paragraph_patch import INSERT_OPS, patch_inputs, expand_inputs, apply_patch_response
+from utils.text_metrics import count_words, estimate_tokens
+from utils.book_writer import BookWriter, stream_to_file
+import utils.project_path  # noqa: F401
+from src.llm import LimitConfig, get_llm, registry
+from typing import List, Dict, Optional
+import argparse
+import asyncio
+import hashlib
 import json
 import logging
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from datetime import datetime
 
@@ -22,16 +34,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# 初始化LLM
-# llm = ChatOpenAI(
+# 初始化LLM，从共享连接池的注册表获取
+# llm = get_llm(
+#     "openai",
 #     model='gpt-4o-2024-11-20',
-#     api_key=os.getenv('OPENAI_API_KEY'),
 #     temperature=1.0,
 #     max_tokens=16384,
 # )
-llm = ChatAnthropic(
+llm = get_llm(
+    "anthropic",
     model='claude-3-5-sonnet-20241022',
-    api_key=os.getenv('ANTHROPIC_API_KEY'),
     temperature=0.75,
     max_tokens=8192,
 )
@@ -140,6 +152,8 @@ content_generation_prompt = ChatPromptTemplate.from_messages([
     章节标题：{chapter_title}
     章节大纲：
     {chapter_outline}
+    前后章节（仅用于衔接，不要写入本章）：
+    {continuity}
     要求字数：{target_words}字
     """)
 ])
@@ -159,6 +173,28 @@ expand_prompt = ChatPromptTemplate.from_messages([
     """)
 ])
 
+# 步骤5（续写模式）：续写式扩展的提示词，原文保持不变，只输出插入的新段落
+expand_insert_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个专业的小说内容创作者。正文已按段落编号，请在指定位置之后插入新的段落来扩展章节，原文一字不改。
+    要求：
+    1. 插入的内容可以是场景描写、对话、动作、神态、心理活动等，增加场景，对话，情感等元素
+    2. 插入的内容要与前后段落自然衔接，不要与后文情节冲突，也不要提前写出后文的情节
+    3. 模仿网文风格，增强代入感
+    4. 可以埋下伏笔，增加悬念
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不要重复或改写原文
+    - 只输出JSON，格式如下：
+    {{"edits": [{{"op": "insert_after", "id": 段落编号, "text": "插入的段落"}}]}}
+    """),
+    ("human", """请扩展以下内容：
+    插入位置（在这些段落之后）：{points}
+    需要补充的字数：约{missing_words}字，每处约{words_per_point}字
+    正文：
+    {paragraphs}
+    """)
+])
+
 # 步骤6：内容优化的提示词
 enhance_prompt = ChatPromptTemplate.from_messages([
     ("system", """你是一个内容优化专家。基于已有内容进行优化和提升。
@@ -175,46 +211,132 @@ enhance_prompt = ChatPromptTemplate.from_messages([
     ("human", "请优化以下内容：\n{content}")
 ])
 
+# 步骤6（分窗口模式）：分窗口优化的提示词，每次只优化章节中的一段连续段落
+enhance_window_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个内容优化专家。基于已有内容进行优化和提升，内容是一个章节中的连续片段，已按段落编号。
+    优化要求：
+    1. 加强细节描写的生动性
+    2. 优化对话的真实感
+    3. 增强情感表达的打动力
+    4. 提升文学性和可读性
+    5. 保持风格的一致性，开头和结尾要能与片段前后的内容衔接
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不需要阐述优化版本的好处/优点
+    - 逐段优化，每段以原编号开头，格式为 [P编号] 优化后的段落
+    - 不要合并、拆分、删除或新增段落，不要输出编号段落以外的内容
+    """),
+    ("human", """请优化以下内容（{part}）：
+    {paragraphs}
+    """)
+])
+
+# 步骤6（补丁模式）：补丁式优化的提示词，只输出需要修改的段落
+enhance_patch_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个内容优化专家。正文已按段落编号，请只改写确实需要优化的段落，不要重新输出全文。
+    优化要求：
+    1. 加强细节描写的生动性
+    2. 优化对话的真实感
+    3. 增强情感表达的打动力
+    4. 提升文学性和可读性
+    5. 保持风格的一致性，改写后的段落要与前后段落自然衔接
+    6. 已标记的段落必须改写，其他段落只在明显需要时才改写，大部分段落应保持不变
+    7. 可以在某段之后插入新段落（如补充对话），段落编号0表示插入到开头
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不需要阐述优化的理由
+    - 只输出JSON，格式如下：
+    {{"edits": [{{"op": "replace", "id": 段落编号, "text": "改写后的段落"}}, {{"op": "insert_after", "id": 段落编号, "text": "插入的段落"}}]}}
+    """),
+    ("human", """请优化以下内容：
+    需要改写的段落：{flagged}
+    发现的问题：{issues}
+    正文：
+    {paragraphs}
+    """)
+])
+
 
 
 class LongTextGenerator:
-    def __init__(self):
+    def __init__(self, expand_mode: str = "insert", enhance_mode: str = "patch"):
+        # 扩展方式：insert 保留原文、只在选定位置插入新段落，rewrite 重新输出全文
+        if expand_mode not in ("insert", "rewrite"):
+            raise ValueError(f"不支持的扩展方式: {expand_mode}")
+        # 优化方式：patch 只输出按段落编号的修改并在本地应用，rewrite 重新输出全文，
+        # window 把章节拆为重叠的段落窗口并行重写后在本地合并
+        if enhance_mode not in ("patch", "rewrite", "window"):
+            raise ValueError(f"不支持的优化方式: {enhance_mode}")
+        self.expand_mode = expand_mode
+        self.enhance_mode = enhance_mode
+        # 决定每章执行哪些扩展、优化步骤
+        self.pass_controller = PassController()
+        
         # 创建各个chain
-        self.book_outline_chain = (
-            book_outline_prompt 
-            | llm 
-            | StrOutputParser()
+        self.book_outline_chain = ContinuationChain(
+            book_outline_prompt,
+            llm
         )
 
-        self.volume_outline_chain = (
-            volume_outline_prompt 
-            | llm 
-            | StrOutputParser()
+        self.volume_outline_chain = ContinuationChain(
+            volume_outline_prompt,
+            llm
         )
 
-        self.chapter_outline_chain = (
-            chapter_outline_prompt 
-            | llm 
-            | StrOutputParser()
+        self.chapter_outline_chain = ContinuationChain(
+            chapter_outline_prompt,
+            llm
+        )
+        self.content_generation_chain = ContinuationChain(
+            content_generation_prompt,
+            llm,
+            monitor=prose_monitor("target_words"),
+            hedge="content_generation"
         )
-        self.content_generation_chain = (
-            content_generation_prompt
-            | llm
-            | StrOutputParser()
+        self.expand_chain = ContinuationChain(
+            expand_prompt,
+            llm,
+            monitor=prose_monitor("target_words")
+        )
+
+        self.expand_insert_chain = ContinuationChain(
+            expand_insert_prompt,
+            llm,
+            monitor=json_monitor
         )
-        self.expand_chain = (
-            expand_prompt 
-            | llm 
-            | StrOutputParser()
+
+        self.enhance_chain = ContinuationChain(
+            enhance_prompt,
+            llm,
+            monitor=prose_monitor(source_key="content")
         )
 
-        self.enhance_chain = (
-            enhance_prompt 
-            | llm 
-            | StrOutputParser()
+        self.enhance_patch_chain = ContinuationChain(
+            enhance_patch_prompt,
+            llm,
+            monitor=json_monitor
         )
 
-    def generate_long_text(self, topic: str, description: str, words: str, chapter_limit: int = None) -> str:
+        self.enhance_window_chain = WindowedPolishChain(ContinuationChain(
+            enhance_window_prompt,
+            llm,
+            monitor=prose_monitor(source_key="paragraphs")
+        ))
+
+    def generate_long_text(self, topic: str, description: str, words: str, chapter_limit: int = None,
+                           pipeline: bool = False, num_workers: int = 2, max_pending: int = 2,
+                           concurrent: bool = False, max_concurrency: int = 5) -> str:
+        if concurrent:
+            # 同一卷的章节并行生成，参见 agenerate_long_text_concurrent
+            return asyncio.run(self.agenerate_long_text_concurrent(
+                topic, description, words, chapter_limit, max_concurrency
+            ))
+        if pipeline:
+            # 大纲与正文流水线并行，参见 agenerate_long_text
+            return asyncio.run(self.agenerate_long_text(
+                topic, description, words, chapter_limit, num_workers, max_pending
+            ))
+            
         logger.info(f"开始为主题「{topic}」生成长文本...")
         logger.info(f"书籍描述：{description}")
         logger.info(f"章节限制：{chapter_limit if chapter_limit else '无'}")
@@ -226,15 +348,7 @@ class LongTextGenerator:
                 "topic": topic,
                 "description": description
             })
-            logger.debug(f"Raw LLM response: {book_outline_json}")
-            
-            # 清理JSON字符串
-            cleaned_json = book_outline_json.replace("```json", "").replace("```", "").strip()
-            book_outline = json.loads(cleaned_json)
-            # 验证JSON结构
-            required_fields = ["main_theme", "description", "volumes"]
-            if not all(field in book_outline for field in required_fields):
-                raise ValueError("Missing required fields in book outline")
+            book_outline = self._parse_book_outline(book_outline_json)
             
         except json.JSONDecodeError as e:
             logger.error(f"JSON parsing error: {e}")
@@ -254,21 +368,15 @@ class LongTextGenerator:
             logger.info(f"开始生成第 {volume['volume_number']} 卷内容...")
             
             # 步骤2：生成分卷章节大纲
-            volume_outline_json = self.volume_outline_chain.invoke({
-                "volume_number": volume["volume_number"],
-                "volume_title": volume["volume_title"],
-                "volume_description": volume["volume_description"],
-                "key_plots": json.dumps(volume["key_plots"], ensure_ascii=False)
-            })
-            cleaned_json = volume_outline_json.replace("```json", "").replace("```", "").strip()
-            volume_outline = json.loads(cleaned_json)
+            volume_outline_json = self.volume_outline_chain.invoke(self._volume_inputs(volume))
+            volume_outline = parse_json_response(volume_outline_json)
             logger.info(f"分卷章节大纲：\n{json.dumps(volume_outline, ensure_ascii=False, indent=2)}")
             
             # 添加卷标题
             full_content.append(f"\n# 第{volume['volume_number']}卷 {volume['volume_title']}\n\n")
             
             # 为每个章节生成内容，但要检查限制
-            for chapter in volume_outline["chapters"]:
+            for chapter_index, chapter in enumerate(volume_outline["chapters"]):
                 # Check if we've reached the limit
                 if chapter_limit and total_chapters >= chapter_limit:
                     logger.info(f"已达到章节限制 {chapter_limit}，停止生成")
@@ -277,27 +385,16 @@ class LongTextGenerator:
                 logger.info(f"生成第 {chapter['chapter_number']} 章内容...")
                 
                 # 步骤3：生成章节详细大纲
-                chapter_outline_json = self.chapter_outline_chain.invoke({
-                    "chapter_title": chapter["chapter_title"],
-                    "plot_points": json.dumps(chapter["plot_points"], ensure_ascii=False),
-                    "word_count": chapter["word_count"]
-                })
-                cleaned_json = chapter_outline_json.replace("```json", "").replace("```", "").strip()
-                chapter_outline = json.loads(cleaned_json)
+                chapter_outline_json = self.chapter_outline_chain.invoke(self._chapter_inputs(chapter))
+                chapter_outline = parse_json_response(chapter_outline_json)
                 logger.info(f"章节详细大纲：\n{json.dumps(chapter_outline, ensure_ascii=False, indent=2)}")
                 
-                # 步骤4：扩展章节内容
-                expanded_content = self.expand_chapter_content(chapter_outline)
-                logger.info(f"章节初始内容已生成，长度：{len(expanded_content)}")
-                logger.info(f"章节内容：\n{expanded_content}")
-                # 步骤5：优化内容
-                enhanced_content = self.enhance_chain.invoke({
-                    "content": expanded_content
-                })
-                logger.info(f"章节内容优化完成，最终长度：{len(enhanced_content)}")
-                logger.info(f"章节内容优化后：\n{enhanced_content}")
+                # 步骤4、5：扩展并优化章节内容
+                chapter_content = self.write_chapter(
+                    chapter_outline, self._continuity(volume_outline["chapters"], chapter_index)
+                )
                 # 添加章节内容
-                full_content.append(f"\n## {chapter['chapter_number']} {chapter['chapter_title']}\n\n{expanded_content}\n\n")
+                full_content.append(f"\n## {chapter['chapter_number']} {chapter['chapter_title']}\n\n{chapter_content}\n\n")
                 
                 total_chapters += 1  # Increment counter
                 
@@ -310,57 +407,466 @@ class LongTextGenerator:
             if chapter_limit and total_chapters >= chapter_limit:
                 break
         
-        # 合并所有内容
+        return self._join_content(full_content)
+        
+    async def agenerate_long_text(self, topic: str, description: str, words: str, chapter_limit: int = None,
+                                  num_workers: int = 2, max_pending: int = 2) -> str:
+        """以流水线方式生成长文本
+        
+        大纲生成作为生产者逐章产出详细大纲，放入有界队列；多个正文任务作为消费者，
+        一章的详细大纲一生成就开始写该章，不必等待后续大纲。队列满时大纲生成暂停。
+        最终文本按章节顺序拼接，与串行生成的结构一致。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            words: 目标字数
+            chapter_limit: 最多生成的章节数
+            num_workers: 同时生成正文的章节数
+            max_pending: 已生成大纲、等待生成正文的最大章节数
+            
+        Returns:
+            str: 生成的长文本
+        """
+        async with self._warmup():
+            logger.info(f"开始为主题「{topic}」流水线生成长文本...")
+            logger.info(f"书籍描述：{description}")
+            logger.info(f"章节限制：{chapter_limit if chapter_limit else '无'}")
+            
+            try:
+                book_outline_json = await self.book_outline_chain.ainvoke({
+                    "topic": topic,
+                    "description": description
+                })
+                book_outline = self._parse_book_outline(book_outline_json)
+            except Exception as e:
+                logger.error(f"Error generating book outline: {e}")
+                raise
+            
+            logger.info(f"书籍大纲：\n{json.dumps(book_outline, ensure_ascii=False, indent=2)}")
+            
+            async def produce_outlines():
+                total_chapters = 0
+                for volume in book_outline["volumes"]:
+                    volume_outline = parse_json_response(
+                        await self.volume_outline_chain.ainvoke(self._volume_inputs(volume))
+                    )
+                    logger.info(f"分卷章节大纲：\n{json.dumps(volume_outline, ensure_ascii=False, indent=2)}")
+                    for chapter_index, chapter in enumerate(volume_outline["chapters"]):
+                        if chapter_limit and total_chapters >= chapter_limit:
+                            logger.info(f"已达到章节限制 {chapter_limit}，停止生成")
+                            return
+                        chapter_outline = parse_json_response(
+                            await self.chapter_outline_chain.ainvoke(self._chapter_inputs(chapter))
+                        )
+                        logger.info(f"章节详细大纲：\n{json.dumps(chapter_outline, ensure_ascii=False, indent=2)}")
+                        continuity = self._continuity(volume_outline["chapters"], chapter_index)
+                        yield volume, chapter, chapter_outline, continuity
+                        total_chapters += 1
+                        
+            async def write_chapter(item):
+                volume, chapter, chapter_outline, continuity = item
+                return volume, chapter, await self.awrite_chapter(chapter_outline, continuity)
+                
+            chapters = await run_pipeline(produce_outlines(), write_chapter, num_workers, max_pending)
+            
+            full_content = []
+            current_volume = None
+            for volume, chapter, chapter_content in chapters:
+                if volume is not current_volume:
+                    full_content.append(f"\n# 第{volume['volume_number']}卷 {volume['volume_title']}\n\n")
+                    current_volume = volume
+                full_content.append(f"\n## {chapter['chapter_number']} {chapter['chapter_title']}\n\n{chapter_content}\n\n")
+                
+            return self._join_content(full_content)
+            
+    async def agenerate_long_text_concurrent(self, topic: str, description: str, words: str,
+                                             chapter_limit: int = None, max_concurrency: int = 5) -> str:
+        """以工作池方式生成长文本
+        
+        逐卷生成章节规划后，同一卷的各章节（详细大纲、正文、优化）在并发上限内并行生成。
+        章节之间的衔接信息取自分卷大纲而不是前一章的正文，因此各章节互不依赖。
+        完成的章节经重排缓冲区按章节顺序写入 full_content。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            words: 目标字数
+            chapter_limit: 最多生成的章节数
+            max_concurrency: 同时生成的最大章节数
+            
+        Returns:
+            str: 生成的长文本
+        """
+        async with self._warmup():
+            logger.info(f"开始为主题「{topic}」并行生成长文本，并发上限：{max_concurrency}")
+            logger.info(f"书籍描述：{description}")
+            logger.info(f"章节限制：{chapter_limit if chapter_limit else '无'}")
+            
+            try:
+                book_outline_json = await self.book_outline_chain.ainvoke({
+                    "topic": topic,
+                    "description": description
+                })
+                book_outline = self._parse_book_outline(book_outline_json)
+            except Exception as e:
+                logger.error(f"Error generating book outline: {e}")
+                raise
+            
+            logger.info(f"书籍大纲：\n{json.dumps(book_outline, ensure_ascii=False, indent=2)}")
+            
+            full_content = []
+            total_chapters = 0
+            
+            for volume in book_outline["volumes"]:
+                if chapter_limit and total_chapters >= chapter_limit:
+                    logger.info(f"已达到章节限制 {chapter_limit}，停止生成")
+                    break
+                logger.info(f"开始生成第 {volume['volume_number']} 卷内容...")
+                
+                volume_outline = parse_json_response(
+                    await self.volume_outline_chain.ainvoke(self._volume_inputs(volume))
+                )
+                logger.info(f"分卷章节大纲：\n{json.dumps(volume_outline, ensure_ascii=False, indent=2)}")
+                all_chapters = volume_outline["chapters"]
+                chapters = all_chapters
+                if chapter_limit:
+                    chapters = chapters[:chapter_limit - total_chapters]
+                    
+                full_content.append(f"\n# 第{volume['volume_number']}卷 {volume['volume_title']}\n\n")
+                
+                async def generate_chapter(chapter_index: int, chapter: Dict) -> str:
+                    logger.info(f"生成第 {chapter['chapter_number']} 章内容...")
+                    chapter_outline = parse_json_response(
+                        await self.chapter_outline_chain.ainvoke(self._chapter_inputs(chapter))
+                    )
+                    chapter_content = await self.awrite_chapter(
+                        chapter_outline, self._continuity(all_chapters, chapter_index)
+                    )
+                    return f"\n## {chapter['chapter_number']} {chapter['chapter_title']}\n\n{chapter_content}\n\n"
+                    
+                await run_worker_pool(chapters, generate_chapter, max_concurrency, on_ready=full_content.append)
+                total_chapters += len(chapters)
+                
+            return self._join_content(full_content)
+            
+    def write_long_text(self, topic: str, description: str, words: str, chapter_limit: int = None,
+                        output_dir: str = "demo/novel_md", resume: bool = False) -> str:
+        """逐章写入磁盘生成长文本，参见 awrite_long_text"""
+        return asyncio.run(self.awrite_long_text(
+            topic, description, words, chapter_limit, output_dir, resume
+        ))
+        
+    async def awrite_long_text(self, topic: str, description: str, words: str, chapter_limit: int = None,
+                               output_dir: str = "demo/novel_md", resume: bool = False) -> str:
+        """逐章写入磁盘生成长文本，支持断点续写
+        
+        与 generate_long_text 的生成顺序相同，但不在内存中累积整本书：章节初稿以流式方式边生成边写入
+        草稿文件，章节完成后立即追加到 book.md，并在运行清单中记录。书籍大纲和分卷章节大纲也记录在清单中，
+        resume 为 True 时沿用清单中的大纲并跳过已完成的章节；否则清空输出目录重新开始。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            words: 目标字数
+            chapter_limit: 最多生成的章节数（包括之前已完成的章节）
+            output_dir: 输出根目录，同一主题、描述的运行使用其下固定的子目录
+            resume: 是否从运行清单继续
+            
+        Returns:
+            str: book.md 的路径
+        """
+        async with self._warmup():
+            writer = BookWriter(os.path.join(output_dir, self.book_run_key(topic, description, words)))
+            if resume and writer.exists():
+                writer.resume()
+            else:
+                if resume:
+                    logger.info("没有找到运行清单，重新开始生成")
+                writer.start({"topic": topic, "description": description, "words": words})
+            logger.info(f"开始为主题「{topic}」生成长文本，输出到 {writer.book_path}")
+            logger.info(f"章节限制：{chapter_limit if chapter_limit else '无'}")
+            
+            book_outline = writer.book_outline
+            if book_outline is None:
+                try:
+                    book_outline = self._parse_book_outline(await self.book_outline_chain.ainvoke({
+                        "topic": topic,
+                        "description": description
+                    }))
+                except Exception as e:
+                    logger.error(f"Error generating book outline: {e}")
+                    raise
+                writer.save_book_outline(book_outline)
+                logger.info(f"书籍大纲：\n{json.dumps(book_outline, ensure_ascii=False, indent=2)}")
+            
+            total_chapters = writer.completed_count
+            for volume_index, volume in enumerate(book_outline["volumes"], 1):
+                if chapter_limit and total_chapters >= chapter_limit:
+                    logger.info(f"已达到章节限制 {chapter_limit}，停止生成")
+                    break
+                
+                volume_outline = writer.volume_outline(volume_index)
+                if volume_outline is None:
+                    logger.info(f"开始生成第 {volume['volume_number']} 卷内容...")
+                    volume_outline = parse_json_response(
+                        await self.volume_outline_chain.ainvoke(self._volume_inputs(volume))
+                    )
+                    writer.save_volume_outline(volume_index, volume_outline)
+                    
+                for chapter_index, chapter in enumerate(volume_outline["chapters"], 1):
+                    if writer.is_completed(volume_index, chapter_index):
+                        continue
+                    if chapter_limit and total_chapters >= chapter_limit:
+                        break
+                    logger.info(f"生成第 {chapter['chapter_number']} 章内容...")
+                    
+                    chapter_outline = parse_json_response(
+                        await self.chapter_outline_chain.ainvoke(self._chapter_inputs(chapter))
+                    )
+                    chapter_content = await self.awrite_chapter(
+                        chapter_outline,
+                        self._continuity(volume_outline["chapters"], chapter_index - 1),
+                        part_path=writer.part_path(volume_index, chapter_index)
+                    )
+                    text = f"\n## {chapter['chapter_number']} {chapter['chapter_title']}\n\n{chapter_content}\n\n"
+                    # 卷标题随该卷第一章一起写入
+                    if chapter_index == 1:
+                        text = f"\n# 第{volume['volume_number']}卷 {volume['volume_title']}\n\n" + text
+                    writer.append_chapter(volume_index, chapter_index, text, count_words(chapter_content))
+                    total_chapters += 1
+            
+            logger.info("长文本生成完成！")
+            logger.info(f"最终文本统计：{writer.completed_count} 章，{writer.word_count} 字")
+            logger.info(f"生成步骤统计：{self.pass_controller.report()}")
+            if registry.response_cache is not None:
+                logger.info(f"响应缓存统计：{registry.response_cache.stats()}")
+            logger.info(f"限流统计：{registry.limiter_stats()}")
+            logger.info(f"对冲请求统计：{registry.hedger.stats()}")
+            return writer.book_path
+            
+    @staticmethod
+    def book_run_key(topic: str, description: str, words: str) -> str:
+        """根据主题、描述和目标字数计算运行目录名，续写时据此找到上一次的运行"""
+        payload = json.dumps([topic, description, words], ensure_ascii=False)
+        return f"book_{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:12]}"
+        
+    @staticmethod
+    def _continuity(chapters: List[Dict], chapter_index: int) -> str:
+        """根据分卷大纲构造前后章节的衔接信息"""
+        lines = []
+        if chapter_index > 0:
+            previous = chapters[chapter_index - 1]
+            lines.append(f"上一章《{previous['chapter_title']}》：{'；'.join(previous.get('plot_points', []))}")
+        if chapter_index + 1 < len(chapters):
+            following = chapters[chapter_index + 1]
+            lines.append(f"下一章《{following['chapter_title']}》：{'；'.join(following.get('plot_points', []))}")
+        return "\n".join(lines) or "无"
+        
+    @staticmethod
+    def _parse_book_outline(book_outline_json: str) -> Dict:
+        """清理并解析书籍大纲，验证必要字段"""
+        logger.debug(f"Raw LLM response: {book_outline_json}")
+        book_outline = parse_json_response(book_outline_json)
+        required_fields = ["main_theme", "description", "volumes"]
+        if not all(field in book_outline for field in required_fields):
+            raise ValueError("Missing required fields in book outline")
+        return book_outline
+        
+    @staticmethod
+    def _volume_inputs(volume: Dict) -> Dict:
+        """构造分卷章节大纲chain的输入"""
+        return {
+            "volume_number": volume["volume_number"],
+            "volume_title": volume["volume_title"],
+            "volume_description": volume["volume_description"],
+            "key_plots": json.dumps(volume["key_plots"], ensure_ascii=False)
+        }
+        
+    @staticmethod
+    def _chapter_inputs(chapter: Dict) -> Dict:
+        """构造章节详细大纲chain的输入"""
+        return {
+            "chapter_title": chapter["chapter_title"],
+            "plot_points": json.dumps(chapter["plot_points"], ensure_ascii=False),
+            "word_count": chapter["word_count"]
+        }
+        
+    @asynccontextmanager
+    async def _warmup(self):
+        """在后台预热共享连接池，与书籍大纲请求同时进行，之后的并行请求不必再建立连接
+        
+        退出时等待预热结束，仍未结束（生成提前出错）时取消，不留下悬空的任务。
+        """
+        task = asyncio.create_task(registry.awarmup())
+        try:
+            yield
+        finally:
+            await cancel_tasks([task])
+        
+    def _join_content(self, full_content: List[str]) -> str:
+        """合并所有章节内容并输出统计"""
         final_text = "".join(full_content)
         logger.info("长文本生成完成！")
         
-        # 计算字数
+        # 计算字数：中文按字、英文按词统计
         char_count = len(final_text)
-        word_count = len(final_text.split())
-        logger.info(f"最终文本统计：{char_count} 字符，约 {word_count} 个词")
+        word_count = count_words(final_text)
+        logger.info(f"最终文本统计：{char_count} 字符，{word_count} 字，约 {estimate_tokens(final_text)} tokens")
+        logger.info(f"生成步骤统计：{self.pass_controller.report()}")
+        if registry.response_cache is not None:
+            logger.info(f"响应缓存统计：{registry.response_cache.stats()}")
+        logger.info(f"限流统计：{registry.limiter_stats()}")
+        logger.info(f"对冲请求统计：{registry.hedger.stats()}")
         
         return final_text
-
-    def expand_chapter_content(self, chapter_outline: dict, target_words: int = 3000) -> str:
+        
+    def _expand_chain(self, content: str, target_words: int):
+        """返回扩展步骤使用的chain、输入，以及把模型回复转换为正文的函数
+        
+        续写模式下原文保持不变，模型只返回在选定位置（对话之后、均匀分布在全章）插入的新段落，
+        输出token只和补充的字数有关。
+        """
+        if self.expand_mode == "rewrite":
+            return self.expand_chain, {"scenes": content, "target_words": target_words}, lambda response: response
+        paragraphs, chain_input = expand_inputs(content, target_words)
+        return (self.expand_insert_chain, chain_input,
+                lambda response: apply_patch_response(content, paragraphs, response, INSERT_OPS))
+        
+    def _enhance_chain(self, content: str):
+        """返回优化步骤使用的chain、输入，以及把模型回复转换为正文的函数
+        
+        补丁模式下模型只返回被标记段落（以及它认为需要修改的段落）的修改，在本地应用到原文，
+        输出token只和修改的段落有关，而不是整章。
+        """
+        if self.enhance_mode == "rewrite":
+            return self.enhance_chain, {"content": content}, lambda response: response
+        if self.enhance_mode == "window":
+            return self.enhance_window_chain, content, lambda response: response
+        paragraphs, chain_input = patch_inputs(
+            content,
+            self.pass_controller.flag_paragraphs(content),
+            self.pass_controller.quality_issues(content)
+        )
+        return (self.enhance_patch_chain, chain_input,
+                lambda response: apply_patch_response(content, paragraphs, response))
+        
+    def write_chapter(self, chapter_outline: dict, continuity: str = "无", target_words: int = 3000) -> str:
+        """基于章节详细大纲生成章节内容，内容质量有问题时再优化"""
+        content = self.expand_chapter_content(chapter_outline, target_words, continuity)
+        logger.info(f"章节内容：\n{content}")
+        if not self.pass_controller.should_run("enhance", content):
+            self.pass_controller.record_skip("enhance", content)
+            return content
+        
+        chain, chain_input, to_content = self._enhance_chain(content)
+        response = chain.invoke(chain_input)
+        self.pass_controller.record_run("enhance", content, response, pass_prompt_tokens(chain, content))
+        enhanced_content = to_content(response)
+        logger.info(f"章节内容优化完成，最终字数：{count_words(enhanced_content)}")
+        logger.info(f"章节内容优化后：\n{enhanced_content}")
+        return enhanced_content
+        
+    async def awrite_chapter(self, chapter_outline: dict, continuity: str = "无", target_words: int = 3000,
+                             part_path: Optional[str] = None) -> str:
+        """异步生成章节内容，参见 write_chapter；指定 part_path 时初稿边生成边写入该文件"""
+        content = await self.aexpand_chapter_content(chapter_outline, target_words, continuity, part_path)
+        if not self.pass_controller.should_run("enhance", content):
+            self.pass_controller.record_skip("enhance", content)
+            return content
+        
+        chain, chain_input, to_content = self._enhance_chain(content)
+        response = await chain.ainvoke(chain_input)
+        self.pass_controller.record_run("enhance", content, response, pass_prompt_tokens(chain, content))
+        enhanced_content = to_content(response)
+        logger.info(f"章节内容优化完成，最终字数：{count_words(enhanced_content)}")
+        return enhanced_content
+        
+    def expand_chapter_content(self, chapter_outline: dict, target_words: int = 3000,
+                               continuity: str = "无") -> str:
         """Generate chapter content with length control"""
         logger.info(f"开始生成章节内容，目标字数：{target_words}")
         
         # 首先使用content_generation_chain生成初始内容
-        initial_content = self.content_generation_chain.invoke({
+        generation_inputs = {
             "chapter_title": chapter_outline["chapter_title"],
             "chapter_outline": json.dumps(chapter_outline, ensure_ascii=False, indent=2),
+            "continuity": continuity,
             "target_words": target_words
-        })
-        
-        current_length = len(initial_content)
-        logger.info(f"初始内容生成完成，当前字数：{current_length}")
+        }
+        initial_content = self.content_generation_chain.invoke(generation_inputs)
+        self.pass_controller.record_run("generate", generation_inputs["chapter_outline"], initial_content,
+                                        self.content_generation_chain.prompt_tokens)
+        logger.info(f"初始内容生成完成，当前字数：{count_words(initial_content)}")
         logger.info(f"初始内容：\n{initial_content}")
-
-        # 如果内容长度不足，使用expand_chain扩展
-        if current_length < target_words:
-            logger.info("内容长度不足，开始扩展...")
-            expanded_content = self.expand_chain.invoke({
-                "scenes": initial_content
-            })
-            current_length = len(expanded_content)
-            logger.info(f"内容扩展完成，当前字数：{current_length}")
-            logger.info(f"扩展内容：\n{expanded_content}")
-            # 如果扩展后仍不足，使用enhance_chain优化
-            if current_length < target_words:
-                logger.info("内容仍需优化...")
-                final_content = self.enhance_chain.invoke({
-                    "content": expanded_content
-                })
-                logger.info(f"内容优化完成，最终字数：{len(final_content)}")
-                logger.info(f"优化内容：\n{final_content}")
-                return final_content
-            return expanded_content
         
-        return initial_content
-
-import os
+        # 字数明显不足时才使用expand_chain扩展
+        if not self.pass_controller.should_run("expand", initial_content, target_words):
+            self.pass_controller.record_skip("expand", initial_content, target_words)
+            return initial_content
+        
+        chain, chain_input, to_content = self._expand_chain(initial_content, target_words)
+        response = chain.invoke(chain_input)
+        self.pass_controller.record_run("expand", initial_content, response, chain.prompt_tokens)
+        expanded_content = to_content(response)
+        logger.info(f"内容扩展完成，当前字数：{count_words(expanded_content)}")
+        logger.info(f"扩展内容：\n{expanded_content}")
+        return expanded_content
+        
+    async def aexpand_chapter_content(self, chapter_outline: dict, target_words: int = 3000,
+                                      continuity: str = "无", part_path: Optional[str] = None) -> str:
+        """异步生成章节内容，长度控制逻辑与 expand_chapter_content 相同
+        
+        指定 part_path 时以流式方式生成初稿，每收到一段就写入该文件。
+        """
+        logger.info(f"开始生成章节内容，目标字数：{target_words}")
+        
+        generation_inputs = {
+            "chapter_title": chapter_outline["chapter_title"],
+            "chapter_outline": json.dumps(chapter_outline, ensure_ascii=False, indent=2),
+            "continuity": continuity,
+            "target_words": target_words
+        }
+        if part_path is None:
+            initial_content = await self.content_generation_chain.ainvoke(generation_inputs)
+        else:
+            initial_content = await stream_to_file(
+                self.content_generation_chain.astream(generation_inputs), part_path
+            )
+        self.pass_controller.record_run("generate", generation_inputs["chapter_outline"], initial_content,
+                                        self.content_generation_chain.prompt_tokens)
+        logger.info(f"初始内容生成完成，当前字数：{count_words(initial_content)}")
+        
+        if not self.pass_controller.should_run("expand", initial_content, target_words):
+            self.pass_controller.record_skip("expand", initial_content, target_words)
+            return initial_content
+        
+        chain, chain_input, to_content = self._expand_chain(initial_content, target_words)
+        response = await chain.ainvoke(chain_input)
+        self.pass_controller.record_run("expand", initial_content, response, chain.prompt_tokens)
+        expanded_content = to_content(response)
+        logger.info(f"内容扩展完成，当前字数：{count_words(expanded_content)}")
+        return expanded_content
 
 def main():
+    parser = argparse.ArgumentParser(description="长文本小说生成")
+    parser.add_argument("--resume", action="store_true", help="从上一次运行的清单继续，跳过已完成的章节")
+    parser.add_argument("--chapter-limit", type=int, default=1, help="最多生成的章节数")
+    parser.add_argument("--output-dir", default="demo/novel_md", help="输出根目录")
+    parser.add_argument("--cache-path", default="demo/cache/llm_cache.db",
+                        help="模型响应缓存文件，重跑时相同的请求直接使用缓存的响应")
+    parser.add_argument("--no-cache", action="store_true", help="不使用模型响应缓存")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="账户每分钟请求数上限，超过时排队等待；不设置时不限速，只在被拒绝（429/529）时退避")
+    parser.add_argument("--tpm", type=int, default=None,
+                        help="账户每分钟token数上限（输入+输出），超过时排队等待；不设置时不限速")
+    args = parser.parse_args()
+    
+    if not args.no_cache:
+        registry.enable_cache(args.cache_path)
+    if args.rpm or args.tpm:
+        registry.set_limits("anthropic", LimitConfig(requests_per_minute=args.rpm, tokens_per_minute=args.tpm))
+    
     # 记录开始时间
     start_time = datetime.now()
     logger.info(f"开始运行时间: {start_time}")
@@ -369,19 +875,11 @@ def main():
     topic = "龙傲天重生录"
     description = """故事题材为都市玄幻，大致讲述一个名叫龙傲天的主角重生在有超能力的都市，但他的超能力很弱，凭借着前世的智慧，一步步成为这个世界最强者的故事。可以分成5卷，每一卷都由多个章节组成，一个章节至少3000字，请开始书写第一章和第二章的内容。"""
     words = "3000"
-    chapter_limit = 1  # Limit to first 2 chapters
-    
-    result = generator.generate_long_text(topic, description, words, chapter_limit)
-    
-    # Save result
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_dir = "demo/novel_md"
-    os.makedirs(output_dir, exist_ok=True)  # Create directory if it doesn't exist
-    output_file = os.path.join(output_dir, f"novel_{timestamp}.md")
     
-    # 将结果保存到文件
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(result)
+    # 章节完成后立即写入文件，中断后可用 --resume 继续
+    output_file = generator.write_long_text(
+        topic, description, words, args.chapter_limit, args.output_dir, args.resume
+    )
     
     # 记录结束时间和总用时
     end_time = datetime.now()
@@ -1,13 +1,26 @@
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from prompts_utils.outline_prompts import book_outline_prompt, volume_outline_prompt, chapter_outline_prompt
+from utils.continuation import ContinuationChain
+from utils.file_handler import FileHandler
+from utils.json_handler import JsonArrayStreamParser, parse_json_response
+from utils.outline_store import OutlineStore, find_index_by_number
+from utils.pipeline import cancel_tasks
+from utils.text_metrics import estimate_tokens
+import utils.project_path  # noqa: F401
+from src.llm import get_llm, refresh_cache
+from outline_models import BookOutline, VolumeChapters, ChapterScenes, ChapterScenesBatch, outline_to_dict
+from pydantic import BaseModel
+from prompts_utils.outline_prompts import (
+    book_outline_prompt, volume_outline_prompt, chapter_outline_prompt,
+    batch_chapter_outline_prompt, OUTLINE_PROMPT_VERSION
+)
+import asyncio
+import hashlib
 import json
 import logging
 import os
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 
 # 配置日志
 logging.basicConfig(
@@ -20,41 +33,247 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class LazyOutline:
+    """按需展开的小说大纲
+    
+    创建时只包含书籍大纲，分卷的章节列表和章节的详细大纲在第一次被访问时才调用模型生成，
+    已展开的节点直接复用。生成单个章节只需要书籍、分卷、章节三次调用。
+    指定分片存储时，节点优先从存储中读取，新展开的节点只写入对应的分片。
+    """
+    
+    def __init__(self, generator: "OutlineGenerator", book_outline: Dict,
+                 store: Optional[OutlineStore] = None):
+        """初始化按需展开的大纲
+        
+        Args:
+            generator: 用于展开节点的大纲生成器
+            book_outline: 书籍大纲字典，可以是之前已部分展开的大纲
+            store: 大纲分片存储，为None时不读写磁盘
+        """
+        self.generator = generator
+        self.book_outline = book_outline
+        self.store = store
+        
+    def _find_volume(self, volume_number: int):
+        """按卷号查找分卷，返回分卷序号（从1开始）和分卷字典"""
+        volumes = self.book_outline["volumes"]
+        volume_index = find_index_by_number(volumes, "volume_number", volume_number)
+        if volume_index is None:
+            raise ValueError(f"未找到第 {volume_number} 卷")
+        return volume_index + 1, volumes[volume_index]
+        
+    @staticmethod
+    def _find_chapter(volume: Dict, volume_number: int, chapter_number: int):
+        """在已展开的分卷中查找章节，返回章节序号（从1开始）和章节字典"""
+        chapter_index = find_index_by_number(volume["chapters"], "chapter_number", chapter_number)
+        if chapter_index is None:
+            raise ValueError(f"未找到第 {volume_number} 卷第 {chapter_number} 章")
+        return chapter_index + 1, volume["chapters"][chapter_index]
+        
+    def _restore_volume(self, volume_index: int, volume: Dict) -> bool:
+        """从分片存储恢复分卷的章节列表，成功时返回True"""
+        stored = self.store.read_volume(volume_index) if self.store else None
+        if stored is None:
+            return False
+        volume.update(stored)
+        return True
+        
+    def _expand_volume(self, volume_index: int, volume: Dict, volume_outline: Dict):
+        """合并新生成的分卷章节大纲并写入分片存储"""
+        volume.update(volume_outline)
+        if self.store:
+            self.store.save_volume(volume_index, volume)
+            
+    def _restore_chapter(self, volume_index: int, chapter_index: int, chapter: Dict) -> bool:
+        """从分片存储恢复章节详细大纲，成功时返回True"""
+        stored = self.store.read_chapter(volume_index, chapter_index) if self.store else None
+        if stored is None:
+            return False
+        chapter.update(stored)
+        return True
+        
+    def _expand_chapter(self, volume_index: int, chapter_index: int, chapter: Dict, chapter_outline: Dict):
+        """合并新生成的章节详细大纲并写入分片存储"""
+        chapter.update(chapter_outline)
+        if self.store:
+            self.store.save_chapter(volume_index, chapter_index, chapter)
+            
+    def get_volume(self, volume_number: int) -> Dict:
+        """获取分卷大纲，首次访问时生成该卷的章节列表
+        
+        Args:
+            volume_number: 卷号
+            
+        Returns:
+            Dict: 包含章节列表的分卷字典
+        """
+        volume_index, volume = self._find_volume(volume_number)
+        if "chapters" not in volume and not self._restore_volume(volume_index, volume):
+            self._expand_volume(volume_index, volume, self.generator.generate_volume_outline(volume))
+        return volume
+        
+    def get_chapter(self, volume_number: int, chapter_number: int) -> Dict:
+        """获取章节大纲，首次访问时生成该章的详细大纲
+        
+        Args:
+            volume_number: 卷号
+            chapter_number: 章节号
+            
+        Returns:
+            Dict: 包含场景列表的章节字典
+        """
+        volume = self.get_volume(volume_number)
+        volume_index, _ = self._find_volume(volume_number)
+        chapter_index, chapter = self._find_chapter(volume, volume_number, chapter_number)
+        if "scenes" not in chapter and not self._restore_chapter(volume_index, chapter_index, chapter):
+            self._expand_chapter(
+                volume_index, chapter_index, chapter, self.generator.generate_chapter_outline(chapter)
+            )
+        return chapter
+        
+    async def aget_volume(self, volume_number: int) -> Dict:
+        """异步获取分卷大纲，参见 get_volume"""
+        volume_index, volume = self._find_volume(volume_number)
+        if "chapters" not in volume and not self._restore_volume(volume_index, volume):
+            self._expand_volume(volume_index, volume, await self.generator.agenerate_volume_outline(volume))
+        return volume
+        
+    async def aget_chapter(self, volume_number: int, chapter_number: int) -> Dict:
+        """异步获取章节大纲，参见 get_chapter"""
+        volume = await self.aget_volume(volume_number)
+        volume_index, _ = self._find_volume(volume_number)
+        chapter_index, chapter = self._find_chapter(volume, volume_number, chapter_number)
+        if "scenes" not in chapter and not self._restore_chapter(volume_index, chapter_index, chapter):
+            self._expand_chapter(
+                volume_index, chapter_index, chapter, await self.generator.agenerate_chapter_outline(chapter)
+            )
+        return chapter
+        
+    def to_dict(self) -> Dict:
+        """返回当前已加载部分的大纲字典"""
+        return self.book_outline
+
 class OutlineGenerator:
     """大纲生成器类，负责生成和管理小说大纲"""
     
-    def __init__(self, model_name: str = "claude-3-5-sonnet-20241022"):
+    # 单个章节详细大纲的输出token数初始估计，批量生成时根据实际响应调整
+    CHAPTER_OUTLINE_TOKENS = 1500
+    # 批量请求的预计输出最多占用 max_tokens 的比例，留出余量避免截断
+    BATCH_OUTPUT_RATIO = 0.8
+    
+    def __init__(self, model_name: str = "claude-3-5-sonnet-20241022",
+                 cache_dir: str = "demo/outlines/cache", base_dir: str = "demo",
+                 structured_output: bool = False, max_parse_retries: int = 1,
+                 max_chapter_batch_size: int = 8):
         """初始化大纲生成器
         
         Args:
             model_name: 使用的模型名称
+            cache_dir: 大纲缓存目录
+            base_dir: 基础目录，断点文件保存在其下的 checkpoints 目录
+            structured_output: 是否通过工具调用直接返回结构化大纲
+            max_parse_retries: 本地修复后仍无法解析时重新请求模型的次数
+            max_chapter_batch_size: 批量生成章节详细大纲时单次请求包含的最多章节数
         """
-        self.llm = ChatAnthropic(
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.file_handler = FileHandler(base_dir)
+        self.structured_output = structured_output
+        self.max_parse_retries = max_parse_retries
+        self.max_chapter_batch_size = max_chapter_batch_size
+        self.max_tokens = 8192
+        self._chapter_outline_tokens = self.CHAPTER_OUTLINE_TOKENS
+        self.llm = get_llm(
+            "anthropic",
+            model=model_name,
+            temperature=0.75,
+            max_tokens=self.max_tokens,
+        )
+        # 结构化输出不经过 ContinuationChain，由模型自身的缓存层读写响应缓存
+        self.structured_llm = get_llm(
+            "anthropic",
             model=model_name,
-            api_key=os.getenv('ANTHROPIC_API_KEY'),
+            cache=True,
             temperature=0.75,
-            max_tokens=8192,
+            max_tokens=self.max_tokens,
         )
         logger.info(f"大纲生成器初始化完成，使用模型: {model_name}")
         
         # 初始化chain
-        self.book_outline_chain = (
-            book_outline_prompt 
-            | self.llm 
-            | StrOutputParser()
-        )
+        self.book_outline_chain = self._build_chain(book_outline_prompt, BookOutline)
+        self.volume_outline_chain = self._build_chain(volume_outline_prompt, VolumeChapters)
+        self.chapter_outline_chain = self._build_chain(chapter_outline_prompt, ChapterScenes)
+        self.batch_chapter_outline_chain = self._build_chain(batch_chapter_outline_prompt, ChapterScenesBatch)
         
-        self.volume_outline_chain = (
-            volume_outline_prompt 
-            | self.llm 
-            | StrOutputParser()
-        )
+    def _build_chain(self, prompt: ChatPromptTemplate, schema: type):
+        """构建大纲chain，结构化输出模式下由模型以工具调用返回 schema 对应的结构"""
+        if self.structured_output:
+            return prompt | self.structured_llm.with_structured_output(schema)
+        return ContinuationChain(prompt, self.llm)
         
-        self.chapter_outline_chain = (
-            chapter_outline_prompt 
-            | self.llm 
-            | StrOutputParser()
-        )
+    @staticmethod
+    def _parse_outline(response, schema: type) -> Dict:
+        """把chain的返回结果校验为大纲模型并转换为字典
+        
+        response 可以是结构化输出返回的模型对象，也可以是文本；文本会先经过本地修复再校验。
+        """
+        if isinstance(response, BaseModel):
+            outline = schema.model_validate(response.model_dump(exclude_unset=True))
+        elif isinstance(response, dict):
+            outline = schema.model_validate(response)
+        else:
+            outline = schema.model_validate(parse_json_response(response))
+        return outline_to_dict(outline)
+        
+    def _parse_book_outline(self, response) -> Dict:
+        """解析并校验书籍大纲"""
+        return self._parse_outline(response, BookOutline)
+        
+    def _invoke_outline(self, chain, chain_input: Dict, schema: type) -> Dict:
+        """调用chain并解析大纲，本地修复后仍无法解析时才重新请求模型
+        
+        重新请求时跳过响应缓存，否则会再次拿到同一个无法解析的响应；新的响应覆盖缓存中的旧响应。
+        """
+        for attempt in range(self.max_parse_retries + 1):
+            try:
+                with refresh_cache() if attempt else nullcontext():
+                    response = chain.invoke(chain_input)
+                return self._parse_outline(response, schema)
+            except ValueError as e:
+                if attempt == self.max_parse_retries:
+                    raise
+                logger.warning(f"大纲解析失败，重新请求模型（第 {attempt + 1} 次）: {e}")
+                
+    async def _ainvoke_outline(self, chain, chain_input: Dict, schema: type, refresh: bool = False) -> Dict:
+        """异步调用chain并解析大纲，参见 _invoke_outline；refresh 为True时第一次请求也跳过响应缓存"""
+        for attempt in range(self.max_parse_retries + 1):
+            try:
+                with refresh_cache() if attempt or refresh else nullcontext():
+                    response = await chain.ainvoke(chain_input)
+                return self._parse_outline(response, schema)
+            except ValueError as e:
+                if attempt == self.max_parse_retries:
+                    raise
+                logger.warning(f"大纲解析失败，重新请求模型（第 {attempt + 1} 次）: {e}")
+                
+    @staticmethod
+    def _volume_inputs(volume: Dict) -> Dict:
+        """构造分卷大纲chain的输入"""
+        return {
+            "volume_number": volume["volume_number"],
+            "volume_title": volume.get("volume_title", ""),
+            "volume_description": volume.get("volume_description", ""),
+            "key_plots": json.dumps(volume.get("key_plots", []), ensure_ascii=False)
+        }
+        
+    @staticmethod
+    def _chapter_inputs(chapter: Dict) -> Dict:
+        """构造章节大纲chain的输入"""
+        return {
+            "chapter_title": chapter["chapter_title"],
+            "plot_points": json.dumps(chapter.get("plot_points", []), ensure_ascii=False),
+            "word_count": chapter.get("word_count", "")
+        }
         
     def generate_book_outline(self, topic: str, description: str) -> Dict:
         """生成书籍整体大纲
@@ -69,20 +288,11 @@ class OutlineGenerator:
         logger.info(f"开始生成书籍大纲 - 主题: {topic}")
         try:
             # 生成大纲
-            outline_json = self.book_outline_chain.invoke({
-                "topic": topic,
-                "description": description
-            })
-            
-            # 清理和解析JSON
-            cleaned_json = outline_json.replace("```json", "").replace("```", "").strip()
-            book_outline = json.loads(cleaned_json)
-            
-            # 验证JSON结构
-            required_fields = ["main_theme", "description", "volumes"]
-            if not all(field in book_outline for field in required_fields):
-                raise ValueError("书籍大纲缺少必要字段")
-                
+            book_outline = self._invoke_outline(
+                self.book_outline_chain,
+                {"topic": topic, "description": description},
+                BookOutline
+            )
             logger.info("书籍大纲生成成功")
             return book_outline
             
@@ -101,15 +311,9 @@ class OutlineGenerator:
         """
         logger.info(f"开始生成第 {volume['volume_number']} 卷章节大纲")
         try:
-            volume_outline_json = self.volume_outline_chain.invoke({
-                "volume_number": volume["volume_number"],
-                "volume_title": volume["volume_title"],
-                "volume_description": volume["volume_description"],
-                "key_plots": json.dumps(volume["key_plots"], ensure_ascii=False)
-            })
-            
-            cleaned_json = volume_outline_json.replace("```json", "").replace("```", "").strip()
-            volume_outline = json.loads(cleaned_json)
+            volume_outline = self._invoke_outline(
+                self.volume_outline_chain, self._volume_inputs(volume), VolumeChapters
+            )
             
             logger.info(f"第 {volume['volume_number']} 卷章节大纲生成成功")
             return volume_outline
@@ -129,14 +333,9 @@ class OutlineGenerator:
         """
         logger.info(f"开始生成章节详细大纲 - {chapter['chapter_title']}")
         try:
-            chapter_outline_json = self.chapter_outline_chain.invoke({
-                "chapter_title": chapter["chapter_title"],
-                "plot_points": json.dumps(chapter["plot_points"], ensure_ascii=False),
-                "word_count": chapter["word_count"]
-            })
-            
-            cleaned_json = chapter_outline_json.replace("```json", "").replace("```", "").strip()
-            chapter_outline = json.loads(cleaned_json)
+            chapter_outline = self._invoke_outline(
+                self.chapter_outline_chain, self._chapter_inputs(chapter), ChapterScenes
+            )
             
             logger.info(f"章节详细大纲生成成功 - {chapter['chapter_title']}")
             return chapter_outline
@@ -145,18 +344,128 @@ class OutlineGenerator:
             logger.error(f"生成章节详细大纲时出错: {e}")
             raise
             
-    def save_outline(self, outline: Dict, output_dir: str = "demo/outlines") -> str:
+    def chapter_batch_size(self) -> int:
+        """根据单章详细大纲的预计输出长度计算每批章节数，使整批输出不超过 max_tokens"""
+        budget = int(self.max_tokens * self.BATCH_OUTPUT_RATIO)
+        return max(1, min(self.max_chapter_batch_size, budget // self._chapter_outline_tokens))
+        
+    def _observe_chapter_tokens(self, batch_outline: Dict, chapter_count: int):
+        """根据实际响应更新单章输出长度估计，取平滑值与本次值中较大者"""
+        observed = estimate_tokens(json.dumps(batch_outline, ensure_ascii=False)) // max(chapter_count, 1)
+        smoothed = (self._chapter_outline_tokens + observed) // 2
+        self._chapter_outline_tokens = max(smoothed, observed, 1)
+        
+    @staticmethod
+    def _batch_inputs(chapters: List[Dict]) -> Dict:
+        """构造批量章节大纲chain的输入，chapter_key 为章节在本批中的序号"""
+        return {
+            "chapters": json.dumps([
+                {
+                    "chapter_key": str(i),
+                    "chapter_title": chapter["chapter_title"],
+                    "plot_points": chapter.get("plot_points", []),
+                    "word_count": chapter.get("word_count", "")
+                }
+                for i, chapter in enumerate(chapters, 1)
+            ], ensure_ascii=False, indent=2)
+        }
+        
+    def _split_batch(self, chapters: List[Dict], batch_outline: Dict) -> List[Optional[Dict]]:
+        """按 chapter_key 把批量结果拆回各章节，缺失的章节对应 None"""
+        self._observe_chapter_tokens(batch_outline, len(chapters))
+        by_key = {}
+        for item in batch_outline["chapters"]:
+            item = dict(item)
+            by_key[str(item.pop("chapter_key")).strip()] = item
+        return [by_key.get(str(i)) for i in range(1, len(chapters) + 1)]
+        
+    def generate_chapter_outlines_batch(self, chapters: List[Dict],
+                                        on_complete: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
+        """批量生成章节详细大纲
+        
+        每次请求打包多个章节的剧情推进点，返回按 chapter_key 标记的结果后拆回各章节。
+        每批章节数按已观察到的单章输出长度动态调整；模型漏掉的章节单独补生成。
+        
+        Args:
+            chapters: 章节信息字典列表
+            on_complete: 单个章节完成后的回调，参数为序号和结果
+            
+        Returns:
+            List[Dict]: 与输入顺序一致的章节详细大纲列表
+        """
+        results = []
+        while len(results) < len(chapters):
+            start = len(results)
+            batch = chapters[start:start + self.chapter_batch_size()]
+            logger.info(f"开始批量生成章节详细大纲 - 第 {start + 1} 至 {start + len(batch)} 章")
+            try:
+                batch_outline = self._invoke_outline(
+                    self.batch_chapter_outline_chain, self._batch_inputs(batch), ChapterScenesBatch
+                )
+            except Exception as e:
+                logger.error(f"批量生成章节详细大纲时出错: {e}")
+                raise
+                
+            for offset, (chapter, chapter_outline) in enumerate(zip(batch, self._split_batch(batch, batch_outline))):
+                if chapter_outline is None:
+                    logger.warning(f"批量结果缺少章节，单独生成 - {chapter['chapter_title']}")
+                    chapter_outline = self.generate_chapter_outline(chapter)
+                if on_complete:
+                    on_complete(start + offset, chapter_outline)
+                results.append(chapter_outline)
+        return results
+        
+    def lazy_outline(self, topic: str, description: str,
+                     use_cache: bool = True, refresh: bool = False) -> LazyOutline:
+        """返回按需展开的大纲对象
+        
+        启用缓存时优先复用相同主题和描述的已缓存大纲。缓存按分片存储，
+        打开时只读取索引，访问到的分卷和章节才从分片读取，新展开的节点只写入对应分片。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            use_cache: 是否读写大纲缓存
+            refresh: 是否丢弃已有缓存重新生成
+            
+        Returns:
+            LazyOutline: 按需展开大纲
+        """
+        if not use_cache:
+            return LazyOutline(self, self.generate_book_outline(topic, description))
+            
+        if refresh:
+            self.invalidate_outline_cache(topic, description)
+            
+        store = self.outline_cache_store(topic, description)
+        if store.exists():
+            logger.info(f"复用已缓存的大纲: {store.root}")
+        else:
+            store.save_book(self.generate_book_outline(topic, description))
+            
+        return LazyOutline(self, store.get_book(), store=store)
+        
+    def save_outline(self, outline: Dict, output_dir: str = "demo/outlines",
+                     sharded: bool = False) -> str:
         """保存大纲到文件
         
         Args:
             outline: 大纲字典
             output_dir: 输出目录
+            sharded: 是否按分卷、章节分片保存为目录，章节很多时读取单章不必加载整本大纲
             
         Returns:
-            str: 保存的文件路径
+            str: 保存的文件路径，分片保存时为目录路径
         """
         os.makedirs(output_dir, exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        if sharded:
+            dirpath = os.path.join(output_dir, f"outline_{timestamp}")
+            OutlineStore(dirpath, OUTLINE_PROMPT_VERSION).save(outline)
+            logger.info(f"大纲已分片保存到: {dirpath}")
+            return dirpath
+            
         filename = f"outline_{timestamp}.json"
         filepath = os.path.join(output_dir, filename)
         
@@ -170,48 +479,667 @@ class OutlineGenerator:
         """从文件加载大纲
         
         Args:
-            filepath: 大纲文件路径
+            filepath: 大纲文件路径，也可以是分片保存的大纲目录
             
         Returns:
             Dict: 大纲字典
         """
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                outline = json.load(f)
+            if os.path.isdir(filepath):
+                outline = OutlineStore(filepath).load()
+            else:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    outline = json.load(f)
             logger.info(f"成功加载大纲: {filepath}")
             return outline
         except Exception as e:
             logger.error(f"加载大纲文件时出错: {e}")
             raise
             
+    def outline_cache_key(self, topic: str, description: str) -> str:
+        """计算大纲缓存键
+        
+        缓存键由主题、描述、模型名称和提示词版本共同决定，任一变化都会得到新的缓存。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            
+        Returns:
+            str: 缓存键
+        """
+        payload = json.dumps({
+            "topic": topic,
+            "description": description,
+            "model": self.model_name,
+            "prompt_version": OUTLINE_PROMPT_VERSION
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        
+    def get_cached_outline_path(self, topic: str, description: str) -> str:
+        """获取大纲缓存目录路径
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            
+        Returns:
+            str: 缓存目录路径
+        """
+        key = self.outline_cache_key(topic, description)
+        return os.path.join(self.cache_dir, f"outline_{key}")
+        
+    def outline_cache_store(self, topic: str, description: str) -> OutlineStore:
+        """获取大纲缓存的分片存储
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            
+        Returns:
+            OutlineStore: 缓存目录对应的分片存储
+        """
+        return OutlineStore(self.get_cached_outline_path(topic, description), OUTLINE_PROMPT_VERSION)
+        
+    def load_cached_outline(self, topic: str, description: str) -> Optional[Dict]:
+        """读取已缓存的完整大纲
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            
+        Returns:
+            Optional[Dict]: 缓存的大纲，不存在时返回None
+        """
+        store = self.outline_cache_store(topic, description)
+        if not store.exists():
+            return None
+        outline = store.load()
+        logger.info(f"复用已缓存的大纲: {store.root}")
+        return outline
+        
+    def save_cached_outline(self, topic: str, description: str, outline: Dict) -> str:
+        """写入大纲缓存
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            outline: 大纲字典
+            
+        Returns:
+            str: 缓存目录路径
+        """
+        store = self.outline_cache_store(topic, description)
+        store.save(outline)
+        logger.debug(f"大纲缓存已更新: {store.root}")
+        return store.root
+        
+    def invalidate_outline_cache(self, topic: str, description: str) -> bool:
+        """删除指定主题和描述的大纲缓存
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            
+        Returns:
+            bool: 是否删除了缓存
+        """
+        store = self.outline_cache_store(topic, description)
+        if store.exists():
+            store.clear()
+            logger.info(f"已删除大纲缓存: {store.root}")
+            return True
+        return False
+        
+    def rebuild_outline(self, outline_dir: str, max_concurrency: int = 5,
+                        batch_chapters: bool = False) -> Dict:
+        """增量重建分片保存的大纲
+        
+        修改索引中的书籍描述、分卷剧情点，或分卷分片中的章节规划后调用，
+        只重新生成输入哈希发生变化的节点，其余节点直接复用磁盘上的分片。
+        
+        Args:
+            outline_dir: 分片大纲目录
+            max_concurrency: 同时进行的最大请求数
+            batch_chapters: 是否每次请求打包多个章节生成详细大纲
+            
+        Returns:
+            Dict: 重建后的完整大纲字典
+        """
+        return asyncio.run(self.arebuild_outline(outline_dir, max_concurrency, batch_chapters))
+        
+    async def arebuild_outline(self, outline_dir: str, max_concurrency: int = 5,
+                               batch_chapters: bool = False) -> Dict:
+        """增量重建分片保存的大纲，参见 rebuild_outline"""
+        store = OutlineStore(outline_dir, OUTLINE_PROMPT_VERSION)
+        book_outline = store.get_book()
+        volumes = book_outline["volumes"]
+        
+        # 先重建过期的分卷，新的章节规划会使其下章节的输入哈希随之变化
+        stale_volumes = [i for i in range(1, len(volumes) + 1) if store.is_stale(i)]
+        
+        def save_volume(i: int, volume_outline: Dict):
+            volume_index = stale_volumes[i]
+            store.save_volume(volume_index, {**volumes[volume_index - 1], **volume_outline})
+            
+        if stale_volumes:
+            logger.info(f"重新生成 {len(stale_volumes)} 卷章节大纲")
+            await self.agenerate_volume_outlines(
+                [volumes[i - 1] for i in stale_volumes], max_concurrency, on_complete=save_volume
+            )
+            
+        stale_chapters = []
+        for volume_index in range(1, len(volumes) + 1):
+            volume_outline = store.read_volume(volume_index)
+            for chapter_index, chapter in enumerate(volume_outline["chapters"], 1):
+                if store.is_stale(volume_index, chapter_index, chapter):
+                    stale_chapters.append((volume_index, chapter_index, chapter))
+                    
+        def save_chapter(i: int, chapter_outline: Dict):
+            volume_index, chapter_index, chapter = stale_chapters[i]
+            store.save_chapter(volume_index, chapter_index, {**chapter, **chapter_outline}, chapter)
+            
+        if stale_chapters:
+            logger.info(f"重新生成 {len(stale_chapters)} 章详细大纲")
+            await self.agenerate_chapter_outlines(
+                [chapter for _, _, chapter in stale_chapters], max_concurrency,
+                on_complete=save_chapter, batch=batch_chapters
+            )
+            
+        logger.info(f"大纲重建完成，重新生成 {len(stale_volumes)} 卷、{len(stale_chapters)} 章: {outline_dir}")
+        return store.load()
+        
+    @staticmethod
+    def _volume_node(volume_index: int) -> str:
+        """分卷节点的断点名称（序号从1开始）"""
+        return f"volume_{volume_index:03d}"
+        
+    @staticmethod
+    def _chapter_node(volume_index: int, chapter_index: int) -> str:
+        """章节节点的断点名称（序号从1开始）"""
+        return f"chapter_{volume_index:03d}_{chapter_index:03d}"
+        
+    def _load_node(self, run_id: Optional[str], node: str) -> Optional[Dict]:
+        """读取节点断点，未启用断点时返回None"""
+        if run_id is None:
+            return None
+        return self.file_handler.load_checkpoint(run_id, node)
+        
+    def _save_node(self, run_id: Optional[str], node: str, data: Dict) -> None:
+        """节点完成后立即保存断点，未启用断点时不做任何事"""
+        if run_id is not None:
+            self.file_handler.save_checkpoint(run_id, node, data)
+            
     def generate_complete_outline(self, topic: str, description: str, 
-                                save: bool = True, output_dir: str = "outlines") -> Dict:
+                                save: bool = True, output_dir: str = "outlines",
+                                concurrent: bool = False, max_concurrency: int = 5,
+                                checkpoint: bool = True, stream: bool = False,
+                                batch_chapters: bool = False, sharded: bool = False) -> Dict:
         """生成完整的小说大纲（包括书籍、分卷和章节大纲）
         
+        启用断点时，书籍、分卷、章节大纲每完成一个就写入断点目录；中途失败后以相同参数重新运行，
+        会从第一个缺失的节点继续生成。全部完成后断点目录会被清除。
+        
         Args:
             topic: 小说主题
             description: 小说描述
             save: 是否保存到文件
             output_dir: 输出目录
+            concurrent: 是否并发生成分卷和章节大纲
+            max_concurrency: 并发模式下同时进行的最大请求数
+            checkpoint: 是否逐节点保存断点并从断点恢复
+            stream: 是否流式解析大纲响应，分卷或章节条目一生成完就开始下游生成（隐含并发模式）
+            batch_chapters: 是否每次请求打包多个章节生成详细大纲
+            sharded: 是否按分卷、章节分片保存
             
         Returns:
             Dict: 完整大纲字典
         """
+        if concurrent or stream:
+            return asyncio.run(self.agenerate_complete_outline(
+                topic, description, save, output_dir, max_concurrency, checkpoint, stream,
+                batch_chapters, sharded
+            ))
+            
+        run_id = self.outline_cache_key(topic, description) if checkpoint else None
+        
         # 生成书籍大纲
-        book_outline = self.generate_book_outline(topic, description)
+        book_outline = self._load_node(run_id, "book")
+        if book_outline is None:
+            book_outline = self.generate_book_outline(topic, description)
+            self._save_node(run_id, "book", book_outline)
+        else:
+            logger.info("从断点恢复书籍大纲")
         
         # 为每卷生成章节大纲
-        for volume in book_outline["volumes"]:
-            volume_outline = self.generate_volume_outline(volume)
+        for volume_index, volume in enumerate(book_outline["volumes"], 1):
+            volume_node = self._volume_node(volume_index)
+            volume_outline = self._load_node(run_id, volume_node)
+            if volume_outline is None:
+                volume_outline = self.generate_volume_outline(volume)
+                self._save_node(run_id, volume_node, volume_outline)
             volume.update(volume_outline)
             
             # 为每章生成详细大纲
-            for chapter in volume["chapters"]:
-                chapter_outline = self.generate_chapter_outline(chapter)
+            pending_chapters = []
+            for chapter_index, chapter in enumerate(volume["chapters"], 1):
+                chapter_node = self._chapter_node(volume_index, chapter_index)
+                chapter_outline = self._load_node(run_id, chapter_node)
+                if chapter_outline is None:
+                    pending_chapters.append((chapter_node, chapter))
+                else:
+                    chapter.update(chapter_outline)
+                    
+            def save_chapter(i: int, chapter_outline: Dict):
+                chapter_node, chapter = pending_chapters[i]
+                self._save_node(run_id, chapter_node, chapter_outline)
                 chapter.update(chapter_outline)
+                
+            if batch_chapters:
+                self.generate_chapter_outlines_batch([chapter for _, chapter in pending_chapters], save_chapter)
+            else:
+                for i, (_, chapter) in enumerate(pending_chapters):
+                    save_chapter(i, self.generate_chapter_outline(chapter))
+        
+        # 保存大纲
+        if save:
+            self.save_outline(book_outline, output_dir, sharded=sharded)
+        if run_id is not None:
+            self.file_handler.clear_checkpoints(run_id)
+            
+        return book_outline
+        
+    async def agenerate_book_outline(self, topic: str, description: str) -> Dict:
+        """异步生成书籍整体大纲
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            
+        Returns:
+            Dict: 书籍大纲字典
+        """
+        logger.info(f"开始生成书籍大纲 - 主题: {topic}")
+        try:
+            book_outline = await self._ainvoke_outline(
+                self.book_outline_chain,
+                {"topic": topic, "description": description},
+                BookOutline
+            )
+            logger.info("书籍大纲生成成功")
+            return book_outline
+            
+        except Exception as e:
+            logger.error(f"生成书籍大纲时出错: {e}")
+            raise
+            
+    async def agenerate_volume_outline(self, volume: Dict) -> Dict:
+        """异步生成分卷章节大纲
+        
+        Args:
+            volume: 分卷信息字典
+            
+        Returns:
+            Dict: 分卷章节大纲字典
+        """
+        logger.info(f"开始生成第 {volume['volume_number']} 卷章节大纲")
+        try:
+            volume_outline = await self._ainvoke_outline(
+                self.volume_outline_chain, self._volume_inputs(volume), VolumeChapters
+            )
+            
+            logger.info(f"第 {volume['volume_number']} 卷章节大纲生成成功")
+            return volume_outline
+            
+        except Exception as e:
+            logger.error(f"生成分卷章节大纲时出错: {e}")
+            raise
+            
+    async def agenerate_chapter_outline(self, chapter: Dict) -> Dict:
+        """异步生成章节详细大纲
+        
+        Args:
+            chapter: 章节信息字典
+            
+        Returns:
+            Dict: 章节详细大纲字典
+        """
+        logger.info(f"开始生成章节详细大纲 - {chapter['chapter_title']}")
+        try:
+            chapter_outline = await self._ainvoke_outline(
+                self.chapter_outline_chain, self._chapter_inputs(chapter), ChapterScenes
+            )
+            
+            logger.info(f"章节详细大纲生成成功 - {chapter['chapter_title']}")
+            return chapter_outline
+            
+        except Exception as e:
+            logger.error(f"生成章节详细大纲时出错: {e}")
+            raise
+            
+    async def _ainvoke_all(self, chain, inputs: List[Dict], schema: type, max_concurrency: int,
+                           on_complete: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
+        """以有限并发调用chain并解析结果
+        
+        每个请求完成后立即回调 on_complete(序号, 结果)，便于逐个保存断点；
+        返回列表与输入顺序一致。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run(index: int, chain_input: Dict) -> Dict:
+            async with semaphore:
+                outline = await self._ainvoke_outline(chain, chain_input, schema)
+            if on_complete:
+                on_complete(index, outline)
+            return outline
+            
+        return await asyncio.gather(*(run(i, item) for i, item in enumerate(inputs)))
+        
+    async def agenerate_volume_outlines(self, volumes: List[Dict], max_concurrency: int = 5,
+                                        on_complete: Optional[Callable[[int, Dict], None]] = None) -> List[Dict]:
+        """并发生成多个分卷的章节大纲
+        
+        Args:
+            volumes: 分卷信息字典列表
+            max_concurrency: 同时进行的最大请求数
+            on_complete: 单个分卷完成后的回调，参数为序号和结果
+            
+        Returns:
+            List[Dict]: 与输入顺序一致的分卷章节大纲列表
+        """
+        logger.info(f"开始并发生成 {len(volumes)} 卷章节大纲，并发上限: {max_concurrency}")
+        try:
+            return await self._ainvoke_all(
+                self.volume_outline_chain,
+                [self._volume_inputs(volume) for volume in volumes],
+                VolumeChapters,
+                max_concurrency,
+                on_complete
+            )
+            
+        except Exception as e:
+            logger.error(f"并发生成分卷章节大纲时出错: {e}")
+            raise
+            
+    async def agenerate_chapter_outlines(self, chapters: List[Dict], max_concurrency: int = 5,
+                                         on_complete: Optional[Callable[[int, Dict], None]] = None,
+                                         batch: bool = False) -> List[Dict]:
+        """并发生成多个章节的详细大纲
+        
+        Args:
+            chapters: 章节信息字典列表
+            max_concurrency: 同时进行的最大请求数
+            on_complete: 单个章节完成后的回调，参数为序号和结果
+            batch: 是否每次请求打包多个章节
+            
+        Returns:
+            List[Dict]: 与输入顺序一致的章节详细大纲列表
+        """
+        logger.info(f"开始并发生成 {len(chapters)} 个章节详细大纲，并发上限: {max_concurrency}")
+        try:
+            if batch:
+                return await self._agenerate_chapter_batches(chapters, max_concurrency, on_complete)
+            return await self._ainvoke_all(
+                self.chapter_outline_chain,
+                [self._chapter_inputs(chapter) for chapter in chapters],
+                ChapterScenes,
+                max_concurrency,
+                on_complete
+            )
+            
+        except Exception as e:
+            logger.error(f"并发生成章节详细大纲时出错: {e}")
+            raise
+            
+    async def _agenerate_chapter_batches(self, chapters: List[Dict], max_concurrency: int,
+                                         on_complete: Optional[Callable[[int, Dict], None]]) -> List[Dict]:
+        """把章节按批次打包后并发请求，结果拆回各章节并保持输入顺序
+        
+        max_concurrency 个工作协程依次领取下一批章节，每批领取时按当前的单章输出长度估计重新计算批大小，
+        因此先完成的批次观察到的实际长度会用于调整之后的批次。
+        """
+        results: List[Optional[Dict]] = [None] * len(chapters)
+        cursor = 0
+        
+        async def work():
+            nonlocal cursor
+            while cursor < len(chapters):
+                start = cursor
+                batch = chapters[start:start + self.chapter_batch_size()]
+                cursor += len(batch)
+                logger.info(f"批量生成章节详细大纲 - 第 {start + 1} 至 {start + len(batch)} 章")
+                batch_outline = await self._ainvoke_outline(
+                    self.batch_chapter_outline_chain, self._batch_inputs(batch), ChapterScenesBatch
+                )
+                chapter_outlines = self._split_batch(batch, batch_outline)
+                for offset, chapter in enumerate(batch):
+                    if chapter_outlines[offset] is None:
+                        logger.warning(f"批量结果缺少章节，单独生成 - {chapter['chapter_title']}")
+                        chapter_outlines[offset] = await self._ainvoke_outline(
+                            self.chapter_outline_chain, self._chapter_inputs(chapter), ChapterScenes
+                        )
+                for offset, chapter_outline in enumerate(chapter_outlines):
+                    results[start + offset] = chapter_outline
+                    if on_complete:
+                        on_complete(start + offset, chapter_outline)
+                        
+        workers = [asyncio.create_task(work()) for _ in range(min(max_concurrency, len(chapters)))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            await cancel_tasks(workers)
+            raise
+        return results
+        
+    async def _aexpand_pending_nodes(self, book_outline: Dict, max_concurrency: int,
+                                     run_id: Optional[str], batch_chapters: bool = False) -> None:
+        """并发补齐书籍大纲下缺失的分卷和章节节点，已有断点的节点直接复用"""
+        # 并发生成所有缺失的分卷章节大纲
+        volumes = book_outline["volumes"]
+        pending_volumes = []
+        for volume_index, volume in enumerate(volumes, 1):
+            volume_outline = self._load_node(run_id, self._volume_node(volume_index))
+            if volume_outline is None:
+                pending_volumes.append((volume_index, volume))
+            else:
+                volume.update(volume_outline)
+                
+        def save_volume(i: int, volume_outline: Dict):
+            volume_index, _ = pending_volumes[i]
+            self._save_node(run_id, self._volume_node(volume_index), volume_outline)
+            
+        volume_outlines = await self.agenerate_volume_outlines(
+            [volume for _, volume in pending_volumes], max_concurrency, save_volume
+        )
+        for (_, volume), volume_outline in zip(pending_volumes, volume_outlines):
+            volume.update(volume_outline)
+            
+        # 并发生成全书所有缺失的章节详细大纲
+        pending_chapters = []
+        for volume_index, volume in enumerate(volumes, 1):
+            for chapter_index, chapter in enumerate(volume["chapters"], 1):
+                chapter_node = self._chapter_node(volume_index, chapter_index)
+                chapter_outline = self._load_node(run_id, chapter_node)
+                if chapter_outline is None:
+                    pending_chapters.append((chapter_node, chapter))
+                else:
+                    chapter.update(chapter_outline)
+                    
+        def save_chapter(i: int, chapter_outline: Dict):
+            self._save_node(run_id, pending_chapters[i][0], chapter_outline)
+            
+        chapter_outlines = await self.agenerate_chapter_outlines(
+            [chapter for _, chapter in pending_chapters], max_concurrency, save_chapter, batch_chapters
+        )
+        for (_, chapter), chapter_outline in zip(pending_chapters, chapter_outlines):
+            chapter.update(chapter_outline)
+        
+    async def agenerate_complete_outline(self, topic: str, description: str,
+                                         save: bool = True, output_dir: str = "outlines",
+                                         max_concurrency: int = 5, checkpoint: bool = True,
+                                         stream: bool = False, batch_chapters: bool = False,
+                                         sharded: bool = False) -> Dict:
+        """并发生成完整的小说大纲
+        
+        先并发生成所有分卷的章节大纲，再把全书所有章节的详细大纲一起并发生成。
+        结果按输入顺序合并，因此大纲与串行生成的结构和顺序一致。
+        断点行为与 generate_complete_outline 相同，只有缺失的节点才会发起请求。
+        
+        Args:
+            topic: 小说主题
+            description: 小说描述
+            save: 是否保存到文件
+            output_dir: 输出目录
+            max_concurrency: 同时进行的最大请求数
+            checkpoint: 是否逐节点保存断点并从断点恢复
+            stream: 是否流式解析大纲响应，流式模式下章节条目逐个生成，不做批量打包
+            batch_chapters: 是否每次请求打包多个章节生成详细大纲
+            sharded: 是否按分卷、章节分片保存
+            
+        Returns:
+            Dict: 完整大纲字典
+        """
+        run_id = self.outline_cache_key(topic, description) if checkpoint else None
         
+        # 生成书籍大纲
+        book_outline = self._load_node(run_id, "book")
+        if stream and self.structured_output:
+            logger.warning("结构化输出模式不支持流式解析，改用并发生成")
+            stream = False
+            
+        if book_outline is None and stream:
+            # 没有可恢复的断点时才走流式生成，断点恢复沿用逐层补齐的逻辑
+            book_outline = await self._astream_complete_outline(topic, description, max_concurrency, run_id)
+        else:
+            if book_outline is None:
+                book_outline = await self.agenerate_book_outline(topic, description)
+                self._save_node(run_id, "book", book_outline)
+            else:
+                logger.info("从断点恢复书籍大纲")
+            await self._aexpand_pending_nodes(book_outline, max_concurrency, run_id, batch_chapters)
+            
         # 保存大纲
         if save:
-            self.save_outline(book_outline, output_dir)
+            self.save_outline(book_outline, output_dir, sharded=sharded)
+        if run_id is not None:
+            self.file_handler.clear_checkpoints(run_id)
             
-        return book_outline 
\ No newline at end of file
+        return book_outline
+        
+    async def _astream_json_array(self, chain, chain_input: Dict, key: str,
+                                  on_item: Callable[[Dict], None]) -> str:
+        """流式调用chain，数组 key 中的每个对象一闭合就回调 on_item
+        
+        某个对象无法解析时不再回调后续对象（回调按位置对应条目），
+        剩余条目由调用方解析完整响应后补齐。
+        
+        Returns:
+            str: 完整的响应文本
+        """
+        parser = JsonArrayStreamParser(key)
+        async for chunk in chain.astream(chain_input):
+            items = parser.feed(chunk)
+            if parser.failed:
+                continue
+            for item in items:
+                on_item(item)
+        return parser.text
+        
+    async def _astream_complete_outline(self, topic: str, description: str,
+                                        max_concurrency: int, run_id: Optional[str]) -> Dict:
+        """流式生成完整大纲
+        
+        书籍大纲响应中每个分卷条目一闭合就开始流式生成该卷章节大纲，
+        章节条目一闭合就开始生成该章详细大纲，下游生成与上游响应的尾部重叠进行。
+        断点按书籍、分卷、章节的依赖顺序保存，避免恢复时用到与上级节点不匹配的断点。
+        流式响应无法解析时，取消据此启动的下游任务，改用普通请求（跳过响应缓存）按 max_parse_retries 重试。
+        出错时取消所有分卷和章节任务。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        book_saved = asyncio.Event()
+        volume_tasks = []
+        all_chapter_tasks = []
+        
+        async def expand_chapter(volume_index: int, chapter_index: int, chapter: Dict,
+                                 volume_saved: asyncio.Event) -> Dict:
+            async with semaphore:
+                chapter_outline = await self._ainvoke_outline(
+                    self.chapter_outline_chain, self._chapter_inputs(chapter), ChapterScenes
+                )
+            await volume_saved.wait()
+            self._save_node(run_id, self._chapter_node(volume_index, chapter_index), chapter_outline)
+            return chapter_outline
+            
+        async def reparse(response: str, chain, chain_input: Dict, schema: type,
+                          started: List[asyncio.Task], dependents: List[asyncio.Task]) -> Dict:
+            """解析流式响应，失败时取消据此启动的下游任务（started 及其派生的 dependents）并改用普通请求重试"""
+            try:
+                return self._parse_outline(response, schema)
+            except ValueError as e:
+                if not self.max_parse_retries:
+                    raise
+                logger.warning(f"流式大纲解析失败，改用普通请求重试: {e}")
+            await cancel_tasks(started + dependents)
+            started.clear()
+            return await self._ainvoke_outline(chain, chain_input, schema, refresh=True)
+            
+        async def expand_volume(volume_index: int, volume: Dict) -> Dict:
+            volume_saved = asyncio.Event()
+            chapter_tasks = []
+            
+            def start_chapter(chapter: Dict):
+                chapter_index = len(chapter_tasks) + 1
+                task = asyncio.create_task(expand_chapter(volume_index, chapter_index, chapter, volume_saved))
+                chapter_tasks.append(task)
+                all_chapter_tasks.append(task)
+                
+            logger.info(f"开始流式生成第 {volume['volume_number']} 卷章节大纲")
+            chain_input = self._volume_inputs(volume)
+            async with semaphore:
+                response = await self._astream_json_array(
+                    self.volume_outline_chain, chain_input, "chapters", start_chapter
+                )
+                volume_outline = await reparse(
+                    response, self.volume_outline_chain, chain_input, VolumeChapters, chapter_tasks, []
+                )
+            for chapter in volume_outline["chapters"][len(chapter_tasks):]:
+                start_chapter(chapter)
+                
+            await book_saved.wait()
+            self._save_node(run_id, self._volume_node(volume_index), volume_outline)
+            volume_saved.set()
+            
+            chapter_outlines = await asyncio.gather(*chapter_tasks)
+            for chapter, chapter_outline in zip(volume_outline["chapters"], chapter_outlines):
+                chapter.update(chapter_outline)
+            return volume_outline
+            
+        def start_volume(volume: Dict):
+            volume_index = len(volume_tasks) + 1
+            volume_tasks.append(asyncio.create_task(expand_volume(volume_index, volume)))
+            
+        logger.info(f"开始流式生成书籍大纲 - 主题: {topic}")
+        chain_input = {"topic": topic, "description": description}
+        try:
+            response = await self._astream_json_array(
+                self.book_outline_chain, chain_input, "volumes", start_volume
+            )
+            book_outline = await reparse(
+                response, self.book_outline_chain, chain_input, BookOutline, volume_tasks, all_chapter_tasks
+            )
+            for volume in book_outline["volumes"][len(volume_tasks):]:
+                start_volume(volume)
+            self._save_node(run_id, "book", book_outline)
+            book_saved.set()
+            
+            volume_outlines = await asyncio.gather(*volume_tasks)
+            for volume, volume_outline in zip(book_outline["volumes"], volume_outlines):
+                volume.update(volume_outline)
+            logger.info("流式大纲生成完成")
+            return book_outline
+            
+        except BaseException as e:
+            # 章节任务在分卷任务内部创建，分卷任务在 gather 之前被取消时它们不会随之取消
+            await cancel_tasks(volume_tasks + all_chapter_tasks)
+            logger.error(f"流式生成大纲时出错: {e!r}")
+            raise
@@ -0,0 +1,74 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional, Union
+
+class SceneOutline(BaseModel):
+    """场景大纲"""
+    model_config = ConfigDict(extra="allow")
+
+    scene_title: str = Field(description="场景标题")
+    scene_description: str = Field(default="", description="场景描述")
+    key_elements: List[str] = Field(default_factory=list, description="关键元素")
+    dialogues: List[str] = Field(default_factory=list, description="重要对话点")
+    emotions: str = Field(default="", description="情感变化")
+    expected_words: Union[int, str] = Field(default="", description="预计字数")
+
+class ChapterOutline(BaseModel):
+    """章节大纲，展开后包含场景列表"""
+    model_config = ConfigDict(extra="allow")
+
+    chapter_number: Union[int, str] = Field(default="", description="章节号")
+    chapter_title: str = Field(description="章节标题")
+    plot_points: List[str] = Field(default_factory=list, description="剧情推进点")
+    word_count: Union[int, str] = Field(default="", description="预计字数")
+    scenes: Optional[List[SceneOutline]] = Field(default=None, description="场景列表")
+
+class VolumeOutline(BaseModel):
+    """分卷大纲，展开后包含章节列表"""
+    model_config = ConfigDict(extra="allow")
+
+    volume_number: Union[int, str] = Field(description="卷号")
+    volume_title: str = Field(default="", description="分卷标题")
+    volume_description: str = Field(default="", description="分卷主要内容描述")
+    key_plots: List[str] = Field(default_factory=list, description="该卷主要剧情点")
+    chapters: Optional[List[ChapterOutline]] = Field(default=None, description="章节列表")
+
+class BookOutline(BaseModel):
+    """书籍大纲，book_outline_chain 的返回结构"""
+    model_config = ConfigDict(extra="allow")
+
+    main_theme: str = Field(description="书籍主题")
+    description: str = Field(description="书籍完整描述")
+    volumes: List[VolumeOutline] = Field(description="分卷列表")
+
+class VolumeChapters(BaseModel):
+    """分卷章节规划，volume_outline_chain 的返回结构"""
+    model_config = ConfigDict(extra="allow")
+
+    volume_number: Union[int, str] = Field(default="", description="卷号")
+    volume_title: str = Field(default="", description="分卷标题")
+    chapters: List[ChapterOutline] = Field(description="章节列表")
+
+class ChapterScenes(BaseModel):
+    """章节详细大纲，chapter_outline_chain 的返回结构"""
+    model_config = ConfigDict(extra="allow")
+
+    chapter_title: str = Field(description="章节标题")
+    scenes: List[SceneOutline] = Field(description="场景列表")
+
+class KeyedChapterScenes(ChapterScenes):
+    """批量请求中的单个章节详细大纲，chapter_key 用于对应输入章节"""
+    chapter_key: Union[int, str] = Field(description="与输入章节对应的键")
+
+class ChapterScenesBatch(BaseModel):
+    """批量章节详细大纲，batch_chapter_outline_chain 的返回结构"""
+    model_config = ConfigDict(extra="allow")
+
+    chapters: List[KeyedChapterScenes] = Field(description="各章节的详细大纲")
+
+def outline_to_dict(outline: BaseModel) -> Dict:
+    """把大纲模型转换为字典
+
+    只保留模型实际返回的字段，未返回的可选字段不会以默认值出现，
+    因此可以用 "chapters" / "scenes" 是否存在判断节点是否已展开。
+    """
+    return outline.model_dump(exclude_unset=True)
@@ -23,6 +23,32 @@ content_generation_prompt = ChatPromptTemplate.from_messages([
     要求字数：{target_words}字
     """)
 ])
+# 场景内容生成提示词，按场景并行生成时每个场景单独调用
+scene_generation_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个专业的小说内容创作者。基于章节大纲中的单个场景生成该场景的具体内容。
+    要求：
+    1. 场景描写要细腻，带入感强
+    2. 对话要自然，符合人物性格
+    3. 情感描写要细腻
+    4. 开头承接上一场景，结尾为下一场景留出自然的过渡
+    5. 只写本场景的情节，不要提前写下一场景的内容
+    6. 模仿网文风格，增强代入感
+     
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不要输出场景标题
+    """),
+    ("human", """请基于以下大纲生成本场景的完整内容：
+    章节标题：{chapter_title}
+    章节概况：
+    {chapter_context}
+    本场景大纲：
+    {scene}
+    场景衔接：
+    {handoff}
+    要求字数：{target_words}字
+    """)
+])
 # 扩展章节内容的提示词
 expand_prompt = ChatPromptTemplate.from_messages([
     ("system", """你是一个专业的小说内容创作者。基于章节内容扩展，增加场景，对话，情感等元素。
@@ -39,6 +65,28 @@ expand_prompt = ChatPromptTemplate.from_messages([
     """)
 ])
 
+# 续写式扩展的提示词，原文保持不变，只输出插入的新段落
+expand_insert_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个专业的小说内容创作者。正文已按段落编号，请在指定位置之后插入新的段落来扩展章节，原文一字不改。
+    要求：
+    1. 插入的内容可以是场景描写、对话、动作、神态、心理活动等，增加场景，对话，情感等元素
+    2. 插入的内容要与前后段落自然衔接，不要与后文情节冲突，也不要提前写出后文的情节
+    3. 模仿网文风格，增强代入感
+    4. 可以埋下伏笔，增加悬念
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不要重复或改写原文
+    - 只输出JSON，格式如下：
+    {{"edits": [{{"op": "insert_after", "id": 段落编号, "text": "插入的段落"}}]}}
+    """),
+    ("human", """请扩展以下内容：
+    插入位置（在这些段落之后）：{points}
+    需要补充的字数：约{missing_words}字，每处约{words_per_point}字
+    正文：
+    {paragraphs}
+    """)
+])
+
 # 内容优化的提示词
 enhance_prompt = ChatPromptTemplate.from_messages([
     ("system", """你是一个内容优化专家。基于已有内容进行优化和提升。
@@ -54,3 +102,48 @@ enhance_prompt = ChatPromptTemplate.from_messages([
     """),
     ("human", "请优化以下内容：\n{content}")
 ])
+
+# 分窗口优化的提示词，每次只优化章节中的一段连续段落
+enhance_window_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个内容优化专家。基于已有内容进行优化和提升，内容是一个章节中的连续片段，已按段落编号。
+    优化要求：
+    1. 加强细节描写的生动性
+    2. 优化对话的真实感
+    3. 增强情感表达的打动力
+    4. 提升文学性和可读性
+    5. 保持风格的一致性，开头和结尾要能与片段前后的内容衔接
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不需要阐述优化版本的好处/优点
+    - 逐段优化，每段以原编号开头，格式为 [P编号] 优化后的段落
+    - 不要合并、拆分、删除或新增段落，不要输出编号段落以外的内容
+    """),
+    ("human", """请优化以下内容（{part}）：
+    {paragraphs}
+    """)
+])
+
+# 补丁式优化的提示词，只输出需要修改的段落
+enhance_patch_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个内容优化专家。正文已按段落编号，请只改写确实需要优化的段落，不要重新输出全文。
+    优化要求：
+    1. 加强细节描写的生动性
+    2. 优化对话的真实感
+    3. 增强情感表达的打动力
+    4. 提升文学性和可读性
+    5. 保持风格的一致性，改写后的段落要与前后段落自然衔接
+    6. 已标记的段落必须改写，其他段落只在明显需要时才改写，大部分段落应保持不变
+    7. 可以在某段之后插入新段落（如补充对话），段落编号0表示插入到开头
+    限制：
+    - 不要出现如篇幅限制，字数限制，字数要求等字样
+    - 不需要阐述优化的理由
+    - 只输出JSON，格式如下：
+    {{"edits": [{{"op": "replace", "id": 段落编号, "text": "改写后的段落"}}, {{"op": "insert_after", "id": 段落编号, "text": "插入的段落"}}]}}
+    """),
+    ("human", """请优化以下内容：
+    需要改写的段落：{flagged}
+    发现的问题：{issues}
+    正文：
+    {paragraphs}
+    """)
+])
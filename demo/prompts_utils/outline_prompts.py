@@ -1,5 +1,8 @@
 from langchain_core.prompts import ChatPromptTemplate
 
+# 大纲提示词版本，修改下面任一提示词后需要递增，使已缓存的大纲失效
+OUTLINE_PROMPT_VERSION = "1"
+
 # 书籍大纲生成提示词
 book_outline_prompt = ChatPromptTemplate.from_messages([
     ("system", """你是一个专业的小说大纲生成器。根据用户的主题和描述，生成一个详细的分卷大纲。
@@ -83,4 +86,36 @@ chapter_outline_prompt = ChatPromptTemplate.from_messages([
     剧情推进点：{plot_points}
     预计字数：{word_count}
     """)
-]) 
\ No newline at end of file
+]) 
+# 批量章节详细大纲生成提示词，一次请求生成多个章节
+batch_chapter_outline_prompt = ChatPromptTemplate.from_messages([
+    ("system", """你是一个专业的章节细纲生成器。基于多个章节的大纲，分别为每个章节生成详细的写作提纲。
+    请生成一个包含以下字段的JSON格式输出：
+    {{
+        "chapters": [
+            {{
+                "chapter_key": "与输入中对应章节相同的chapter_key",
+                "chapter_title": "章节标题",
+                "scenes": [
+                    {{
+                        "scene_title": "场景标题",
+                        "scene_description": "场景描述",
+                        "key_elements": ["关键元素1", "关键元素2", ...],
+                        "dialogues": ["重要对话点1", "重要对话点2", ...],
+                        "emotions": "情感变化",
+                        "expected_words": "预计字数"
+                    }}
+                ]
+            }}
+        ]
+    }}
+    要求：
+    1. 每个输入章节都要输出一项，chapter_key 必须与输入一致
+    2. 场景描述要具体，包含环境、人物、动作等要素
+    3. 重要对话要推动剧情发展
+    4. 要注意情感铺垫和渲染
+    """),
+    ("human", """请为以下章节分别生成详细大纲：
+    {chapters}
+    """)
+])
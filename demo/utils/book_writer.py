@@ -0,0 +1,165 @@
+import glob
+import json
+import logging
+import os
+import shutil
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+async def stream_to_file(chunks: AsyncIterator[str], filepath: str) -> str:
+    """把流式输出逐段写入文件，同时返回完整文本
+
+    进程中断时文件中保留已经生成的部分，便于排查。
+
+    Args:
+        chunks: 流式输出的文本片段
+        filepath: 写入的文件路径
+
+    Returns:
+        str: 完整文本
+    """
+    pieces: List[str] = []
+    with open(filepath, 'w', encoding='utf-8') as f:
+        async for chunk in chunks:
+            f.write(chunk)
+            f.flush()
+            pieces.append(chunk)
+    return "".join(pieces)
+
+class BookWriter:
+    """逐章写入磁盘的书籍输出，并用运行清单记录进度以便断点续写
+
+    目录结构：
+        book.md                 已完成章节按顺序追加写入的正文
+        manifest.json           运行清单：书籍大纲、各卷章节大纲、已完成的章节以及 book.md 的有效长度
+        chapter_001_001.part    正在生成的章节初稿，生成时逐段写入，章节完成后删除
+
+    内存中只保留当前章节的内容，整本书的长度不影响内存占用。
+    """
+
+    BOOK_FILE = "book.md"
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, book_dir: str):
+        """初始化书籍输出
+
+        Args:
+            book_dir: 输出目录
+        """
+        self.book_dir = book_dir
+        self.manifest: Dict = {}
+
+    @property
+    def book_path(self) -> str:
+        return os.path.join(self.book_dir, self.BOOK_FILE)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.book_dir, self.MANIFEST_FILE)
+
+    @staticmethod
+    def chapter_node(volume_index: int, chapter_index: int) -> str:
+        """章节在运行清单中的名称（序号从1开始）"""
+        return f"chapter_{volume_index:03d}_{chapter_index:03d}"
+
+    def part_path(self, volume_index: int, chapter_index: int) -> str:
+        """正在生成的章节初稿路径"""
+        return os.path.join(self.book_dir, f"{self.chapter_node(volume_index, chapter_index)}.part")
+
+    def exists(self) -> bool:
+        """输出目录中是否已有运行清单"""
+        return os.path.exists(self.manifest_path)
+
+    def start(self, run_info: Dict):
+        """清空输出目录，开始新的运行
+
+        Args:
+            run_info: 运行参数（主题、描述等），写入运行清单
+        """
+        shutil.rmtree(self.book_dir, ignore_errors=True)
+        os.makedirs(self.book_dir, exist_ok=True)
+        open(self.book_path, 'wb').close()
+        self.manifest = {
+            **run_info,
+            "book_outline": None,
+            "volume_outlines": {},
+            "completed": [],
+            "book_size": 0,
+            "word_count": 0
+        }
+        self._save_manifest()
+
+    def resume(self):
+        """读取运行清单，恢复到最后一个已完成的章节
+
+        book.md 中超出清单记录长度的部分（写入章节后、更新清单前中断）会被截掉，
+        未完成章节的初稿会被删除。
+        """
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        with open(self.book_path, 'ab') as f:
+            f.truncate(self.manifest["book_size"])
+        for part_path in glob.glob(os.path.join(self.book_dir, "*.part")):
+            os.remove(part_path)
+        logger.info(f"从运行清单恢复，已完成 {len(self.manifest['completed'])} 章")
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    @property
+    def book_outline(self) -> Optional[Dict]:
+        return self.manifest["book_outline"]
+
+    def save_book_outline(self, book_outline: Dict):
+        """记录书籍大纲，续写时沿用同一份大纲"""
+        self.manifest["book_outline"] = book_outline
+        self._save_manifest()
+
+    def volume_outline(self, volume_index: int) -> Optional[Dict]:
+        """读取已记录的分卷章节大纲"""
+        return self.manifest["volume_outlines"].get(str(volume_index))
+
+    def save_volume_outline(self, volume_index: int, volume_outline: Dict):
+        """记录分卷章节大纲，续写时沿用同一份大纲"""
+        self.manifest["volume_outlines"][str(volume_index)] = volume_outline
+        self._save_manifest()
+
+    def is_completed(self, volume_index: int, chapter_index: int) -> bool:
+        """章节是否已经写入 book.md"""
+        return self.chapter_node(volume_index, chapter_index) in self.manifest["completed"]
+
+    @property
+    def completed_count(self) -> int:
+        return len(self.manifest["completed"])
+
+    @property
+    def word_count(self) -> int:
+        return self.manifest["word_count"]
+
+    def append_chapter(self, volume_index: int, chapter_index: int, text: str, word_count: int = 0):
+        """把完成的章节追加到 book.md 并记录到运行清单
+
+        正文先落盘，再更新清单；两步之间中断时，续写会按清单中的长度截掉多写的部分。
+
+        Args:
+            volume_index: 分卷序号（从1开始）
+            chapter_index: 章节序号（从1开始）
+            text: 章节文本（含标题）
+            word_count: 章节字数，累计到运行清单中
+        """
+        with open(self.book_path, 'ab') as f:
+            f.write(text.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            book_size = f.tell()
+        self.manifest["completed"].append(self.chapter_node(volume_index, chapter_index))
+        self.manifest["book_size"] = book_size
+        self.manifest["word_count"] += word_count
+        self._save_manifest()
+        part_path = self.part_path(volume_index, chapter_index)
+        if os.path.exists(part_path):
+            os.remove(part_path)
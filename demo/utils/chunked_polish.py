@@ -0,0 +1,187 @@
+import logging
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from utils.paragraph_patch import join_paragraphs, number_paragraphs, split_layout
+from utils.text_metrics import count_words, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 模型输出中带编号的段落开头
+LABEL_PATTERN = re.compile(r"^\s*\[P(\d+)\]\s*", re.MULTILINE)
+
+def split_windows(paragraphs: List[str], window_words: int = 1500,
+                  overlap: int = 1) -> List[Tuple[int, int]]:
+    """把段落按字数切分为相互重叠的窗口
+
+    先按字数切出互不重叠的核心区间，再向两侧各扩展 overlap 个段落作为重叠部分。
+
+    Args:
+        paragraphs: 段落列表
+        window_words: 每个窗口核心部分的字数上限
+        overlap: 相邻窗口重叠的段落数（每侧）
+
+    Returns:
+        List[Tuple[int, int]]: 窗口的起止下标（左闭右开）
+    """
+    cores = []
+    start, words = 0, 0
+    for i, paragraph in enumerate(paragraphs):
+        paragraph_words = count_words(paragraph)
+        if i > start and words + paragraph_words > window_words:
+            cores.append((start, i))
+            start, words = i, 0
+        words += paragraph_words
+    if start < len(paragraphs):
+        cores.append((start, len(paragraphs)))
+    return [(max(start - overlap, 0), min(end + overlap, len(paragraphs))) for start, end in cores]
+
+def parse_labeled_paragraphs(text: str) -> Dict[int, str]:
+    """解析模型按 "[P编号] 段落" 格式输出的段落
+
+    编号之间没有编号的内容归入前一个编号；同一编号出现多次时保留第一次。
+    """
+    matches = list(LABEL_PATTERN.finditer(text))
+    paragraphs: Dict[int, str] = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        paragraph = text[match.end():end].strip()
+        paragraphs.setdefault(int(match.group(1)), paragraph)
+    return paragraphs
+
+def merged_labels(polished: Dict[int, str], paragraphs: List[str], start: int, end: int) -> Set[int]:
+    """窗口输出中疑似并入了相邻缺失段落的段落编号
+
+    模型有时把两段合写在一个编号下，另一个编号不再出现。缺失编号旁边的段落比原文长出
+    缺失段落字数的一半以上时，认为它包含了缺失段落的内容。
+
+    Args:
+        polished: parse_labeled_paragraphs 返回的窗口输出
+        paragraphs: 原文段落列表
+        start: 窗口起始下标
+        end: 窗口结束下标（不含）
+
+    Returns:
+        Set[int]: 疑似合并的段落编号
+    """
+    suspects = set()
+    for label in range(start + 1, end + 1):
+        if label in polished:
+            continue
+        missing_words = count_words(paragraphs[label - 1])
+        for neighbour in (label - 1, label + 1):
+            text = polished.get(neighbour)
+            if text and start < neighbour <= end and \
+                    count_words(text) > count_words(paragraphs[neighbour - 1]) + missing_words / 2:
+                suspects.add(neighbour)
+    return suspects
+
+def reconcile_windows(paragraphs: List[str], windows: List[Tuple[int, int]],
+                      outputs: List[str]) -> List[str]:
+    """在本地合并各窗口的优化结果
+
+    每个段落只取一个窗口的版本：优先取该段落离窗口边缘最远的窗口，重叠部分因此前一半取前一个窗口、
+    后一半取后一个窗口，段落的上下文都是完整的。窗口输出中缺少的段落依次尝试其他窗口，
+    都没有时保留原文，因此合并结果的段落与原文一一对应，不会重复也不会丢失。
+    窗口把缺失段落并入相邻段落时（参见 merged_labels），该窗口的这个段落也不采用，
+    以免与其他窗口或原文中的缺失段落重复。
+
+    Args:
+        paragraphs: 原文段落列表
+        windows: split_windows 返回的窗口
+        outputs: 各窗口的模型输出
+
+    Returns:
+        List[str]: 合并后的段落列表
+    """
+    polished = [parse_labeled_paragraphs(output) for output in outputs]
+    for window_output, (start, end) in zip(polished, windows):
+        suspects = merged_labels(window_output, paragraphs, start, end)
+        if suspects:
+            logger.warning(f"优化结果中 {'、'.join(f'P{label}' for label in sorted(suspects))} 疑似并入了相邻段落，不采用")
+        for label in suspects:
+            del window_output[label]
+    merged = []
+    missing = 0
+    for i, paragraph in enumerate(paragraphs):
+        candidates = [w for w, (start, end) in enumerate(windows) if start <= i < end]
+        # 离窗口边缘越远越优先
+        candidates.sort(key=lambda w: -min(i - windows[w][0], windows[w][1] - 1 - i))
+        for w in candidates:
+            text = polished[w].get(i + 1)
+            if text:
+                merged.append(text)
+                break
+        else:
+            merged.append(paragraph)
+            missing += 1
+    if missing:
+        logger.warning(f"{missing} 个段落没有出现在优化结果中，保留原文")
+    return merged
+
+class WindowedPolishChain(Runnable[str, str]):
+    """按重叠的段落窗口并行优化整章内容
+
+    章节拆分为带编号的段落窗口，各窗口在并发上限内分别调用优化chain，模型按编号逐段输出，
+    最后在本地按编号合并，段落之间的换行、空行和缩进与原文一致。单次请求和响应的长度只与窗口大小有关，
+    与章节长度无关。
+    """
+
+    def __init__(self, chain: Runnable, window_words: int = 1500, overlap: int = 1,
+                 max_concurrency: int = 5):
+        """初始化分窗口优化chain
+
+        Args:
+            chain: 优化单个窗口的chain，输入为 paragraphs、part 两个字段
+            window_words: 每个窗口核心部分的字数上限
+            overlap: 相邻窗口重叠的段落数（每侧）
+            max_concurrency: 同时优化的最大窗口数
+        """
+        self.chain = chain
+        self.window_words = window_words
+        self.overlap = overlap
+        self.max_concurrency = max_concurrency
+
+    def prompt_tokens_for(self, content: str) -> int:
+        """优化content时额外发送的估算token数：每个窗口请求中提示词模板的固定部分，以及重叠段落的重复发送"""
+        paragraphs, _ = split_layout(content)
+        windows = split_windows(paragraphs, self.window_words, self.overlap)
+        repeated = sum(estimate_tokens(p) for start, end in windows for p in paragraphs[start:end]) - \
+            sum(estimate_tokens(p) for p in paragraphs)
+        return self.chain.prompt_tokens * len(windows) + repeated
+
+    def _window_inputs(self, content: str):
+        paragraphs, separators = split_layout(content)
+        windows = split_windows(paragraphs, self.window_words, self.overlap)
+        inputs = [
+            {
+                "paragraphs": number_paragraphs(paragraphs[start:end], start + 1),
+                "part": f"第{i}部分，共{len(windows)}部分"
+            }
+            for i, (start, end) in enumerate(windows, 1)
+        ]
+        logger.info(f"章节共 {len(paragraphs)} 段，拆分为 {len(windows)} 个窗口并行优化")
+        return paragraphs, separators, windows, inputs
+
+    def invoke(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        paragraphs, separators, windows, inputs = self._window_inputs(input)
+        outputs = self.chain.batch(inputs, config={"max_concurrency": self.max_concurrency})
+        return join_paragraphs(reconcile_windows(paragraphs, windows, outputs), separators)
+
+    async def ainvoke(self, input: str, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        paragraphs, separators, windows, inputs = self._window_inputs(input)
+        outputs = await self.chain.abatch(inputs, config={"max_concurrency": self.max_concurrency})
+        return join_paragraphs(reconcile_windows(paragraphs, windows, outputs), separators)
+
+def pass_prompt_tokens(chain: Runnable, content: str) -> int:
+    """执行一次扩展、优化步骤时提示词模板固定部分的估算token数，分窗口优化按所有窗口计算
+
+    Args:
+        chain: 步骤使用的chain
+        content: 步骤处理的正文
+    """
+    if isinstance(chain, WindowedPolishChain):
+        return chain.prompt_tokens_for(content)
+    return chain.prompt_tokens
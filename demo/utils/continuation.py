@@ -0,0 +1,406 @@
+import asyncio
+import logging
+from contextlib import aclosing, closing
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from utils.stream_monitor import StreamMonitor
+from utils.text_metrics import prompt_tokens
+import utils.project_path  # noqa: F401
+from src.llm import cache_key, cache_refreshing, load_generations, registry
+
+logger = logging.getLogger(__name__)
+
+# 检查续写开头与已有输出重复的最大字符数
+OVERLAP_CHARS = 200
+# 不支持预填充的模型使用的续写请求
+CONTINUE_PROMPT = "上面的输出在此处中断了，请从中断处直接继续输出，不要重复已输出的内容，也不要添加任何说明。"
+
+def is_truncated(message: BaseMessage) -> bool:
+    """判断模型输出是否因达到 max_tokens 上限而被截断
+
+    Anthropic 模型返回 stop_reason 为 max_tokens，OpenAI 模型返回 finish_reason 为 length。
+
+    Args:
+        message: 模型返回的消息（流式调用时为合并后的消息块）
+
+    Returns:
+        bool: 是否被截断
+    """
+    metadata = getattr(message, "response_metadata", None) or {}
+    return metadata.get("stop_reason") == "max_tokens" or metadata.get("finish_reason") == "length"
+
+def message_text(message: BaseMessage) -> str:
+    """取出消息中的文本，兼容内容为分块列表的情况"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    )
+
+def merge_continuation(text: str, piece: str, max_overlap: int = OVERLAP_CHARS) -> str:
+    """把续写内容接到已有输出之后，去掉续写开头与已有输出结尾重复的部分
+
+    Args:
+        text: 已有输出
+        piece: 续写内容
+        max_overlap: 检查的最大重复长度
+
+    Returns:
+        str: 拼接后的输出
+    """
+    for size in range(min(len(text), len(piece), max_overlap), 0, -1):
+        if text.endswith(piece[:size]):
+            return text + piece[size:]
+    return text + piece
+
+class _StreamJoiner:
+    """把多次请求的流式输出拼接为连续的文本片段
+
+    续写的开头需要先与已有输出拼接（去掉重复部分），之后的内容直接追加。
+    已有输出结尾的空白先不产出，被截断时续写会从去掉空白的结尾重新开始。
+    """
+
+    def __init__(self, chain: "ContinuationChain"):
+        self.chain = chain
+        self.text = ""
+        self._held = ""
+        self._piece = ""
+        self._joined = True
+
+    def begin(self):
+        """开始一次请求"""
+        self._joined = not self.text
+        self._piece = ""
+
+    def _release(self, piece: str) -> str:
+        output = (self._held + piece).rstrip()
+        self._held = (self._held + piece)[len(output):]
+        return output
+
+    def feed(self, chunk_text: str) -> str:
+        """接收一段模型输出，返回可以产出的文本"""
+        self._piece += chunk_text
+        if not self._joined:
+            # 不使用预填充时，续写开头可能与已有输出重复，先缓存一段再拼接
+            if not self.chain.prefill and len(self._piece) <= OVERLAP_CHARS:
+                return ""
+            base = self.text.rstrip()
+            self._piece = self.chain._merge(self.text, self._piece)[len(base):]
+            self.text, self._held = base, ""
+            self._joined = True
+        piece, self._piece = self._piece, ""
+        self.text += piece
+        return self._release(piece)
+
+    def end(self) -> str:
+        """一次请求结束，返回仍在缓存中的续写内容（续写内容比重复检查的长度还短时）"""
+        if self._joined or not self._piece:
+            return ""
+        base = self.text.rstrip()
+        piece = self.chain._merge(self.text, self._piece)[len(base):]
+        self.text, self._held, self._piece = base + piece, "", ""
+        self._joined = True
+        return self._release(piece)
+
+    def close(self) -> str:
+        """全部请求结束，返回结尾的空白"""
+        held, self._held = self._held, ""
+        return held
+
+class ContinuationChain(Runnable[dict, str]):
+    """输出被截断时自动续写的chain，可替代 prompt | llm | StrOutputParser()
+
+    模型因达到 max_tokens 而停止时，带上已有输出的结尾重新请求，直到输出完整或达到续写次数上限，
+    各段输出无缝拼接后返回。支持预填充的模型（Anthropic）把结尾作为助手消息的开头继续生成，
+    其他模型追加一条要求从中断处继续的用户消息，并去掉续写开头与已有输出重复的部分。
+
+    设置 monitor 时改为流式请求，监控器判定应当停止（长度已够或出现复读）时取消请求，
+    返回监控器放行的内容。
+
+    启用响应缓存（registry.enable_cache）后，每次请求（包括续写请求）先按模型配置、完整消息和
+    prompt_version 查找缓存，命中时不再请求模型；在 refresh_cache() 中调用时跳过查找，新的响应覆盖缓存。
+    流式请求被中途取消时，已收到的部分按被截断的响应缓存，重放时监控器会在同一位置停止；没有停止时由续写补齐剩余部分。
+
+    设置 hedge 时，异步请求超过该chain学习到的尾部延迟（p95）仍未返回（流式请求为未收到第一个片段）时，
+    注册表的模型会再发一个相同的请求，采用先完成的结果并取消另一个，额外请求数受预算限制（见 src/llm/hedging.py）。
+    """
+
+    def __init__(self, prompt: ChatPromptTemplate, llm: BaseChatModel,
+                 max_continuations: int = 3, tail_chars: int = 2000,
+                 prefill: Optional[bool] = None,
+                 monitor: Optional[Callable[[dict], StreamMonitor]] = None,
+                 cache: bool = True, prompt_version: str = "",
+                 hedge: Optional[str] = None):
+        """初始化续写chain
+
+        Args:
+            prompt: 提示词模板
+            llm: 聊天模型
+            max_continuations: 单次调用最多续写的次数
+            tail_chars: 续写请求中携带的已有输出结尾的字符数
+            prefill: 是否使用助手消息预填充续写，默认根据模型类型判断
+            monitor: 根据chain输入创建流式监控器的函数，为None时不监控
+            cache: 是否使用响应缓存（需先启用），输出需要每次不同的chain应设为False
+            prompt_version: 提示词版本，修改提示词语义但模板文本未变时更新它，使旧的缓存失效
+            hedge: 对冲请求使用的chain名称，各名称分别统计延迟，为None时不对冲；需使用注册表创建的模型
+        """
+        self.prompt = prompt
+        self.llm = llm
+        self.max_continuations = max_continuations
+        self.tail_chars = tail_chars
+        self.prefill = llm._llm_type == "anthropic-chat" if prefill is None else prefill
+        self.monitor = monitor
+        self.cache = cache
+        self.prompt_version = prompt_version
+        self.hedge = hedge
+
+    @property
+    def prompt_tokens(self) -> int:
+        """提示词模板固定部分的估算token数"""
+        return prompt_tokens(self.prompt)
+
+    def _continuation_messages(self, messages: List[BaseMessage], text: str) -> List[BaseMessage]:
+        """构造续写请求的消息列表，第一次请求时 text 为空"""
+        if not text:
+            return messages
+        # 预填充内容不能以空白结尾
+        tail = text[-self.tail_chars:].rstrip()
+        if self.prefill:
+            return messages + [AIMessage(content=tail)]
+        return messages + [AIMessage(content=tail), HumanMessage(content=CONTINUE_PROMPT)]
+
+    def _merge(self, text: str, piece: str) -> str:
+        if not text:
+            return piece
+        if self.prefill:
+            return text.rstrip() + piece
+        return merge_continuation(text.rstrip(), piece)
+
+    def _log_truncated(self, text: str, attempt: int):
+        if attempt < self.max_continuations:
+            logger.warning(f"输出达到 max_tokens 上限被截断（已输出 {len(text)} 字符），开始第 {attempt + 1} 次续写")
+        else:
+            logger.warning(f"续写 {self.max_continuations} 次后输出仍被截断，返回已有内容")
+
+    @property
+    def _llm_kwargs(self) -> Dict[str, Any]:
+        """每次请求传给模型的额外参数"""
+        return {"hedge": self.hedge} if self.hedge else {}
+
+    def _cache_key(self, messages: List[BaseMessage]) -> Optional[str]:
+        """请求在响应缓存中的键，未启用缓存或该chain不使用缓存时为None"""
+        if not self.cache or registry.response_cache is None:
+            return None
+        return cache_key(dumps(messages), self.llm._get_llm_string(), self.prompt_version)
+
+    @staticmethod
+    def _cache_get(key: Optional[str]) -> Optional[BaseMessage]:
+        store = registry.response_cache
+        if key is None or store is None or cache_refreshing():
+            return None
+        generations = load_generations(store.get(key))
+        return generations[0].message if generations else None
+
+    @staticmethod
+    def _cache_put(key: Optional[str], text: str, metadata: Dict):
+        store = registry.response_cache
+        if key is None or store is None:
+            return
+        message = AIMessage(content=text, response_metadata=metadata)
+        store.put(key, dumps([ChatGeneration(message=message)]))
+
+    def _request(self, messages: List[BaseMessage], config: Optional[RunnableConfig]) -> BaseMessage:
+        key = self._cache_key(messages)
+        message = self._cache_get(key)
+        if message is None:
+            message = self.llm.invoke(messages, config, **self._llm_kwargs)
+            self._cache_put(key, message_text(message), message.response_metadata)
+        return message
+
+    async def _arequest(self, messages: List[BaseMessage], config: Optional[RunnableConfig]) -> BaseMessage:
+        key = self._cache_key(messages)
+        message = await asyncio.to_thread(self._cache_get, key)
+        if message is None:
+            message = await self.llm.ainvoke(messages, config, **self._llm_kwargs)
+            await asyncio.to_thread(self._cache_put, key, message_text(message), message.response_metadata)
+        return message
+
+    @staticmethod
+    def _cache_partial(monitor: Optional[StreamMonitor]) -> bool:
+        """流式请求中途被关闭时是否缓存已收到的部分：因复读停止的输出不缓存，否则重跑时会再次拿到复读的内容"""
+        return monitor is None or monitor.stop_reason != "repetition"
+
+    def _stream_request(self, messages: List[BaseMessage], config: Optional[RunnableConfig],
+                        monitor: Optional[StreamMonitor] = None) -> Iterator[BaseMessage]:
+        """流式请求，命中缓存时一次产出缓存的响应；中途被关闭时把已收到的部分按被截断的响应缓存，参见 _cache_partial"""
+        key = self._cache_key(messages)
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+        merged = None
+        try:
+            for chunk in self.llm.stream(messages, config, **self._llm_kwargs):
+                merged = chunk if merged is None else merged + chunk
+                yield chunk
+        except GeneratorExit:
+            if merged is not None and self._cache_partial(monitor):
+                self._cache_put(key, message_text(merged), {"stop_reason": "max_tokens"})
+            raise
+        if merged is not None:
+            self._cache_put(key, message_text(merged), merged.response_metadata)
+
+    async def _astream_request(self, messages: List[BaseMessage], config: Optional[RunnableConfig],
+                               monitor: Optional[StreamMonitor] = None) -> AsyncIterator[BaseMessage]:
+        """异步流式请求，参见 _stream_request；缓存读写在线程中进行，不阻塞事件循环"""
+        key = self._cache_key(messages)
+        cached = await asyncio.to_thread(self._cache_get, key)
+        if cached is not None:
+            yield cached
+            return
+        merged = None
+        try:
+            async for chunk in self.llm.astream(messages, config, **self._llm_kwargs):
+                merged = chunk if merged is None else merged + chunk
+                yield chunk
+        except GeneratorExit:
+            if merged is not None and self._cache_partial(monitor):
+                await asyncio.to_thread(self._cache_put, key, message_text(merged), {"stop_reason": "max_tokens"})
+            raise
+        if merged is not None:
+            await asyncio.to_thread(self._cache_put, key, message_text(merged), merged.response_metadata)
+
+    def _invoke_once(self, input: dict, config: Optional[RunnableConfig]) -> str:
+        messages = self.prompt.invoke(input, config).to_messages()
+        text = ""
+        for attempt in range(self.max_continuations + 1):
+            message = self._request(self._continuation_messages(messages, text), config)
+            text = self._merge(text, message_text(message))
+            if not is_truncated(message):
+                break
+            self._log_truncated(text, attempt)
+        return text
+
+    async def _ainvoke_once(self, input: dict, config: Optional[RunnableConfig]) -> str:
+        messages = (await self.prompt.ainvoke(input, config)).to_messages()
+        text = ""
+        for attempt in range(self.max_continuations + 1):
+            message = await self._arequest(self._continuation_messages(messages, text), config)
+            text = self._merge(text, message_text(message))
+            if not is_truncated(message):
+                break
+            self._log_truncated(text, attempt)
+        return text
+
+    def _stream_joined(self, input: dict, config: Optional[RunnableConfig],
+                       monitor: Optional[StreamMonitor] = None) -> Iterator[str]:
+        messages = self.prompt.invoke(input, config).to_messages()
+        joiner = _StreamJoiner(self)
+        for attempt in range(self.max_continuations + 1):
+            joiner.begin()
+            merged = None
+            request = self._stream_request(self._continuation_messages(messages, joiner.text), config, monitor)
+            with closing(request):
+                for chunk in request:
+                    merged = chunk if merged is None else merged + chunk
+                    output = joiner.feed(message_text(chunk))
+                    if output:
+                        yield output
+            output = joiner.end()
+            if output:
+                yield output
+            if merged is None or not is_truncated(merged):
+                break
+            self._log_truncated(joiner.text, attempt)
+        output = joiner.close()
+        if output:
+            yield output
+
+    async def _astream_joined(self, input: dict, config: Optional[RunnableConfig],
+                              monitor: Optional[StreamMonitor] = None) -> AsyncIterator[str]:
+        messages = (await self.prompt.ainvoke(input, config)).to_messages()
+        joiner = _StreamJoiner(self)
+        for attempt in range(self.max_continuations + 1):
+            joiner.begin()
+            merged = None
+            request = self._astream_request(self._continuation_messages(messages, joiner.text), config, monitor)
+            async with aclosing(request):
+                async for chunk in request:
+                    merged = chunk if merged is None else merged + chunk
+                    output = joiner.feed(message_text(chunk))
+                    if output:
+                        yield output
+            output = joiner.end()
+            if output:
+                yield output
+            if merged is None or not is_truncated(merged):
+                break
+            self._log_truncated(joiner.text, attempt)
+        output = joiner.close()
+        if output:
+            yield output
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        if self.monitor is None:
+            return self._invoke_once(input, config)
+        # 需要监控时改为流式请求，以便中途停止
+        return "".join(self.stream(input, config))
+
+    async def ainvoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        if self.monitor is None:
+            return await self._ainvoke_once(input, config)
+        return "".join([chunk async for chunk in self.astream(input, config)])
+
+    def stream(self, input: dict, config: Optional[RunnableConfig] = None,
+               **kwargs: Any) -> Iterator[str]:
+        """流式输出，续写内容接在被截断的输出之后继续产出；设置了监控时满足停止条件即取消请求"""
+        if self.monitor is None:
+            yield from self._stream_joined(input, config)
+            return
+        monitor = self.monitor(input)
+        chunks = self._stream_joined(input, config, monitor)
+        try:
+            for chunk in chunks:
+                output = monitor.feed(chunk)
+                if output:
+                    yield output
+                if monitor.stopped:
+                    return
+            output = monitor.flush()
+            if output:
+                yield output
+        finally:
+            # 关闭生成器会关闭底层的流式请求
+            chunks.close()
+
+    async def astream(self, input: dict, config: Optional[RunnableConfig] = None,
+                      **kwargs: Any) -> AsyncIterator[str]:
+        """异步流式输出，参见 stream"""
+        if self.monitor is None:
+            async for chunk in self._astream_joined(input, config):
+                yield chunk
+            return
+        monitor = self.monitor(input)
+        chunks = self._astream_joined(input, config, monitor)
+        try:
+            async for chunk in chunks:
+                output = monitor.feed(chunk)
+                if output:
+                    yield output
+                if monitor.stopped:
+                    return
+            output = monitor.flush()
+            if output:
+                yield output
+        finally:
+            await chunks.aclose()
@@ -1,5 +1,8 @@
+import json
 import os
+import shutil
 from datetime import datetime
+from typing import Dict, Optional
 
 class FileHandler:
     """文件处理工具类，统一管理文件路径和操作"""
@@ -20,7 +23,8 @@ class FileHandler:
             "outlines": os.path.join(self.base_dir, "outlines"),
             "chapters": os.path.join(self.base_dir, "chapters"),
             "volumes": os.path.join(self.base_dir, "volumes"),
-            "logs": os.path.join(self.base_dir, "logs")
+            "logs": os.path.join(self.base_dir, "logs"),
+            "checkpoints": os.path.join(self.base_dir, "checkpoints")
         }
         
         # 创建目录
@@ -67,6 +71,60 @@ class FileHandler:
         filename = f"volume_{volume_number}_{timestamp}.md"
         return os.path.join(self.dirs["volumes"], filename)
         
+    def get_checkpoint_dir(self, run_id: str) -> str:
+        """获取某次生成任务的断点目录
+        
+        Args:
+            run_id: 生成任务标识
+        """
+        return os.path.join(self.dirs["checkpoints"], run_id)
+        
+    def save_checkpoint(self, run_id: str, node: str, data: Dict) -> str:
+        """保存一个已完成节点的断点
+        
+        先写临时文件再替换，进程中断时不会留下半个文件。
+        
+        Args:
+            run_id: 生成任务标识
+            node: 节点名称
+            data: 节点数据
+            
+        Returns:
+            str: 断点文件路径
+        """
+        checkpoint_dir = self.get_checkpoint_dir(run_id)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        filepath = os.path.join(checkpoint_dir, f"{node}.json")
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, filepath)
+        return filepath
+        
+    def load_checkpoint(self, run_id: str, node: str) -> Optional[Dict]:
+        """读取节点断点
+        
+        Args:
+            run_id: 生成任务标识
+            node: 节点名称
+            
+        Returns:
+            Optional[Dict]: 节点数据，不存在时返回None
+        """
+        filepath = os.path.join(self.get_checkpoint_dir(run_id), f"{node}.json")
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+            
+    def clear_checkpoints(self, run_id: str) -> None:
+        """删除某次生成任务的全部断点
+        
+        Args:
+            run_id: 生成任务标识
+        """
+        shutil.rmtree(self.get_checkpoint_dir(run_id), ignore_errors=True)
+        
     def merge_chapters(self, chapter_files: list, output_path: str) -> None:
         """合并多个章节文件
         
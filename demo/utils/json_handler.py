@@ -0,0 +1,244 @@
+import json
+import logging
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def clean_json_response(response: str) -> str:
+    """去掉模型回复中的 ```json 代码块标记
+
+    Args:
+        response: 模型原始回复
+
+    Returns:
+        str: 清理后的JSON文本
+    """
+    return response.replace("```json", "").replace("```", "").strip()
+
+def repair_json(response: str) -> str:
+    """在本地修复模型输出中常见的JSON错误
+
+    处理以下情况：
+    - JSON前后的代码块标记和说明文字
+    - 对象或数组末尾多余的逗号
+    - 字符串中未转义的双引号和换行
+    - 输出被截断：丢弃最后一个不完整的元素并补齐括号
+
+    Args:
+        response: 模型原始回复
+
+    Returns:
+        str: 修复后的JSON文本
+    """
+    text = clean_json_response(response)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    text = text[min(starts):]
+
+    out: List[str] = []
+    stack: List[str] = []
+    # 截断时可以安全切断的位置：(输出长度, 当时未闭合的括号)
+    safe_points = []
+    in_string = False
+    escape = False
+    i = 0
+
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(char)
+            elif char == "\\":
+                escape = True
+                out.append(char)
+            elif char == '"':
+                j = i + 1
+                while j < len(text) and text[j] in " \t\r\n":
+                    j += 1
+                if j >= len(text) or text[j] in ",:}]":
+                    in_string = False
+                    out.append(char)
+                else:
+                    # 字符串内部未转义的引号
+                    out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            # 去掉结尾多余的逗号
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                out.append(stack.pop())
+            safe_points.append((len(out), list(stack)))
+            if not stack:
+                break
+        elif char == ",":
+            safe_points.append((len(out), list(stack)))
+            out.append(char)
+        else:
+            out.append(char)
+        i += 1
+
+    if not stack:
+        return "".join(out)
+
+    # 输出被截断，回退到最后一个完整元素之后并补齐括号
+    if not safe_points:
+        return text
+    length, open_brackets = safe_points[-1]
+    return "".join(out[:length]) + "".join(reversed(open_brackets))
+
+def parse_json_response(response: str) -> Dict:
+    """清理并解析模型返回的JSON
+
+    标准解析失败时先在本地修复再解析，仍然失败则抛出原始的解析错误。
+
+    Args:
+        response: 模型原始回复
+
+    Returns:
+        Dict: 解析后的字典
+    """
+    try:
+        return json.loads(clean_json_response(response))
+    except json.JSONDecodeError as e:
+        try:
+            result = json.loads(repair_json(response))
+        except json.JSONDecodeError:
+            raise e
+        logger.warning(f"JSON解析失败，已在本地修复: {e}")
+        return result
+
+class JsonArrayStreamParser:
+    """增量解析流式JSON中指定数组的元素
+
+    每次喂入一段模型输出，返回这段输出中刚刚闭合的数组元素对象。
+    只扫描新到达的字符，不会重复解析已经处理过的内容。
+    无法解析的元素会被跳过并记录在 failed 中，完整响应留给调用方整体解析。
+    """
+
+    def __init__(self, key: str):
+        """初始化解析器
+
+        Args:
+            key: 要增量解析的数组字段名，如 volumes、chapters
+        """
+        self.key = key
+        self.text = ""
+        self._pos = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._current_key: Optional[str] = None
+        self._stack: List[str] = []
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        # 解析失败而被跳过的元素数
+        self.failed = 0
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """喂入一段输出
+
+        Args:
+            chunk: 新到达的文本片段
+
+        Returns:
+            List[Dict]: 本次新闭合的数组元素
+        """
+        self.text += chunk
+        items = []
+        text = self.text
+
+        while self._pos < len(text):
+            char = text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start:self._pos]
+                self._pos += 1
+                continue
+
+            if not self._started:
+                # 忽略JSON之前的代码块标记等内容
+                self._started = char == "{"
+                if not self._started:
+                    self._pos += 1
+                    continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = self._pos + 1
+            elif char == ":":
+                self._current_key = self._last_string
+            elif char in "{[":
+                self._stack.append(char)
+                depth = len(self._stack)
+                if char == "[" and self._array_depth is None and self._current_key == self.key:
+                    self._array_depth = depth
+                elif char == "{" and self._array_depth is not None and depth == self._array_depth + 1:
+                    self._item_start = self._pos
+                self._current_key = None
+            elif char in "}]":
+                depth = len(self._stack)
+                if self._stack:
+                    self._stack.pop()
+                if char == "}" and self._item_start is not None and depth == self._array_depth + 1:
+                    try:
+                        items.append(parse_json_response(text[self._item_start:self._pos + 1]))
+                    except ValueError as e:
+                        self.failed += 1
+                        logger.warning(f"跳过无法解析的 {self.key} 元素: {e}")
+                    self._item_start = None
+                elif char == "]" and depth == self._array_depth:
+                    # 目标数组已结束，后续同名字段不再解析
+                    self._array_depth = -1
+            elif char == ",":
+                self._current_key = None
+            self._pos += 1
+
+        return items
+
+def iter_json_array(chunks: Iterator[str], key: str) -> Iterator[Dict]:
+    """从同步文本流中逐个取出数组元素
+
+    Args:
+        chunks: 文本片段迭代器，如 chain.stream(...)
+        key: 数组字段名
+    """
+    parser = JsonArrayStreamParser(key)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+async def aiter_json_array(chunks: AsyncIterator[str], key: str) -> AsyncIterator[Dict]:
+    """从异步文本流中逐个取出数组元素
+
+    Args:
+        chunks: 异步文本片段迭代器，如 chain.astream(...)
+        key: 数组字段名
+    """
+    parser = JsonArrayStreamParser(key)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
@@ -0,0 +1,343 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+def find_index_by_number(items: List[Dict], key: str, number: int) -> Optional[int]:
+    """按编号查找分卷或章节的位置
+    
+    模型返回的编号经常是"第一卷"、"第一章"这样的文本，无法与整数直接比较，
+    找不到编号相同的条目时按位置（从1开始）查找。
+    
+    Args:
+        items: 分卷或章节字典列表
+        key: 编号字段名，如 volume_number、chapter_number
+        number: 要查找的编号
+    
+    Returns:
+        Optional[int]: 条目在列表中的下标，不存在时返回None
+    """
+    for i, item in enumerate(items):
+        if str(item.get(key, "")).strip() == str(number):
+            return i
+    if 1 <= number <= len(items):
+        return number - 1
+    return None
+
+def find_by_number(items: List[Dict], key: str, number: int) -> Optional[Dict]:
+    """按编号查找分卷或章节
+    
+    Args:
+        items: 分卷或章节字典列表
+        key: 编号字段名，如 volume_number、chapter_number
+        number: 要查找的编号
+    
+    Returns:
+        Optional[Dict]: 找到的条目，不存在时返回None
+    """
+    index = find_index_by_number(items, key, number)
+    return None if index is None else items[index]
+
+def _write_json(filepath: str, data: Dict):
+    """先写临时文件再替换，中断时不会留下半个文件"""
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, filepath)
+
+def _hash_inputs(inputs: Dict) -> str:
+    """计算节点输入的哈希"""
+    payload = json.dumps(inputs, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _plan_chapter(chapter: Dict) -> Dict:
+    """章节在分卷分片中的规划（不含场景）"""
+    return {key: value for key, value in chapter.items() if key != "scenes"}
+
+def _read_json(filepath: str) -> Optional[Dict]:
+    """读取JSON文件，不存在时返回None"""
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class OutlineStore:
+    """按分卷、章节分片存储的大纲
+    
+    目录结构：
+        index.json              书籍信息、分卷信息以及各卷的章节目录（只有编号和标题）
+        volume_001.json         分卷章节规划（章节不含场景）
+        chapter_001_001.json    章节详细大纲
+    
+    查找某一章只需要读取索引和该章的分片，不会读取整本书。分片按位置（从1开始）命名。
+    
+    分卷的输入是索引中的书籍信息和该卷信息，章节的输入是分卷分片中该章的规划；
+    分片写入时把输入哈希记录在分片自身的 HASH_KEY 字段中，与内容一起原子替换，
+    之后输入被修改（或提示词版本变化）的分片会被判定为过期。
+    早期版本把哈希集中记录在 hashes.json 中，读取这类存储时仍会参考它。
+    """
+    
+    INDEX_FILE = "index.json"
+    # 早期版本集中记录输入哈希的文件
+    HASHES_FILE = "hashes.json"
+    HASH_KEY = "_input_hash"
+    
+    def __init__(self, root: str, version: str = ""):
+        """初始化分片存储
+        
+        Args:
+            root: 存储目录
+            version: 生成分片所用的提示词版本，参与输入哈希的计算
+        """
+        self.root = root
+        self.version = version
+        self._index: Optional[Dict] = None
+        self._hashes: Optional[Dict] = None
+    
+    def exists(self) -> bool:
+        """存储目录中是否已有索引"""
+        return os.path.exists(os.path.join(self.root, self.INDEX_FILE))
+    
+    def clear(self):
+        """删除整个存储目录"""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._index = None
+        self._hashes = None
+    
+    def volume_path(self, volume_index: int) -> str:
+        """分卷分片路径（序号从1开始）"""
+        return os.path.join(self.root, f"volume_{volume_index:03d}.json")
+    
+    def chapter_path(self, volume_index: int, chapter_index: int) -> str:
+        """章节分片路径（序号从1开始）"""
+        return os.path.join(self.root, f"chapter_{volume_index:03d}_{chapter_index:03d}.json")
+    
+    def load_index(self) -> Dict:
+        """读取索引，读取后缓存在内存中"""
+        if self._index is None:
+            self._index = _read_json(os.path.join(self.root, self.INDEX_FILE))
+            if self._index is None:
+                raise FileNotFoundError(f"大纲索引不存在: {self.root}")
+        return self._index
+    
+    def _save_index(self, index: Dict):
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(os.path.join(self.root, self.INDEX_FILE), index)
+        self._index = index
+    
+    def _load_hashes(self) -> Dict:
+        """早期版本记录的输入哈希，没有 hashes.json 时为空字典"""
+        if self._hashes is None:
+            self._hashes = _read_json(os.path.join(self.root, self.HASHES_FILE)) or {}
+        return self._hashes
+        
+    def _write_shard(self, path: str, data: Dict, input_hash: str):
+        """写入分片，输入哈希与内容写在同一个文件中"""
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(path, {**data, self.HASH_KEY: input_hash})
+        
+    def _read_shard(self, path: str) -> Optional[Dict]:
+        """读取分片内容，去掉其中记录的输入哈希"""
+        data = _read_json(path)
+        if data is not None:
+            data.pop(self.HASH_KEY, None)
+        return data
+        
+    def _remove_chapters(self, volume_index: int, start: int, end: int):
+        """删除分卷中序号在 [start, end) 范围内的章节分片"""
+        for chapter_index in range(start, end):
+            path = self.chapter_path(volume_index, chapter_index)
+            if os.path.exists(path):
+                os.remove(path)
+        
+    def volume_input_hash(self, volume_index: int) -> str:
+        """根据索引中的书籍信息和分卷信息计算分卷的输入哈希"""
+        index = self.load_index()
+        return _hash_inputs({
+            "book": {key: value for key, value in index.items() if key != "volumes"},
+            "volume": {
+                key: value for key, value in index["volumes"][volume_index - 1].items()
+                if key != "chapters"
+            },
+            "version": self.version
+        })
+        
+    def chapter_input_hash(self, volume_index: int, chapter_index: int,
+                           planned: Optional[Dict] = None) -> str:
+        """根据分卷分片中的章节规划计算章节的输入哈希
+        
+        Args:
+            volume_index: 分卷序号（从1开始）
+            chapter_index: 章节序号（从1开始）
+            planned: 该章在分卷分片中的规划，调用方已有时传入，避免重新读取分卷分片
+        """
+        if planned is None:
+            planned = self.read_volume(volume_index)["chapters"][chapter_index - 1]
+        return _hash_inputs({
+            "chapter": planned,
+            "version": self.version
+        })
+        
+    def is_stale(self, volume_index: int, chapter_index: Optional[int] = None,
+                 planned: Optional[Dict] = None) -> bool:
+        """判断分片是否需要重新生成
+        
+        分片不存在，或者记录的输入哈希与当前输入不一致时为过期。
+        分片中没有哈希时参考早期版本的 hashes.json：其中也没有记录的视为过期，
+        整个存储都没有 hashes.json（记录哈希之前写入的存储）时视为最新。
+        
+        Args:
+            volume_index: 分卷序号（从1开始）
+            chapter_index: 章节序号（从1开始），为None时判断分卷分片
+            planned: 判断章节分片时该章的规划，参见 chapter_input_hash
+            
+        Returns:
+            bool: 是否过期
+        """
+        if chapter_index is None:
+            path = self.volume_path(volume_index)
+        else:
+            path = self.chapter_path(volume_index, chapter_index)
+        shard = _read_json(path)
+        if shard is None:
+            return True
+        
+        recorded = shard.get(self.HASH_KEY)
+        if recorded is None:
+            if not os.path.exists(os.path.join(self.root, self.HASHES_FILE)):
+                return False
+            recorded = self._load_hashes().get(os.path.basename(path))
+            if recorded is None:
+                return True
+        if chapter_index is None:
+            return recorded != self.volume_input_hash(volume_index)
+        return recorded != self.chapter_input_hash(volume_index, chapter_index, planned)
+        
+    def get_book(self) -> Dict:
+        """获取书籍大纲，分卷中不含章节列表"""
+        index = self.load_index()
+        book = {key: value for key, value in index.items() if key != "volumes"}
+        book["volumes"] = [
+            {key: value for key, value in volume.items() if key != "chapters"}
+            for volume in index["volumes"]
+        ]
+        return book
+    
+    def locate(self, volume_number: int, chapter_number: Optional[int] = None):
+        """根据卷号、章节号在索引中定位分片序号
+        
+        Returns:
+            Tuple[int, Optional[int]]: 分卷序号和章节序号（从1开始），章节未展开或不存在时为None
+        """
+        volumes = self.load_index()["volumes"]
+        volume_index = find_index_by_number(volumes, "volume_number", volume_number)
+        if volume_index is None:
+            raise ValueError(f"未找到第 {volume_number} 卷")
+        if chapter_number is None:
+            return volume_index + 1, None
+        chapter_index = find_index_by_number(
+            volumes[volume_index].get("chapters", []), "chapter_number", chapter_number
+        )
+        return volume_index + 1, None if chapter_index is None else chapter_index + 1
+    
+    def read_volume(self, volume_index: int) -> Optional[Dict]:
+        """按序号读取分卷分片，未展开时返回None"""
+        return self._read_shard(self.volume_path(volume_index))
+    
+    def read_chapter(self, volume_index: int, chapter_index: int) -> Optional[Dict]:
+        """按序号读取章节分片，未展开时返回None"""
+        return self._read_shard(self.chapter_path(volume_index, chapter_index))
+    
+    def get_volume(self, volume_number: int) -> Optional[Dict]:
+        """按卷号读取分卷信息及章节规划，未展开时返回None"""
+        volume_index, _ = self.locate(volume_number)
+        volume_outline = self.read_volume(volume_index)
+        if volume_outline is None:
+            return None
+        volume = self.get_book()["volumes"][volume_index - 1]
+        volume.update(volume_outline)
+        return volume
+    
+    def get_chapter(self, volume_number: int, chapter_number: int) -> Optional[Dict]:
+        """按卷号、章节号读取章节详细大纲，只读取索引和该章分片"""
+        volume_index, chapter_index = self.locate(volume_number, chapter_number)
+        if chapter_index is None:
+            return None
+        return self.read_chapter(volume_index, chapter_index)
+    
+    def save_book(self, book_outline: Dict):
+        """保存书籍大纲到索引，已有的章节目录保留"""
+        old_volumes = self.load_index()["volumes"] if self.exists() else []
+        index = {key: value for key, value in book_outline.items() if key != "volumes"}
+        index["volumes"] = []
+        for i, volume in enumerate(book_outline["volumes"]):
+            entry = {key: value for key, value in volume.items() if key != "chapters"}
+            if i < len(old_volumes) and "chapters" in old_volumes[i]:
+                entry["chapters"] = old_volumes[i]["chapters"]
+            index["volumes"].append(entry)
+        self._save_index(index)
+    
+    def save_volume(self, volume_index: int, volume: Dict):
+        """保存分卷章节规划，并把章节目录写入索引
+        
+        分卷自身的信息以索引为准，分片中只保存章节规划。新的规划比原来章节少时，
+        多出的旧章节分片会被删除，以免之后被误当作新章节的大纲。
+        """
+        self._write_volume(volume_index, volume)
+        self._save_index(self.load_index())
+    
+    def _write_volume(self, volume_index: int, volume: Dict):
+        """写入分卷分片并更新内存中的索引，索引由调用方写回"""
+        self._write_shard(self.volume_path(volume_index), {
+            "chapters": [_plan_chapter(chapter) for chapter in volume["chapters"]]
+        }, self.volume_input_hash(volume_index))
+        index = self.load_index()
+        old_count = len(index["volumes"][volume_index - 1].get("chapters", []))
+        self._remove_chapters(volume_index, len(volume["chapters"]) + 1, old_count + 1)
+        index["volumes"][volume_index - 1]["chapters"] = [
+            {
+                "chapter_number": chapter.get("chapter_number", ""),
+                "chapter_title": chapter.get("chapter_title", "")
+            }
+            for chapter in volume["chapters"]
+        ]
+    
+    def save_chapter(self, volume_index: int, chapter_index: int, chapter: Dict,
+                     planned: Optional[Dict] = None):
+        """保存章节详细大纲分片
+        
+        Args:
+            volume_index: 分卷序号（从1开始）
+            chapter_index: 章节序号（从1开始）
+            chapter: 章节详细大纲
+            planned: 该章在分卷分片中的规划，参见 chapter_input_hash
+        """
+        self._write_shard(self.chapter_path(volume_index, chapter_index), chapter,
+                          self.chapter_input_hash(volume_index, chapter_index, planned))
+    
+    def save(self, outline: Dict):
+        """把一份完整或部分展开的大纲字典按分片写入，索引只在最后写入一次"""
+        self.save_book(outline)
+        for volume_index, volume in enumerate(outline["volumes"], 1):
+            if "chapters" not in volume:
+                continue
+            self._write_volume(volume_index, volume)
+            for chapter_index, chapter in enumerate(volume["chapters"], 1):
+                if "scenes" in chapter:
+                    self.save_chapter(volume_index, chapter_index, chapter, _plan_chapter(chapter))
+        self._save_index(self.load_index())
+    
+    def load(self) -> Dict:
+        """读取全部分片，组装为完整的大纲字典"""
+        book = self.get_book()
+        for volume_index, volume in enumerate(book["volumes"], 1):
+            volume_outline = self.read_volume(volume_index)
+            if volume_outline is None:
+                continue
+            volume.update(volume_outline)
+            for chapter_index, chapter in enumerate(volume["chapters"], 1):
+                chapter_outline = self.read_chapter(volume_index, chapter_index)
+                if chapter_outline is not None:
+                    chapter.update(chapter_outline)
+        return book
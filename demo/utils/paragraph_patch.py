@@ -0,0 +1,245 @@
+import logging
+import re
+from typing import Dict, List, Tuple
+
+from utils.json_handler import parse_json_response
+from utils.text_metrics import DIALOGUE_PATTERN, count_words, split_paragraphs
+
+logger = logging.getLogger(__name__)
+
+# 支持的段落修改操作：替换某段，或在某段之后插入新段落（段落编号0表示插入到开头）
+EDIT_OPS = ("replace", "insert_after")
+# 续写式扩展只允许插入，原文保持不变
+INSERT_OPS = ("insert_after",)
+# 段落：一行中去掉首尾空白后的内容，与 split_paragraphs 的拆分结果一致
+PARAGRAPH_PATTERN = re.compile(r"\S(?:[^\n]*\S)?")
+
+def number_paragraphs(paragraphs: List[str], start: int = 1) -> str:
+    """给段落加上编号，供模型按编号引用
+
+    Args:
+        paragraphs: 段落列表
+        start: 第一个段落的编号
+
+    Returns:
+        str: 形如 "[P1] 第一段" 的编号文本，段落之间空一行
+    """
+    return "\n\n".join(f"[P{i}] {paragraph}" for i, paragraph in enumerate(paragraphs, start))
+
+def join_paragraphs(paragraphs: List[str], separators: List[str] = None) -> str:
+    """把段落列表拼回正文
+
+    Args:
+        paragraphs: 段落列表
+        separators: split_layout 返回的原文分隔，与段落一一对应时按原文的换行、空行和缩进拼接，
+            为None时段落之间空一行
+
+    Returns:
+        str: 正文
+    """
+    if separators is None:
+        return "\n\n".join(paragraphs)
+    return separators[0] + "".join(p + sep for p, sep in zip(paragraphs, separators[1:]))
+
+def split_layout(text: str) -> Tuple[List[str], List[str]]:
+    """拆分段落并保留段落之间的原始分隔（换行、空行和缩进）
+
+    Returns:
+        Tuple[List[str], List[str]]: 段落列表和分隔列表，分隔比段落多一个：
+            第一个在第一段之前，其余依次在各段之后
+    """
+    paragraphs, separators, position = [], [], 0
+    for match in PARAGRAPH_PATTERN.finditer(text):
+        separators.append(text[position:match.start()])
+        paragraphs.append(match.group())
+        position = match.end()
+    separators.append(text[position:])
+    return paragraphs, separators
+
+def parse_edits(response: str, ops: Tuple[str, ...] = EDIT_OPS) -> List[Dict]:
+    """解析模型返回的段落修改，丢弃格式不正确的条目
+
+    Args:
+        response: 模型原始回复，形如 {"edits": [{"op": "replace", "id": 3, "text": "..."}]}
+        ops: 允许的修改操作，其余操作会被丢弃
+
+    Returns:
+        List[Dict]: 修改列表
+
+    Raises:
+        ValueError: 回复不是JSON，或其中的 edits 不是列表
+    """
+    result = parse_json_response(response)
+    edits = result.get("edits", []) if isinstance(result, dict) else result
+    if not isinstance(edits, list):
+        raise ValueError(f"段落修改不是列表: {edits!r}")
+    valid = []
+    for edit in edits:
+        try:
+            op, paragraph_id, text = edit["op"], int(edit["id"]), str(edit["text"]).strip()
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"忽略格式不正确的段落修改: {edit}")
+            continue
+        if op not in ops or not text:
+            logger.warning(f"忽略不支持的段落修改: {edit}")
+            continue
+        valid.append({"op": op, "id": paragraph_id, "text": text})
+    return valid
+
+def _plan_edits(paragraphs: List[str], edits: List[Dict]) -> Tuple[Dict[int, str], Dict[int, List[str]]]:
+    """把修改整理为按段落编号索引的替换和插入，编号超出范围的修改会被忽略"""
+    replacements: Dict[int, str] = {}
+    insertions: Dict[int, List[str]] = {}
+    for edit in edits:
+        paragraph_id = edit["id"]
+        if edit["op"] == "replace" and 1 <= paragraph_id <= len(paragraphs):
+            replacements[paragraph_id] = edit["text"]
+        elif edit["op"] == "insert_after" and 0 <= paragraph_id <= len(paragraphs):
+            # 同一位置重复插入相同的段落只保留一次
+            if edit["text"] not in insertions.setdefault(paragraph_id, []):
+                insertions[paragraph_id].append(edit["text"])
+        else:
+            logger.warning(f"段落编号超出范围，忽略修改: {edit}")
+    return replacements, insertions
+
+def apply_edits(paragraphs: List[str], edits: List[Dict]) -> List[str]:
+    """在本地把段落修改应用到原文
+
+    编号都指向原文中的段落，与修改的先后顺序无关；同一段落多次替换时以最后一次为准，
+    同一位置的多次插入按出现顺序排列，相同的插入只保留一次。编号超出范围的修改会被忽略。
+
+    Args:
+        paragraphs: 原文段落列表
+        edits: parse_edits 返回的修改列表
+
+    Returns:
+        List[str]: 修改后的段落列表
+    """
+    return apply_edits_with_layout(paragraphs, [""] + ["\n\n"] * len(paragraphs), edits)[0]
+
+def apply_edits_with_layout(paragraphs: List[str], separators: List[str],
+                            edits: List[Dict]) -> Tuple[List[str], List[str]]:
+    """应用段落修改并保留原文的段落分隔，参见 apply_edits
+
+    未修改的段落之间沿用原文的分隔；插入的段落使用插入位置处原文的段间分隔。
+
+    Args:
+        paragraphs: split_layout 返回的段落列表
+        separators: split_layout 返回的分隔列表
+        edits: parse_edits 返回的修改列表
+
+    Returns:
+        Tuple[List[str], List[str]]: 修改后的段落列表和分隔列表，可交给 join_paragraphs 拼回正文
+    """
+    replacements, insertions = _plan_edits(paragraphs, edits)
+    # 段落之间的分隔，不含开头和结尾；只有一段时使用空行
+    inner = separators[1:-1] or ["\n\n"]
+
+    def gap(i: int) -> str:
+        return inner[min(max(i, 1), len(inner)) - 1]
+
+    result, result_separators = [], [separators[0]]
+    for text in insertions.get(0, []):
+        result.append(text)
+        result_separators.append(gap(1))
+    for i, paragraph in enumerate(paragraphs, 1):
+        result.append(replacements.get(i, paragraph))
+        for text in insertions.get(i, []):
+            result_separators.append(gap(i))
+            result.append(text)
+        result_separators.append(separators[i])
+    return result, result_separators
+
+def patch_inputs(content: str, flagged: List[int], issues: List[str]) -> Tuple[List[str], Dict]:
+    """把正文拆成编号段落，构造补丁式优化chain的输入
+
+    Args:
+        content: 章节正文
+        flagged: 本地检查标记的段落编号（从1开始）
+        issues: 本地检查发现的问题
+
+    Returns:
+        Tuple[List[str], Dict]: 段落列表和chain输入
+    """
+    paragraphs = split_paragraphs(content)
+    return paragraphs, {
+        "paragraphs": number_paragraphs(paragraphs),
+        "flagged": "、".join(f"P{i}" for i in flagged) or "无",
+        "issues": "；".join(issues) or "无"
+    }
+
+def _spread(items: List[int], count: int) -> List[int]:
+    """从有序列表中均匀选取count项"""
+    if len(items) <= count:
+        return list(items)
+    step = len(items) / count
+    return [items[int(step * k + step / 2)] for k in range(count)]
+
+def insertion_points(paragraphs: List[str], max_points: int = 6) -> List[int]:
+    """选择续写式扩展的插入位置，返回段落编号（在该段之后插入）
+
+    优先选择含对话的段落之后（对话节拍之间适合补充动作、神态和心理描写），
+    在全章范围内均匀分布；含对话的段落不够时用均匀间隔的段落补足。不在最后一段之后插入，
+    以免破坏章节结尾。
+
+    Args:
+        paragraphs: 段落列表
+        max_points: 最多选择的插入位置数
+
+    Returns:
+        List[int]: 升序排列的段落编号
+    """
+    candidates = list(range(1, len(paragraphs)))
+    dialogue = [i for i in candidates if DIALOGUE_PATTERN.search(paragraphs[i - 1])]
+    if len(dialogue) >= max_points:
+        return _spread(dialogue, max_points)
+    dialogue_set = set(dialogue)
+    others = [i for i in candidates if i not in dialogue_set]
+    return sorted(dialogue + _spread(others, max_points - len(dialogue)))
+
+def expand_inputs(content: str, target_words: int, max_points: int = 6) -> Tuple[List[str], Dict]:
+    """把正文拆成编号段落并选择插入位置，构造续写式扩展chain的输入
+
+    Args:
+        content: 章节正文
+        target_words: 目标字数
+        max_points: 最多选择的插入位置数
+
+    Returns:
+        Tuple[List[str], Dict]: 段落列表和chain输入
+    """
+    paragraphs = split_paragraphs(content)
+    points = insertion_points(paragraphs, max_points)
+    missing_words = max(target_words - count_words(content), 0)
+    return paragraphs, {
+        "paragraphs": number_paragraphs(paragraphs),
+        "points": "、".join(f"P{i}" for i in points) or f"P{len(paragraphs)}",
+        "missing_words": missing_words,
+        "words_per_point": max(missing_words // max(len(points), 1), 1)
+    }
+
+def apply_patch_response(content: str, paragraphs: List[str], response: str,
+                         ops: Tuple[str, ...] = EDIT_OPS) -> str:
+    """解析模型返回的段落修改并应用到正文，无法解析时保留原文
+
+    未修改部分的换行、空行和缩进与原文保持一致。
+
+    Args:
+        content: 原章节正文
+        paragraphs: patch_inputs 或 expand_inputs 返回的段落列表
+        response: 模型原始回复
+        ops: 允许的修改操作
+
+    Returns:
+        str: 修改后的正文
+    """
+    try:
+        edits = parse_edits(response, ops)
+    except (ValueError, TypeError) as e:
+        logger.warning(f"段落修改解析失败，保留原文: {e}")
+        return content
+    logger.info(f"应用 {len(edits)} 处段落修改（共 {len(paragraphs)} 段）")
+    if not edits:
+        return content
+    layout_paragraphs, separators = split_layout(content)
+    return join_paragraphs(*apply_edits_with_layout(layout_paragraphs, separators, edits))
@@ -0,0 +1,125 @@
+import logging
+from typing import Dict, List
+
+from utils.text_metrics import (
+    SENTENCE_PATTERN, count_words, estimate_tokens, repeated_sentence_ratio, dialogue_ratio,
+    split_paragraphs
+)
+
+logger = logging.getLogger(__name__)
+
+class PassController:
+    """决定每个章节需要执行哪些生成步骤
+    
+    初始生成之后，扩展（expand）和优化（enhance）两个步骤都要把整章内容重新输入并输出一遍，
+    是章节成本的主要部分。控制器按中文字数判断是否需要扩展，按本地质量指标判断是否需要优化，
+    不需要的步骤直接跳过，并累计估算节省的token数。
+    """
+    
+    PASSES = ("generate", "expand", "enhance")
+    
+    def __init__(self, expand_ratio: float = 0.9, max_repetition: float = 0.05,
+                 min_dialogue_ratio: float = 0.05, max_paragraph_words: int = 600):
+        """初始化步骤控制器
+        
+        Args:
+            expand_ratio: 字数低于目标字数的该比例时才扩展
+            max_repetition: 重复句子比例超过该值时需要优化
+            min_dialogue_ratio: 对话比例低于该值时需要优化
+            max_paragraph_words: 单段字数超过该值时需要优化
+        """
+        self.expand_ratio = expand_ratio
+        self.max_repetition = max_repetition
+        self.min_dialogue_ratio = min_dialogue_ratio
+        self.max_paragraph_words = max_paragraph_words
+        self.passes_run = {name: 0 for name in self.PASSES}
+        self.passes_skipped = {name: 0 for name in self.PASSES}
+        self.tokens_spent = 0
+        self.tokens_saved = 0
+    
+    def needs_expand(self, text: str, target_words: int) -> bool:
+        """字数明显不足目标字数时才需要扩展"""
+        words = count_words(text)
+        if words < target_words * self.expand_ratio:
+            logger.info(f"当前字数 {words}，低于目标字数 {target_words}，需要扩展")
+            return True
+        return False
+    
+    def quality_issues(self, text: str) -> List[str]:
+        """用本地指标检查内容质量，返回发现的问题"""
+        issues = []
+        repetition = repeated_sentence_ratio(text)
+        if repetition > self.max_repetition:
+            issues.append(f"重复句子比例 {repetition:.0%}")
+        dialogue = dialogue_ratio(text)
+        if dialogue < self.min_dialogue_ratio:
+            issues.append(f"对话比例 {dialogue:.0%}")
+        longest = max((count_words(p) for p in split_paragraphs(text)), default=0)
+        if longest > self.max_paragraph_words:
+            issues.append(f"最长段落 {longest} 字")
+        return issues
+    
+    def flag_paragraphs(self, text: str) -> List[int]:
+        """标记需要重写的段落，返回段落编号（从1开始）
+        
+        过长的段落，以及包含在全文中重复出现的句子的段落会被标记。
+        """
+        paragraphs = split_paragraphs(text)
+        sentence_counts: Dict[str, int] = {}
+        paragraph_sentences = []
+        for paragraph in paragraphs:
+            sentences = [s.strip() for s in SENTENCE_PATTERN.findall(paragraph)]
+            sentences = [s for s in sentences if count_words(s) >= 4]
+            paragraph_sentences.append(sentences)
+            for sentence in sentences:
+                sentence_counts[sentence] = sentence_counts.get(sentence, 0) + 1
+        
+        flagged = []
+        for i, (paragraph, sentences) in enumerate(zip(paragraphs, paragraph_sentences), 1):
+            if (count_words(paragraph) > self.max_paragraph_words
+                    or any(sentence_counts[s] > 1 for s in sentences)):
+                flagged.append(i)
+        return flagged
+    
+    def needs_enhance(self, text: str) -> bool:
+        """本地质量指标发现问题时才需要优化"""
+        issues = self.quality_issues(text)
+        if issues:
+            logger.info(f"内容需要优化: {'，'.join(issues)}")
+            return True
+        return False
+    
+    def should_run(self, name: str, text: str, target_words: int = 0) -> bool:
+        """判断是否执行指定步骤，初始生成总是执行"""
+        if name == "expand":
+            return self.needs_expand(text, target_words)
+        if name == "enhance":
+            return self.needs_enhance(text)
+        return True
+    
+    def record_run(self, name: str, input_text: str, output_text: str, prompt_tokens: int = 0):
+        """记录一次实际执行的步骤及其估算token数，prompt_tokens 为提示词模板固定部分的token数"""
+        self.passes_run[name] += 1
+        self.tokens_spent += prompt_tokens + estimate_tokens(input_text) + estimate_tokens(output_text)
+    
+    def record_skip(self, name: str, text: str, target_words: int = 0):
+        """记录一次跳过的步骤，按输入全文、输出至少与输入等长（且不少于目标字数）估算节省的token数
+        
+        目标字数按原文每字的token数换算为token数。
+        """
+        self.passes_skipped[name] += 1
+        input_tokens = estimate_tokens(text)
+        words = count_words(text)
+        tokens_per_word = input_tokens / words if words else 1.0
+        output_tokens = max(input_tokens, int(target_words * tokens_per_word))
+        self.tokens_saved += input_tokens + output_tokens
+        logger.info(f"跳过 {name} 步骤，约节省 {input_tokens + output_tokens} tokens")
+    
+    def report(self) -> Dict:
+        """返回累计的执行、跳过次数以及token统计"""
+        return {
+            "passes_run": dict(self.passes_run),
+            "passes_skipped": dict(self.passes_skipped),
+            "tokens_spent": self.tokens_spent,
+            "tokens_saved": self.tokens_saved
+        }
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+async def cancel_tasks(tasks: List[asyncio.Task]):
+    """取消任务并等待它们结束，已完成的任务不受影响"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _gather_or_cancel(tasks: List[asyncio.Task]) -> List[Any]:
+    """等待所有任务完成，任一任务出错时取消其余任务后抛出"""
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        await cancel_tasks(tasks)
+        raise
+
+class ReorderBuffer:
+    """重排缓冲区
+    
+    并行任务按任意顺序完成后放入，缓冲区只在前面的序号全部到齐后才按顺序交给回调，
+    因此输出顺序与输入顺序一致，同时已就绪的前缀可以尽早输出。
+    """
+    
+    def __init__(self, on_ready: Callable[[Any], None], start: int = 0):
+        """初始化重排缓冲区
+        
+        Args:
+            on_ready: 按顺序接收结果的回调
+            start: 第一个结果的序号
+        """
+        self.on_ready = on_ready
+        self.next_index = start
+        self._pending: Dict[int, Any] = {}
+        
+    def put(self, index: int, item: Any):
+        """放入一个已完成的结果，并输出所有已连续就绪的结果"""
+        self._pending[index] = item
+        while self.next_index in self._pending:
+            self.on_ready(self._pending.pop(self.next_index))
+            self.next_index += 1
+            
+    @property
+    def pending(self) -> int:
+        """已完成但仍在等待前序结果的数量"""
+        return len(self._pending)
+        
+async def run_worker_pool(items: List[Any],
+                          worker: Callable[[int, Any], Awaitable[Any]],
+                          max_concurrency: int = 5,
+                          on_ready: Optional[Callable[[Any], None]] = None) -> List[Any]:
+    """在并发上限内并行处理一组相互独立的任务
+    
+    Args:
+        items: 待处理项列表
+        worker: 处理单个项的协程函数，参数为序号和项
+        max_concurrency: 同时进行的最大任务数
+        on_ready: 按输入顺序接收结果的回调，经重排缓冲区后调用
+        
+    Returns:
+        List[Any]: 与输入顺序一致的结果列表
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    buffer = ReorderBuffer(on_ready) if on_ready else None
+    
+    async def run(index: int, item: Any) -> Any:
+        async with semaphore:
+            result = await worker(index, item)
+        if buffer:
+            buffer.put(index, result)
+        return result
+        
+    return await _gather_or_cancel([
+        asyncio.create_task(run(index, item)) for index, item in enumerate(items)
+    ])
+    
+async def run_pipeline(producer: AsyncIterator[Any],
+                       consumer: Callable[[Any], Awaitable[Any]],
+                       num_workers: int = 2,
+                       max_pending: int = 2) -> List[Any]:
+    """生产者/消费者流水线
+    
+    生产者（如逐章生成详细大纲）每产出一项就放入有界队列，多个消费者（如生成章节正文）
+    并行从队列中取出处理。队列满时生产者会等待，避免大纲生成跑得过于靠前。
+    总耗时接近生产和消费两者中较慢的一方，而不是两者之和。
+    
+    Args:
+        producer: 按顺序产出待处理项的异步迭代器
+        consumer: 处理单个项的协程函数
+        num_workers: 并行消费者数量
+        max_pending: 队列中等待处理的最大项数
+    
+    Returns:
+        List[Any]: 与生产顺序一致的处理结果列表
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    results: Dict[int, Any] = {}
+    
+    async def produce():
+        index = 0
+        async for item in producer:
+            await queue.put((index, item))
+            index += 1
+        # 每个消费者一个结束标记
+        for _ in range(num_workers):
+            await queue.put(None)
+    
+    async def work():
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            index, item = entry
+            results[index] = await consumer(item)
+    
+    # 任一环节出错时取消其余任务，避免生产者阻塞在已满的队列上
+    tasks = [asyncio.create_task(produce())]
+    tasks.extend(asyncio.create_task(work()) for _ in range(num_workers))
+    await _gather_or_cancel(tasks)
+    
+    return [results[index] for index in sorted(results)]
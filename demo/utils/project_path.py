@@ -0,0 +1,7 @@
+import os
+import sys
+
+# demo 从自身目录运行，把项目根目录加入搜索路径，以便使用 src/ 下与主项目共用的模块
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
@@ -0,0 +1,142 @@
+import logging
+from collections import Counter, deque
+from typing import Callable, Dict, Optional
+
+from utils.text_metrics import char_ngrams, count_words, repetition_score
+
+logger = logging.getLogger(__name__)
+
+class StreamMonitor:
+    """流式输出的停止条件
+
+    正文模式下输出按段落放行：一段完整结束（遇到换行）后才交给下游，因此中途停止时得到的总是完整的段落。
+    - 长度控制：已放行的字数达到目标字数的 target_ratio 倍后，在段落边界处停止
+    - 复读检测：新段落与最近放行内容的n元组重合比例，或未结束段落的滚动n元组重复比例超过阈值时停止，
+      该段落不会放行
+
+    JSON模式下只做复读检测，输出放行到最后一个闭合的对象为止，停止时未闭合的元素被丢弃，
+    剩余部分由JSON修复补齐括号。
+    """
+
+    def __init__(self, target_words: int = 0, target_ratio: float = 1.1, ngram: int = 10,
+                 window: int = 1000, max_repetition: float = 0.5, prose: bool = True):
+        """初始化流式监控
+
+        Args:
+            target_words: 目标字数，为0时不做长度控制
+            target_ratio: 字数达到目标字数的该倍数时停止
+            ngram: 复读检测使用的字符n元组长度
+            window: 复读检测的滚动窗口字符数
+            max_repetition: 重复比例超过该值时判定为复读
+            prose: 是否为正文（按段落放行）；为False时按JSON输出处理
+        """
+        self.target_words = target_words
+        self.target_ratio = target_ratio
+        self.ngram = ngram
+        self.window = window
+        self.max_repetition = max_repetition
+        self.prose = prose
+        self.stop_reason: Optional[str] = None
+        self.words = 0
+        self._buffer = ""
+        # JSON模式下最近输出的内容，用于滚动复读检测
+        self._tail = ""
+        self._unchecked = 0
+        # 最近放行内容的n元组
+        self._recent: deque = deque()
+        self._recent_counts: Counter = Counter()
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_reason is not None
+
+    def _stop(self, reason: str, detail: str):
+        self.stop_reason = reason
+        logger.info(f"停止流式输出（{detail}），已输出 {self.words} 字")
+
+    def _remember(self, text: str):
+        for gram in char_ngrams(text, self.ngram):
+            self._recent.append(gram)
+            self._recent_counts[gram] += 1
+        while len(self._recent) > self.window:
+            gram = self._recent.popleft()
+            self._recent_counts[gram] -= 1
+            if not self._recent_counts[gram]:
+                del self._recent_counts[gram]
+
+    def _overlap(self, paragraph: str) -> float:
+        """段落的n元组在最近放行内容中出现的比例"""
+        grams = char_ngrams(paragraph, self.ngram)
+        if len(grams) < self.ngram:
+            return 0.0
+        return sum(gram in self._recent_counts for gram in grams) / len(grams)
+
+    def _loops(self, text: str) -> bool:
+        """滚动窗口内的内容是否在循环，每收到 ngram 个字符检查一次"""
+        if len(text) < self.window or self._unchecked < self.ngram:
+            return False
+        self._unchecked = 0
+        return repetition_score(text[-self.window:], self.ngram) > self.max_repetition
+
+    def feed(self, chunk: str) -> str:
+        """接收一段流式输出，返回可以放行的文本；判定停止后 stopped 为 True"""
+        if self.stopped:
+            return ""
+        self._buffer += chunk
+        self._unchecked += len(chunk)
+        if not self.prose:
+            self._tail = (self._tail + chunk)[-self.window:]
+            if self._loops(self._tail):
+                self._stop("repetition", "检测到复读")
+                return ""
+            # 只放行到最后一个闭合的对象为止
+            end = self._buffer.rfind("}") + 1
+            released, self._buffer = self._buffer[:end], self._buffer[end:]
+            return released
+
+        released = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            overlap = self._overlap(line)
+            if overlap > self.max_repetition:
+                self._stop("repetition", f"段落与前文重复 {overlap:.0%}")
+                break
+            released.append(line + "\n")
+            self._remember(line)
+            self.words += count_words(line)
+            if self.target_words and self.words >= self.target_words * self.target_ratio:
+                self._stop("length", f"达到目标字数 {self.target_words}")
+                break
+        if not self.stopped and self._loops(self._buffer):
+            self._stop("repetition", "检测到段落内复读")
+        return "".join(released)
+
+    def flush(self) -> str:
+        """输出正常结束时放行剩余的内容"""
+        if self.stopped:
+            return ""
+        remaining, self._buffer = self._buffer, ""
+        self.words += count_words(remaining)
+        return remaining
+
+def prose_monitor(target_key: Optional[str] = None, source_key: Optional[str] = None,
+                  source_ratio: float = 1.3) -> Callable[[Dict], StreamMonitor]:
+    """返回为正文chain创建监控器的函数
+
+    Args:
+        target_key: chain输入中目标字数的字段名
+        source_key: chain输入中原文的字段名，用于改写类chain：输出字数达到原文字数的 source_ratio 倍时停止
+        source_ratio: 相对原文字数的上限倍数
+
+    两者都为None时只做复读检测。
+    """
+    def create(inputs: Dict) -> StreamMonitor:
+        if source_key:
+            return StreamMonitor(target_words=count_words(str(inputs.get(source_key, ""))), target_ratio=source_ratio)
+        target = str(inputs.get(target_key, "")).strip() if target_key else ""
+        return StreamMonitor(target_words=int(target) if target.isdigit() else 0)
+    return create
+
+def json_monitor(inputs: Dict) -> StreamMonitor:
+    """为输出JSON的chain创建只做复读检测的监控器"""
+    return StreamMonitor(prose=False)
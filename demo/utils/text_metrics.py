@@ -0,0 +1,64 @@
+import re
+from typing import List
+
+# 字数和token的统计与 src/ 共用同一个模块
+import utils.project_path  # noqa: F401
+from src.utils.text_metrics import CJK_PATTERN, cached_token_estimate, count_cjk, count_words, estimate_tokens
+
+# 句子结束符
+SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+[。！？!?]*")
+# 中文引号内的对话
+DIALOGUE_PATTERN = re.compile(r"“[^”]*”|「[^」]*」")
+
+def prompt_tokens(prompt) -> int:
+    """估计提示词模板中固定部分的token数
+    
+    模板文本不随输入变化，按模板文本缓存统计结果，每次调用只需对变量部分计数。
+    
+    Args:
+        prompt: 提示词模板（PromptTemplate 或 ChatPromptTemplate）
+    
+    Returns:
+        int: 估计的token数
+    """
+    messages = getattr(prompt, "messages", None) or [prompt]
+    templates = [getattr(getattr(m, "prompt", m), "template", None) for m in messages]
+    return sum(cached_token_estimate(t) for t in templates if isinstance(t, str))
+
+def split_paragraphs(text: str) -> List[str]:
+    """按空行或换行拆分段落，去掉空段落"""
+    return [paragraph.strip() for paragraph in text.split("\n") if paragraph.strip()]
+
+def repeated_sentence_ratio(text: str) -> float:
+    """重复句子所占比例，用于发现模型复读
+    
+    只统计字数不少于4的句子，比例为重复出现的句子数除以句子总数。
+    """
+    sentences = [s.strip() for s in SENTENCE_PATTERN.findall(text)]
+    sentences = [s for s in sentences if count_words(s) >= 4]
+    if not sentences:
+        return 0.0
+    return 1 - len(set(sentences)) / len(sentences)
+
+def dialogue_ratio(text: str) -> float:
+    """引号内对话的字数占全文字数的比例"""
+    total = count_words(text)
+    if total == 0:
+        return 0.0
+    dialogue = sum(count_words(match) for match in DIALOGUE_PATTERN.findall(text))
+    return dialogue / total
+
+def char_ngrams(text: str, n: int) -> List[str]:
+    """按字符切分的n元组，忽略空白"""
+    text = re.sub(r"\s", "", text)
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+def repetition_score(text: str, n: int = 10) -> float:
+    """字符n元组的重复比例，用于发现流式输出中的复读
+
+    一段长度为L的内容在长度为W的文本中循环时，比例约为 1 - L/W；正常行文中较长的n元组很少重复，比例接近0。
+    """
+    grams = char_ngrams(text, n)
+    if not grams:
+        return 0.0
+    return 1 - len(set(grams)) / len(grams)
@@ -1,4 +1,4 @@
-from langchain_openai import ChatOpenAI
+from src.llm import get_llm
 from langchain_core.tools import tool
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
@@ -6,7 +6,6 @@ from langchain.memory import ConversationBufferMemory
 from dotenv import load_dotenv
 from typing import Dict, List, Optional
 import networkx as nx
-import os
 
 load_dotenv('agent.env')
 
@@ -20,11 +19,7 @@ class NovelAgent:
             model_name: Name of the LLM model to use
             temperature: Temperature for text generation
         """
-        self.llm = ChatOpenAI(
-            model=model_name,
-            temperature=temperature,
-            api_key=os.getenv("OPENAI_API_KEY"),
-        )
+        self.llm = get_llm("openai", model=model_name, cache=True, temperature=temperature)
         
         # Initialize core components
         self.character_graph = nx.Graph()  # Character relationship graph
@@ -3,12 +3,12 @@ from dataclasses import dataclass, field
 from datetime import datetime
 from src.characters.character_system import CharacterSystem
 from src.world.world_builder import WorldBuilder
-from langchain_openai import ChatOpenAI
+from src.utils.text_metrics import count_words
+from src.llm import get_llm
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 import json
 import uuid
-import os
 
 
 @dataclass
@@ -84,12 +84,8 @@ class StoryEngine:
         self.chapters: List[Chapter] = []
         self.current_chapter: Optional[Chapter] = None
         
-        # Initialize LLM
-        self.llm = ChatOpenAI(
-            model=model_name,
-            temperature=temperature,
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+        # Initialize LLM (shared connection pool)
+        self.llm = get_llm("openai", model=model_name, cache=True, temperature=temperature)
         
         # Initialize prompt templates
         self._init_prompts()
@@ -408,8 +404,8 @@ Generate natural and character-appropriate dialogue that reflects their personal
             scene_text = self.generate_scene_text(scene, style)
             chapter_parts.append(scene_text)
             
-            # Update word count
-            chapter.word_count += len(scene_text.split())
+            # Update word count (CJK-aware: one per character, one per Latin word)
+            chapter.word_count += count_words(scene_text)
         
         chapter_text = "\n\n".join(chapter_parts)
         
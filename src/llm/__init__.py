@@ -0,0 +1,17 @@
+"""
+Shared LLM clients, rate limits, hedging and response cache for the novel writing system.
+"""
+
+from .cache import ChatModelCache, ResponseCache, cache_key, cache_refreshing, load_generations, refresh_cache
+from .hedging import HedgeConfig, Hedger, LatencyHistogram, hedging
+from .limiter import AdaptiveLimiter, LimitConfig, TokenBucket, limited
+from .singleflight import SingleFlight, coalescing
+from .registry import PROVIDERS, LLMRegistry, PoolConfig, Provider, get_llm, registry
+
+__all__ = [
+    'ChatModelCache', 'ResponseCache', 'cache_key', 'cache_refreshing', 'load_generations', 'refresh_cache',
+    'HedgeConfig', 'Hedger', 'LatencyHistogram', 'hedging',
+    'AdaptiveLimiter', 'LimitConfig', 'TokenBucket', 'limited',
+    'SingleFlight', 'coalescing',
+    'PROVIDERS', 'LLMRegistry', 'PoolConfig', 'Provider', 'get_llm', 'registry'
+]
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# loads() warns on every call while it is in beta; cached responses are deserialized on every hit
+warnings.filterwarnings("ignore", message="The function `loads` is in beta", category=LangChainBetaWarning)
+
+_refreshing: ContextVar[bool] = ContextVar("llm_cache_refreshing", default=False)
+
+@contextmanager
+def refresh_cache() -> Iterator[None]:
+    """Ignore cached responses for the calls made inside the block
+
+    Fresh responses still overwrite the cached ones. Use it when retrying a
+    request whose cached response turned out to be unusable (e.g. failed to
+    parse); otherwise the retry would be served the same response again.
+    """
+    token = _refreshing.set(True)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+def cache_refreshing() -> bool:
+    """Whether the current call runs inside refresh_cache()"""
+    return _refreshing.get()
+
+def cache_key(prompt: str, llm_string: str, prompt_version: str = "") -> str:
+    """Key of a cached response
+
+    Args:
+        prompt: Serialized messages sent to the model
+        llm_string: Serialized model configuration (model, temperature, max_tokens, ...)
+        prompt_version: Version of the prompt template, bump it to invalidate old responses
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    payload = json.dumps([llm_string, prompt, prompt_version], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_generations(value: Optional[str]) -> Optional[list]:
+    """Deserialize a stored response, treating unreadable entries as misses"""
+    if value is None:
+        return None
+    try:
+        return loads(value, allowed_objects="core")
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cached response: {e}")
+        return None
+
+class ResponseCache:
+    """Disk-backed LLM response store with least-recently-used eviction
+
+    Responses live in a SQLite database in WAL mode, so several worker
+    processes can read and write the same cache concurrently. Every hit
+    refreshes the entry's last-used time; once the stored responses exceed
+    max_bytes (or max_entries), the least recently used ones are evicted down
+    to EVICT_TO of the limits. Triggers keep the total size and entry count in
+    a one-row table, so checking the limits after a write costs O(1); the
+    eviction itself runs in an immediate transaction, so only one process
+    evicts at a time.
+    """
+
+    # eviction frees space down to this share of the limits, so it does not run on every write
+    EVICT_TO = 0.9
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024,
+                 max_entries: Optional[int] = None):
+        """Open (or create) the cache database
+
+        Args:
+            path: SQLite database file
+            max_bytes: Upper bound for the total size of stored responses
+            max_entries: Optional upper bound for the number of stored responses
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        with self._transaction(conn):
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS totals ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), bytes INTEGER NOT NULL, entries INTEGER NOT NULL)"
+            )
+            # databases written before the totals table existed are counted once here
+            conn.execute(
+                "INSERT OR IGNORE INTO totals (id, bytes, entries) "
+                "SELECT 1, COALESCE(SUM(size), 0), COUNT(*) FROM responses"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN "
+                "UPDATE totals SET bytes = bytes + NEW.size, entries = entries + 1 WHERE id = 1; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN "
+                "UPDATE totals SET bytes = bytes - OLD.size, entries = entries - 1 WHERE id = 1; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS responses_resize AFTER UPDATE OF size ON responses BEGIN "
+                "UPDATE totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 1; END"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connection of the current thread; SQLite connections must not be shared between threads"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+        """Write transaction that takes the database lock up front"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _totals(conn: sqlite3.Connection) -> Tuple[int, int]:
+        return conn.execute("SELECT bytes, entries FROM totals WHERE id = 1").fetchone()
+
+    def _over(self, total: int, count: int, share: float = 1.0) -> bool:
+        """Whether the stored responses exceed share of the limits"""
+        return total > self.max_bytes * share or (
+            self.max_entries is not None and count > self.max_entries * share
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the stored response and mark it as recently used, or None on a miss"""
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store a response, evicting least recently used entries when over the size cap"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO responses (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, "
+            "last_used = excluded.last_used",
+            (key, value, len(value.encode("utf-8")), now, now)
+        )
+        if self._over(*self._totals(conn)):
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        evicted = 0
+        with self._transaction(conn):
+            # another process may have evicted while we waited for the lock
+            total, count = self._totals(conn)
+            while self._over(total, count, self.EVICT_TO):
+                rows = conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 100").fetchall()
+                if not rows:
+                    break
+                for key, size in rows:
+                    if not self._over(total, count, self.EVICT_TO):
+                        break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    count -= 1
+                    evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} cached responses, {count} left ({total} bytes)")
+
+    def clear(self) -> None:
+        """Remove every stored response"""
+        self._connection().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, int]:
+        """Hit and miss counts of this process plus the size of the store"""
+        total, count = self._totals(self._connection())
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+class ChatModelCache(BaseCache):
+    """LangChain cache backed by a ResponseCache
+
+    Set as a chat model's `cache`, it serves every invoke/generate call of that
+    model from disk. Responses are stored as serialized generations, the same
+    format ContinuationChain writes for streamed responses, so entries written
+    by either path are readable by the other. The store is resolved on every
+    call, so models built before the cache was enabled use it too; while no
+    store is available every lookup is a miss, and so is every lookup made
+    inside refresh_cache().
+    """
+
+    def __init__(self, store: Callable[[], Optional[ResponseCache]], prompt_version: str = ""):
+        """Initialize the adapter
+
+        Args:
+            store: Returns the response store to use, or None when caching is off
+            prompt_version: Version mixed into every key
+        """
+        self.store = store
+        self.prompt_version = prompt_version
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        store = self.store()
+        if store is None or cache_refreshing():
+            return None
+        return load_generations(store.get(cache_key(prompt, llm_string, self.prompt_version)))
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        store = self.store()
+        if store is not None:
+            store.put(cache_key(prompt, llm_string, self.prompt_version), dumps(list(return_val)))
+
+    def clear(self, **kwargs: Any) -> None:
+        store = self.store()
+        if store is not None:
+            store.clear()
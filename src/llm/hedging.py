@@ -0,0 +1,371 @@
+import asyncio
+import bisect
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, Type
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+# chat models that continue a trailing assistant message, which lets a stalled stream be resumed
+PREFILL_LLM_TYPES = {"anthropic-chat"}
+
+@dataclass
+class HedgeConfig:
+    """When a hedged request gets its duplicate and how many duplicates may be sent
+
+    quantile applies to whole responses and first chunks; stall_quantile to
+    the gaps between chunks of a stream, which are many per response, so a
+    much higher quantile is needed to flag only a few streams.
+    """
+    quantile: float = 0.95
+    min_samples: int = 20
+    min_delay: float = 1.0
+    stall_quantile: float = 0.999
+    min_stall_delay: float = 5.0
+    budget: float = 0.05
+    max_credit: float = 5.0
+
+class LatencyHistogram:
+    """Latency histogram with logarithmic buckets and exponential forgetting
+
+    Buckets grow by `growth` from `low` seconds on, so quantiles are accurate
+    to about 10% from fractions of a second to hours with a few dozen
+    counters. Once `window` samples are recorded all counts are halved, which
+    lets the histogram follow latency that drifts over a long run.
+    """
+
+    def __init__(self, low: float = 0.05, high: float = 3600.0, growth: float = 1.2, window: int = 500):
+        count = int(math.ceil(math.log(high / low, growth))) + 1
+        self.bounds: List[float] = [low * growth ** i for i in range(count)]
+        self.counts: List[float] = [0.0] * (count + 1)
+        self.total = 0.0
+        self.samples = 0
+        self.window = window
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.total += 1
+            self.samples += 1
+            if self.total >= self.window:
+                self.counts = [c / 2 for c in self.counts]
+                self.total /= 2
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding quantile q, None while the histogram is empty"""
+        with self._lock:
+            if not self.total:
+                return None
+            rank = q * self.total
+            seen = 0.0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.bounds[min(i, len(self.bounds) - 1)]
+            return self.bounds[-1]
+
+class Hedger:
+    """Launches a duplicate of a slow request and keeps whichever finishes first
+
+    Each named chain gets its own latency histograms: whole responses, the
+    first chunk of streams, and the gaps between later chunks. Once a request
+    has taken longer than the chain's learned p95 (HedgeConfig.quantile), a
+    second identical request is sent; the first to complete wins and the
+    other is cancelled, which closes its connection so the provider stops
+    generating.
+
+    Streams race the same way to their first chunk. Chunks already passed on
+    cannot be taken back, so a stream that stalls later (no chunk for longer
+    than the stall threshold) is hedged with a request that continues the
+    text received so far, when the caller can build one; whichever produces
+    the next chunk first carries on.
+
+    Extra spend is capped by a credit budget: every request earns `budget`
+    credits (at most max_credit are banked) and every duplicate costs one, so
+    at most about budget x requests are duplicated. Each attempt's latency is
+    measured from its own start, so the winner's latency is what gets recorded.
+
+    Only async calls are hedged; a blocked thread cannot be cancelled, so
+    sync calls just feed the histograms.
+    """
+
+    # gaps between chunks are far more numerous than responses, so their histogram forgets more slowly
+    WINDOWS = {"gap": 20000}
+
+    def __init__(self, config: Optional[HedgeConfig] = None):
+        """Initialize the hedger
+
+        Args:
+            config: Hedge settings, defaults to HedgeConfig()
+        """
+        self.config = config or HedgeConfig()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._credit = self.config.max_credit
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def histogram(self, name: str, kind: str) -> LatencyHistogram:
+        """Histogram of a chain; kind is "generate", "first_chunk" or "gap" """
+        with self._lock:
+            histogram = self._histograms.get((name, kind))
+            if histogram is None:
+                histogram = self._histograms[(name, kind)] = LatencyHistogram(window=self.WINDOWS.get(kind, 500))
+            return histogram
+
+    def _count(self) -> None:
+        """Count a request and earn its hedge credit"""
+        with self._lock:
+            self.requests += 1
+            self._credit = min(self.config.max_credit, self._credit + self.config.budget)
+
+    def _delay(self, histogram: LatencyHistogram, stall: bool = False) -> Optional[float]:
+        """Seconds after which a request (or a stalled stream) is hedged, None while too few samples are known"""
+        if histogram.samples < self.config.min_samples:
+            return None
+        if stall:
+            return max(self.config.min_stall_delay, histogram.quantile(self.config.stall_quantile))
+        return max(self.config.min_delay, histogram.quantile(self.config.quantile))
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self._credit < 1:
+                return False
+            self._credit -= 1
+            self.hedged += 1
+            return True
+
+    def timed(self, name: str, fn: Callable[[], ChatResult]) -> ChatResult:
+        """Run a sync request and record its latency"""
+        self._count()
+        started = time.monotonic()
+        result = fn()
+        self.histogram(name, "generate").record(time.monotonic() - started)
+        return result
+
+    def timed_stream(self, name: str, fn: Callable[[], Iterator[ChatGenerationChunk]]) -> Iterator[ChatGenerationChunk]:
+        """Run a sync streaming request and record the latency of its first chunk and the gaps after it"""
+        self._count()
+        first, gaps = self.histogram(name, "first_chunk"), self.histogram(name, "gap")
+        last = time.monotonic()
+        chunks = fn()
+        try:
+            for i, chunk in enumerate(chunks):
+                now = time.monotonic()
+                (gaps if i else first).record(now - last)
+                yield chunk
+                last = time.monotonic()
+        finally:
+            chunks.close()
+
+    async def _race(self, name: str, start: Callable[[], Awaitable[Any]], delay: Optional[float],
+                    congested: Callable[[], bool], hedge: Optional[Callable[[], Awaitable[Any]]] = None,
+                    started: Optional[float] = None) -> Tuple[Any, int, float]:
+        """Run start(), adding hedge() (default: start()) once it is slower than delay
+
+        No duplicate is sent while congested() is true: a request waiting for a
+        rate limit slot is slow because of us, and a duplicate would only add load.
+
+        Args:
+            started: When the primary started, for one that is already running
+
+        Returns:
+            Tuple[Any, int, float]: The first successful result, the index of the attempt
+                that produced it (0 for the primary, 1 for the hedge) and that attempt's own latency
+        """
+        attempts = [asyncio.ensure_future(start())]
+        launched = [time.monotonic() if started is None else started]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=max(0.0, delay - (time.monotonic() - launched[0])))
+                if not done and not congested() and self._spend():
+                    logger.info(f"Hedging {name}: nothing after {delay:.1f}s, sending a hedge request")
+                    attempts.append(asyncio.ensure_future((hedge or start)()))
+                    launched.append(time.monotonic())
+            pending = set(attempts)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        index = attempts.index(task)
+                        if index:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result(), index, time.monotonic() - launched[index]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+
+    async def run(self, name: str, start: Callable[[], Awaitable[ChatResult]],
+                  congested: Callable[[], bool] = lambda: False) -> ChatResult:
+        """Run an async request of chain `name`, hedged once it is slower than the chain's threshold"""
+        self._count()
+        histogram = self.histogram(name, "generate")
+        result, _, elapsed = await self._race(name, start, self._delay(histogram), congested)
+        histogram.record(elapsed)
+        return result
+
+    async def stream(self, name: str, start: Callable[[], AsyncIterator[ChatGenerationChunk]],
+                     congested: Callable[[], bool] = lambda: False,
+                     resume: Optional[Callable[[str], AsyncIterator[ChatGenerationChunk]]] = None
+                     ) -> AsyncIterator[ChatGenerationChunk]:
+        """Run an async streaming request of chain `name`, hedged until its first chunk and on stalls
+
+        Args:
+            start: Opens the stream
+            congested: Whether the model's requests are held back by its rate limits
+            resume: Opens a stream that continues after the given text; without
+                it, streams are only hedged until their first chunk
+        """
+        self._count()
+        first_histogram, gap_histogram = self.histogram(name, "first_chunk"), self.histogram(name, "gap")
+        streams: List[AsyncIterator[ChatGenerationChunk]] = []
+
+        async def proceed(chunks: AsyncIterator[ChatGenerationChunk]):
+            return chunks, await _next(chunks)
+
+        def opener(open_stream: Callable[[], AsyncIterator[ChatGenerationChunk]]):
+            def first():
+                chunks = open_stream()
+                streams.append(chunks)
+                return proceed(chunks)
+            return first
+
+        try:
+            (chunks, chunk), _, elapsed = await self._race(
+                name, opener(start), self._delay(first_histogram), congested
+            )
+            first_histogram.record(elapsed)
+            text: List[str] = []
+            while chunk is not None:
+                yield chunk
+                text.append(chunk.text)
+                received = time.monotonic()
+                delay = self._delay(gap_histogram, stall=True) if resume is not None else None
+                if delay is None:
+                    chunk = await _next(chunks)
+                    gap_histogram.record(time.monotonic() - received)
+                    continue
+                received_text = "".join(text)
+                (next_chunks, chunk), index, elapsed = await self._race(
+                    name, lambda: proceed(chunks), delay, congested,
+                    hedge=opener(lambda: resume(received_text)), started=received
+                )
+                if index:
+                    logger.info(f"Hedging {name}: continuing from the hedge after a stall")
+                else:
+                    gap_histogram.record(elapsed)
+                chunks = next_chunks
+        finally:
+            for chunks in streams:
+                await chunks.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hedge counters and the current threshold of every chain"""
+        with self._lock:
+            histograms = dict(self._histograms)
+        thresholds = {
+            f"{name}/{kind}": round(histogram.quantile(
+                self.config.stall_quantile if kind == "gap" else self.config.quantile
+            ) or 0.0, 2)
+            for (name, kind), histogram in histograms.items()
+        }
+        return {"requests": self.requests, "hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                "thresholds": thresholds}
+
+async def _next(chunks: AsyncIterator[ChatGenerationChunk]) -> Optional[ChatGenerationChunk]:
+    """Next chunk of a stream, None once it has ended"""
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def _lstrip(chunks: AsyncIterator[ChatGenerationChunk]) -> AsyncIterator[ChatGenerationChunk]:
+    """Drop the leading whitespace of a stream's text"""
+    stripping = True
+    try:
+        async for chunk in chunks:
+            if stripping and isinstance(chunk.message.content, str):
+                content = chunk.message.content.lstrip()
+                stripping = not content
+                chunk = ChatGenerationChunk(message=chunk.message.model_copy(update={"content": content}),
+                                            generation_info=chunk.generation_info)
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+def hedging(cls: Type[BaseChatModel], hedger: Hedger,
+            congested: Callable[[BaseChatModel], bool] = lambda llm: False) -> Type[BaseChatModel]:
+    """Subclass a chat model class so calls made with `hedge=<chain name>` are hedged
+
+    Calls without the hedge argument pass straight through. Streams of models
+    in PREFILL_LLM_TYPES are also hedged when they stall midway, by a request
+    that prefills the text received so far.
+
+    Args:
+        cls: Chat model class
+        hedger: Hedger holding the latency histograms and the budget
+        congested: Whether a model's requests are currently held back by its rate limits
+
+    Returns:
+        Type[BaseChatModel]: The hedging subclass
+    """
+
+    class Hedging(cls):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+            name = kwargs.pop("hedge", None)
+            call = lambda: super(Hedging, self)._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return call() if name is None else hedger.timed(name, call)
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+            name = kwargs.pop("hedge", None)
+            call = lambda: super(Hedging, self)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return await (call() if name is None else hedger.run(name, call, lambda: congested(self)))
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+            name = kwargs.pop("hedge", None)
+            call = lambda: super(Hedging, self)._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return call() if name is None else hedger.timed_stream(name, call)
+
+        def _astream(self, messages, stop=None, run_manager=None,
+                     **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+            name = kwargs.pop("hedge", None)
+            call = lambda messages=messages: super(Hedging, self)._astream(
+                messages, stop=stop, run_manager=run_manager, **kwargs
+            )
+            if name is None:
+                return call()
+
+            def resume(text: str) -> AsyncIterator[ChatGenerationChunk]:
+                # the text received so far becomes the start of the assistant turn
+                prefill = text.rstrip()
+                if not prefill:
+                    return _lstrip(call()) if text else call()
+                last = messages[-1] if messages else None
+                if isinstance(last, AIMessage) and isinstance(last.content, str):
+                    resumed = [*messages[:-1], AIMessage(content=last.content + prefill)]
+                else:
+                    resumed = [*messages, AIMessage(content=prefill)]
+                # the trailing whitespace was passed on already, the continuation may repeat it
+                return _lstrip(call(resumed)) if prefill != text else call(resumed)
+
+            resumable = self._llm_type in PREFILL_LLM_TYPES
+            return hedger.stream(name, call, lambda: congested(self), resume if resumable else None)
+
+    Hedging.__name__ = Hedging.__qualname__ = cls.__name__
+    Hedging.__module__ = cls.__module__
+    return Hedging
@@ -0,0 +1,498 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from src.utils.text_metrics import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 429 is the rate limit, 529 Anthropic's "overloaded"; both mean "send less"
+OVERLOAD_STATUS = {429, 529}
+TRANSIENT_STATUS = {408, 409, 500, 502, 503, 504}
+
+@dataclass
+class LimitConfig:
+    """Throughput limits of one provider model and how the concurrency window adapts
+
+    Requests are only paced when requests_per_minute / tokens_per_minute are
+    set, usually to the account tier's published limits; None leaves that
+    dimension unmetered.
+    """
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    initial_concurrency: int = 4
+    min_concurrency: int = 1
+    max_concurrency: int = 32
+    decrease_factor: float = 0.5
+    latency_decrease_factor: float = 0.8
+    latency_tolerance: float = 2.0
+    expected_output_tokens: int = 1000
+    max_retries: int = 4
+    base_backoff: float = 1.0
+    max_backoff: float = 60.0
+
+class TokenBucket:
+    """Bucket refilled at `per_minute` units per minute, holding at most one minute's worth
+
+    Reservations are taken immediately and may push the balance below zero;
+    the caller then waits until the debt is paid back. That keeps callers in
+    arrival order and lets a request larger than the bucket through once.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket
+
+        Returns:
+            float: Seconds to wait before the reserved amount may be used
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Settle a reservation: take more (positive) or give back (negative) once the real cost is known"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+def _status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None and isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+    return status
+
+def is_overload(error: BaseException) -> bool:
+    """Whether the provider rejected the request because we are sending too much"""
+    return _status(error) in OVERLOAD_STATUS or type(error).__name__ in ("RateLimitError", "OverloadedError")
+
+def is_transient(error: BaseException) -> bool:
+    """Whether the request failed for a reason that a later retry may not hit"""
+    if isinstance(error, (httpx.TransportError, TimeoutError)):
+        return True
+    return _status(error) in TRANSIENT_STATUS or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from the Retry-After header"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+def message_tokens(messages: List[BaseMessage]) -> int:
+    """Estimated input tokens of a request"""
+    return sum(estimate_tokens(m.content if isinstance(m.content, str) else str(m.content)) for m in messages)
+
+def usage_tokens(message: Any) -> Tuple[Optional[int], int]:
+    """Input and output tokens of a response, from its usage metadata when the provider reports it"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    output = usage.get("output_tokens")
+    # partial streams may carry the input usage but no output count yet
+    if not output:
+        content = getattr(message, "content", "")
+        output = estimate_tokens(content if isinstance(content, str) else str(content))
+    return usage.get("input_tokens"), output
+
+class AdaptiveLimiter:
+    """Paces the requests of one provider model and adapts how many run at once
+
+    Two token buckets meter requests per minute and (input + output) tokens
+    per minute, when those limits are configured. Output tokens are reserved
+    up front from a running average and settled against the reported usage
+    afterwards. On top of that, an
+    AIMD window bounds the requests in flight: every healthy response adds
+    1/window (one slot per round trip), a 429/529 multiplies the window by
+    decrease_factor and pauses every request of the model for the Retry-After
+    time, and recent latency (smoothed, outliers clipped) rising above
+    latency_tolerance times the slower-moving baseline shrinks it by
+    latency_decrease_factor. Only one decrease is applied per round of
+    requests, so a burst of rejections does not collapse the window to the
+    minimum.
+
+    Rejected and transient failures are retried here with exponential backoff
+    and jitter; the registry turns off SDK-internal retries so that every
+    rejection is seen by the limiter.
+    """
+
+    def __init__(self, name: str, config: Optional[LimitConfig] = None):
+        """Initialize the limiter
+
+        Args:
+            name: Name used in logs, usually provider/model
+            config: Limits, defaults to LimitConfig()
+        """
+        self.name = name
+        self.config = config = config or LimitConfig()
+        self.requests = TokenBucket(config.requests_per_minute) if config.requests_per_minute else None
+        self.tokens = TokenBucket(config.tokens_per_minute) if config.tokens_per_minute else None
+        self.window = float(config.initial_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        self.retries = 0
+        self._waiters: Deque[Future] = deque()
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency_baseline: Optional[float] = None
+        self._latency_recent: Optional[float] = None
+        self._expected_output = float(config.expected_output_tokens)
+
+    # -- concurrency window --
+
+    def _enter(self) -> Optional[Future]:
+        """Take a slot, or return a future that resolves once a slot is handed over"""
+        with self._lock:
+            if not self._waiters and self.in_flight < max(1, int(self.window)):
+                self.in_flight += 1
+                return None
+            future = Future()
+            self._waiters.append(future)
+            return future
+
+    def _grant(self) -> None:
+        """Hand free slots to waiters; called with the lock held"""
+        while self._waiters and self.in_flight < max(1, int(self.window)):
+            self.in_flight += 1
+            self._waiters.popleft().set_result(None)
+
+    def _exit(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._grant()
+
+    def _abandon(self, future: Future) -> None:
+        """A waiter gave up; return its slot if one was already handed over"""
+        with self._lock:
+            if future in self._waiters:
+                self._waiters.remove(future)
+                return
+        self._exit()
+
+    def _acquire(self) -> None:
+        future = self._enter()
+        if future is not None:
+            future.result()
+
+    async def _aacquire(self) -> None:
+        future = self._enter()
+        if future is None:
+            return
+        try:
+            await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+
+    # -- pacing and feedback --
+
+    def _reserve(self, input_tokens: int) -> Tuple[float, float]:
+        """Reserve one request and its tokens
+
+        Returns:
+            Tuple[float, float]: Tokens reserved and seconds to wait before sending
+        """
+        reserved = input_tokens + self._expected_output
+        wait = self._paused_until - time.monotonic()
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(reserved))
+        if wait > 0:
+            self.throttled += 1
+        return reserved, max(0.0, wait)
+
+    def _decrease(self, started: float, factor: float, reason: str) -> None:
+        with self._lock:
+            # requests sent before the last decrease reflect the old window
+            if started < self._last_decrease:
+                return
+            self._last_decrease = time.monotonic()
+            self.window = max(float(self.config.min_concurrency), self.window * factor)
+        logger.info(f"{self.name}: {reason}, concurrency window down to {self.window:.1f}")
+
+    def _settle(self, reserved: float, message: Any, complete: bool = True) -> int:
+        """Settle a request's token reservation against what it used
+
+        Returns:
+            int: Output tokens of the response
+        """
+        input_tokens, output_tokens = usage_tokens(message)
+        with self._lock:
+            used = (input_tokens if input_tokens is not None else reserved - self._expected_output) + output_tokens
+            # a stream cut short says little about how long responses usually are
+            if complete:
+                self._expected_output = 0.8 * self._expected_output + 0.2 * output_tokens
+        if self.tokens is not None:
+            self.tokens.adjust(used - reserved)
+        return output_tokens
+
+    def _succeeded(self, started: float, reserved: float, message: Any, complete: bool = True) -> None:
+        """Settle a finished request and feed its latency to the window
+
+        complete is False for a stream the caller closed before its end; its
+        partial output still tells how fast the provider was generating.
+        """
+        elapsed = time.monotonic() - started
+        output_tokens = self._settle(reserved, message, complete)
+
+        # seconds per output token, with a fixed allowance for time to first token
+        latency = elapsed / (output_tokens + 100)
+        with self._lock:
+            baseline, recent = self._latency_baseline, self._latency_recent
+            rising = False
+            if baseline is None:
+                self._latency_baseline = self._latency_recent = latency
+            else:
+                # clip outliers so that a single stalled response does not count as a trend
+                latency = min(latency, baseline * self.config.latency_tolerance * 2)
+                recent = self._latency_recent = 0.8 * recent + 0.2 * latency
+                self._latency_baseline = 0.95 * baseline + 0.05 * recent
+                rising = recent > baseline * self.config.latency_tolerance
+            if not rising:
+                self.window = min(float(self.config.max_concurrency), self.window + 1.0 / self.window)
+                self._grant()
+        if rising:
+            self._decrease(started, self.config.latency_decrease_factor, "latency rising")
+
+    def _failed(self, error: BaseException, started: float, reserved: float, attempt: int) -> Optional[float]:
+        """Account for a failed attempt
+
+        Returns:
+            Optional[float]: Seconds to wait before retrying, or None when the error is final
+        """
+        # a rejected request used none of its tokens
+        if self.tokens is not None:
+            self.tokens.adjust(-reserved)
+        overload = is_overload(error)
+        if (not overload and not is_transient(error)) or attempt >= self.config.max_retries:
+            return None
+        backoff = min(self.config.max_backoff, self.config.base_backoff * 2 ** attempt)
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(backoff / 2, backoff)
+        if overload:
+            self._decrease(started, self.config.decrease_factor, f"rejected with {_status(error) or type(error).__name__}")
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        self.retries += 1
+        logger.warning(f"{self.name}: {type(error).__name__}, retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    # -- wrapped calls --
+
+    def call(self, fn: Callable[[], ChatResult], input_tokens: int) -> ChatResult:
+        """Run a request under the limits, retrying rejections and transient failures"""
+        self._acquire()
+        try:
+            attempt = 0
+            while True:
+                reserved, wait = self._reserve(input_tokens)
+                time.sleep(wait)
+                started = time.monotonic()
+                try:
+                    result = fn()
+                except Exception as e:
+                    delay = self._failed(e, started, reserved, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(started, reserved, result.generations[0].message if result.generations else None)
+                return result
+        finally:
+            self._exit()
+
+    async def acall(self, fn: Callable[[], Awaitable[ChatResult]], input_tokens: int) -> ChatResult:
+        """Async variant of call"""
+        await self._aacquire()
+        try:
+            attempt = 0
+            while True:
+                reserved, wait = self._reserve(input_tokens)
+                await asyncio.sleep(wait)
+                started = time.monotonic()
+                try:
+                    result = await fn()
+                except Exception as e:
+                    delay = self._failed(e, started, reserved, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self._succeeded(started, reserved, result.generations[0].message if result.generations else None)
+                return result
+        finally:
+            self._exit()
+
+    def stream(self, fn: Callable[[], Iterator[ChatGenerationChunk]],
+               input_tokens: int) -> Iterator[ChatGenerationChunk]:
+        """Run a streaming request under the limits
+
+        The slot is held until the stream ends. Failures are retried only
+        before the first chunk, since chunks already yielded cannot be taken back.
+        A stream closed or failing midway is settled with the output received so far.
+        """
+        self._acquire()
+        try:
+            attempt = 0
+            while True:
+                reserved, wait = self._reserve(input_tokens)
+                time.sleep(wait)
+                started = time.monotonic()
+                chunks = fn()
+                merged = None
+                try:
+                    try:
+                        merged = next(chunks)
+                    except StopIteration:
+                        self._succeeded(started, reserved, None)
+                        return
+                    except Exception as e:
+                        delay = self._failed(e, started, reserved, attempt)
+                        if delay is None:
+                            raise
+                        time.sleep(delay)
+                        attempt += 1
+                        continue
+                    yield merged
+                    for chunk in chunks:
+                        merged += chunk
+                        yield chunk
+                except GeneratorExit:
+                    # the caller stopped reading early, e.g. a stream monitor cut the response short
+                    self._succeeded(started, reserved, merged.message, complete=False)
+                    raise
+                except BaseException:
+                    if merged is not None:
+                        self._settle(reserved, merged.message, complete=False)
+                    raise
+                finally:
+                    chunks.close()
+                self._succeeded(started, reserved, merged.message)
+                return
+        finally:
+            self._exit()
+
+    async def astream(self, fn: Callable[[], AsyncIterator[ChatGenerationChunk]],
+                      input_tokens: int) -> AsyncIterator[ChatGenerationChunk]:
+        """Async variant of stream"""
+        await self._aacquire()
+        try:
+            attempt = 0
+            while True:
+                reserved, wait = self._reserve(input_tokens)
+                await asyncio.sleep(wait)
+                started = time.monotonic()
+                chunks = fn()
+                merged = None
+                try:
+                    try:
+                        merged = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        self._succeeded(started, reserved, None)
+                        return
+                    except Exception as e:
+                        delay = self._failed(e, started, reserved, attempt)
+                        if delay is None:
+                            raise
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        continue
+                    yield merged
+                    async for chunk in chunks:
+                        merged += chunk
+                        yield chunk
+                except GeneratorExit:
+                    self._succeeded(started, reserved, merged.message, complete=False)
+                    raise
+                except BaseException:
+                    if merged is not None:
+                        self._settle(reserved, merged.message, complete=False)
+                    raise
+                finally:
+                    await chunks.aclose()
+                self._succeeded(started, reserved, merged.message)
+                return
+        finally:
+            self._exit()
+
+    @property
+    def congested(self) -> bool:
+        """Whether requests are queued for a slot or paused after a rejection"""
+        return bool(self._waiters) or self._paused_until > time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """Current window and counters"""
+        return {
+            "window": round(self.window, 2), "in_flight": self.in_flight, "waiting": len(self._waiters),
+            "throttled": self.throttled, "retries": self.retries,
+        }
+
+def limited(cls: Type[BaseChatModel], limiter_for: Callable[[BaseChatModel], AdaptiveLimiter]) -> Type[BaseChatModel]:
+    """Subclass a chat model class so its upstream calls go through an AdaptiveLimiter
+
+    Args:
+        cls: Chat model class
+        limiter_for: Returns the limiter of a model instance
+
+    Returns:
+        Type[BaseChatModel]: The rate limited subclass
+    """
+
+    class Limited(cls):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+            return limiter_for(self).call(
+                lambda: super(Limited, self)._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                message_tokens(messages)
+            )
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+            return await limiter_for(self).acall(
+                lambda: super(Limited, self)._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                message_tokens(messages)
+            )
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+            return limiter_for(self).stream(
+                lambda: super(Limited, self)._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+                message_tokens(messages)
+            )
+
+        def _astream(self, messages, stop=None, run_manager=None,
+                     **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+            return limiter_for(self).astream(
+                lambda: super(Limited, self)._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+                message_tokens(messages)
+            )
+
+    Limited.__name__ = Limited.__qualname__ = cls.__name__
+    Limited.__module__ = cls.__module__
+    return Limited
@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from langchain_core.language_models import BaseChatModel
+
+from .cache import ChatModelCache, ResponseCache
+from .hedging import Hedger, hedging
+from .limiter import AdaptiveLimiter, LimitConfig, limited
+from .singleflight import SingleFlight, coalescing
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PoolConfig:
+    """Connection pool shared by every client handed out by the registry"""
+    max_connections: int = 32
+    max_keepalive_connections: int = 16
+    keepalive_expiry: float = 120.0
+    timeout: float = 600.0
+    connect_timeout: float = 10.0
+    warm_connections: int = 4
+
+@dataclass
+class Provider:
+    """An LLM provider and where its API lives"""
+    name: str
+    default_base_url: str
+    base_url_env: str
+    api_key_env: str
+    llm_type: str
+
+    @property
+    def base_url(self) -> str:
+        return os.getenv(self.base_url_env) or self.default_base_url
+
+PROVIDERS: Dict[str, Provider] = {
+    "anthropic": Provider("anthropic", "https://api.anthropic.com", "ANTHROPIC_BASE_URL", "ANTHROPIC_API_KEY",
+                          "anthropic-chat"),
+    "openai": Provider("openai", "https://api.openai.com/v1", "OPENAI_BASE_URL", "OPENAI_API_KEY", "openai-chat"),
+}
+
+class _LoopLocalTransport(httpx.AsyncBaseTransport):
+    """Async transport that keeps one connection pool per event loop
+
+    Async connections belong to the loop that opened them. Code that calls
+    asyncio.run() more than once would otherwise pick up connections of a
+    closed loop from the shared pool.
+    """
+
+    def __init__(self, **kwargs: Any):
+        self._kwargs = kwargs
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = \
+            weakref.WeakKeyDictionary()
+
+    def _pool(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = httpx.AsyncHTTPTransport(**self._kwargs)
+        return pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._pool().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        pool = self._pools.pop(asyncio.get_running_loop(), None)
+        if pool is not None:
+            await pool.aclose()
+
+class LLMRegistry:
+    """Hands out chat models that share one keep-alive HTTP connection pool
+
+    Every chat model normally owns its own HTTP client, so each generator pays
+    for its own TCP and TLS handshakes and parallel generation opens as many
+    sockets as it likes. The registry owns a single sync and a single async
+    httpx client with bounded pools; all models it builds send their requests
+    through them. Models with identical settings are built once and reused,
+    and identical requests in flight at the same time share one upstream call
+    (see SingleFlight), so concurrency never pays twice for the same prompt.
+    Upstream calls of each provider model go through an AdaptiveLimiter, which
+    owns the retries of rejected requests and backs off on 429/529; requests
+    are only paced to RPM/TPM limits once they are set with set_limits.
+    Calls made with `hedge=<chain name>` get a duplicate request once they are
+    slower than the chain's learned tail latency (see Hedger).
+
+    The registry also holds the optional on-disk response cache (see
+    enable_cache); models requested with cache=True read and write it on every
+    invoke, and ContinuationChain uses it for both invoke and stream calls.
+    """
+
+    def __init__(self, pool: Optional[PoolConfig] = None):
+        """Initialize the registry
+
+        Args:
+            pool: Connection pool settings, defaults to PoolConfig()
+        """
+        self.pool = pool or PoolConfig()
+        self._http_client: Optional[httpx.Client] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._models: Dict[Tuple, BaseChatModel] = {}
+        self._providers_used: List[str] = []
+        self._lock = threading.Lock()
+        self.response_cache: Optional[ResponseCache] = None
+        self.flights = SingleFlight()
+        self.hedger = Hedger()
+        self._model_classes: Dict[type, type] = {}
+        self._limit_configs: Dict[Tuple[str, Optional[str]], LimitConfig] = {}
+        self._limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+
+    def configure(self, pool: PoolConfig) -> None:
+        """Replace the pool settings; only possible before the first client is built
+
+        Args:
+            pool: Connection pool settings
+        """
+        if self._http_client is not None or self._async_http_client is not None:
+            raise RuntimeError("Connection pool is already in use, configure the registry at startup")
+        self.pool = pool
+
+    def enable_cache(self, path: str, max_bytes: int = 512 * 1024 * 1024,
+                     max_entries: Optional[int] = None) -> ResponseCache:
+        """Turn on the shared on-disk response cache
+
+        Models handed out earlier pick the cache up as well, since they look it
+        up on every call.
+
+        Args:
+            path: SQLite database file, may be shared by several processes
+            max_bytes: Upper bound for the total size of stored responses
+            max_entries: Optional upper bound for the number of stored responses
+
+        Returns:
+            ResponseCache: The enabled cache
+        """
+        self.response_cache = ResponseCache(path, max_bytes, max_entries)
+        logger.info(f"LLM response cache enabled: {path}")
+        return self.response_cache
+
+    def disable_cache(self) -> None:
+        """Turn off the shared response cache"""
+        self.response_cache = None
+
+    def set_limits(self, provider: str, config: LimitConfig, model: Optional[str] = None) -> None:
+        """Set the rate limits of a provider, or of one of its models
+
+        Limiters that already exist are rebuilt with the new limits on their next use.
+
+        Args:
+            provider: Provider name, one of PROVIDERS
+            config: Limits, usually the provider's published RPM/TPM for the account tier
+            model: Model the limits apply to, defaults to every model of the provider
+        """
+        with self._lock:
+            self._limit_configs[(provider, model)] = config
+            for key in [key for key in self._limiters if key[0] == provider and model in (None, key[1])]:
+                del self._limiters[key]
+
+    def limiter(self, provider: str, model: str) -> AdaptiveLimiter:
+        """Limiter shared by every model handed out for provider and model"""
+        key = (provider, model)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                config = self._limit_configs.get(key) or self._limit_configs.get((provider, None))
+                if config is None:
+                    # no limits set: no pacing, the window only shrinks on rejections
+                    config = LimitConfig(initial_concurrency=LimitConfig.max_concurrency)
+                limiter = self._limiters[key] = AdaptiveLimiter(f"{provider}/{model}", config)
+                logger.info(
+                    f"{limiter.name}: rpm {config.requests_per_minute or 'unlimited'}, "
+                    f"tpm {config.tokens_per_minute or 'unlimited'}, "
+                    f"concurrency {config.initial_concurrency} (max {config.max_concurrency})"
+                )
+            return limiter
+
+    def _limiter_for(self, llm: BaseChatModel) -> AdaptiveLimiter:
+        provider = next((p.name for p in PROVIDERS.values() if p.llm_type == llm._llm_type), llm._llm_type)
+        return self.limiter(provider, getattr(llm, "model", None) or getattr(llm, "model_name", ""))
+
+    def limiter_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Window and counters of every limiter in use"""
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.name: limiter.stats() for limiter in limiters}
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.pool.max_connections,
+            max_keepalive_connections=self.pool.max_keepalive_connections,
+            keepalive_expiry=self.pool.keepalive_expiry
+        )
+
+    def _timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.pool.timeout, connect=self.pool.connect_timeout)
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """Shared synchronous HTTP client"""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    limits=self._limits(), timeout=self._timeout(), follow_redirects=True
+                )
+            return self._http_client
+
+    @property
+    def async_http_client(self) -> httpx.AsyncClient:
+        """Shared asynchronous HTTP client"""
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    transport=_LoopLocalTransport(limits=self._limits()),
+                    timeout=self._timeout(), follow_redirects=True
+                )
+            return self._async_http_client
+
+    def get(self, provider: str, model: str, cache: bool = False, **kwargs: Any) -> BaseChatModel:
+        """Get a chat model that sends its requests through the shared pool
+
+        Args:
+            provider: Provider name, one of PROVIDERS
+            model: Model name
+            cache: Whether invoke calls of the model go through the response cache
+                (when enabled). Leave off for models wrapped in ContinuationChain,
+                which does its own caching.
+            **kwargs: Extra model settings (temperature, max_tokens, ...)
+
+        Returns:
+            BaseChatModel: Chat model, shared with other callers using the same settings
+        """
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        key = (provider, model, cache, tuple(sorted(kwargs.items())))
+        with self._lock:
+            llm = self._models.get(key)
+        if llm is None:
+            if cache:
+                kwargs["cache"] = ChatModelCache(lambda: self.response_cache)
+            llm = self._build(PROVIDERS[provider], model, kwargs)
+            with self._lock:
+                llm = self._models.setdefault(key, llm)
+                if provider not in self._providers_used:
+                    self._providers_used.append(provider)
+        return llm
+
+    def _model_class(self, cls: type, pooled: Optional[Callable[[type], type]] = None) -> type:
+        """Rate limited, hedging, coalescing subclass of a chat model class, built once per class
+
+        Coalescing wraps the other layers, so only the leader of a flight takes
+        a slot and may be hedged; hedges bypass coalescing but not the limiter.
+
+        Args:
+            cls: Chat model class
+            pooled: Innermost layer that routes the class's requests through the
+                registry's pools, for classes that take no http_client option
+        """
+        with self._lock:
+            if cls not in self._model_classes:
+                model_class = hedging(limited(pooled(cls) if pooled else cls, self._limiter_for), self.hedger,
+                                      lambda llm: self._limiter_for(llm).congested)
+                self._model_classes[cls] = coalescing(model_class, self.flights)
+            return self._model_classes[cls]
+
+    def _build(self, provider: Provider, model: str, kwargs: Dict[str, Any]) -> BaseChatModel:
+        api_key = kwargs.pop("api_key", None) or os.getenv(provider.api_key_env)
+        if provider.name == "openai":
+            from langchain_openai import ChatOpenAI
+            llm = self._model_class(ChatOpenAI)(
+                model=model, api_key=api_key, base_url=provider.base_url,
+                http_client=self.http_client, http_async_client=self.async_http_client, **kwargs
+            )
+            # the limiter retries rejected requests, SDK retries would hide the 429s from it;
+            # set on the clients rather than the model so cache keys keep the configured max_retries
+            llm.root_client = llm.root_client.with_options(max_retries=0)
+            llm.root_async_client = llm.root_async_client.with_options(max_retries=0)
+            llm.client = llm.root_client.chat.completions
+            llm.async_client = llm.root_async_client.chat.completions
+            return llm
+
+        from langchain_anthropic import ChatAnthropic
+        model_class = self._model_class(ChatAnthropic, lambda cls: _pooled_anthropic(cls, self))
+        return model_class(model=model, api_key=api_key, base_url=provider.base_url, **kwargs)
+
+    def _warm_urls(self, providers: Optional[Iterable[str]]) -> List[str]:
+        names = list(providers) if providers is not None else list(self._providers_used)
+        return [PROVIDERS[name].base_url for name in names]
+
+    async def awarmup(self, providers: Optional[Iterable[str]] = None,
+                      connections: Optional[int] = None) -> int:
+        """Open keep-alive connections in the async pool before the first request
+
+        Each provider gets `connections` concurrent requests to its base URL,
+        which leaves that many connections with finished TLS handshakes in the
+        pool. Failures are logged and otherwise ignored.
+
+        Args:
+            providers: Providers to warm, defaults to those with models handed out
+            connections: Connections per provider, defaults to pool.warm_connections
+
+        Returns:
+            int: Number of connections that were opened
+        """
+        count = connections or self.pool.warm_connections
+        client = self.async_http_client
+
+        async def touch(url: str) -> bool:
+            try:
+                await client.head(url)
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"Connection warmup for {url} failed: {e}")
+                return False
+
+        urls = [url for url in self._warm_urls(providers) for _ in range(count)]
+        opened = sum(await asyncio.gather(*(touch(url) for url in urls)))
+        logger.info(f"Warmed {opened} pooled connections")
+        return opened
+
+    def warmup(self, providers: Optional[Iterable[str]] = None,
+               connections: Optional[int] = None) -> threading.Thread:
+        """Open keep-alive connections in the sync pool from a background thread
+
+        Args:
+            providers: Providers to warm, defaults to those with models handed out
+            connections: Connections per provider, defaults to pool.warm_connections
+
+        Returns:
+            threading.Thread: The warmup thread, already started
+        """
+        count = connections or self.pool.warm_connections
+        urls = self._warm_urls(providers)
+
+        def touch(url: str):
+            try:
+                self.http_client.head(url)
+            except httpx.HTTPError as e:
+                logger.warning(f"Connection warmup for {url} failed: {e}")
+
+        def run():
+            workers = [threading.Thread(target=touch, args=(url,), daemon=True)
+                       for url in urls for _ in range(count)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        thread = threading.Thread(target=run, name="llm-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        """Close the sync pool"""
+        if self._http_client is not None:
+            self._http_client.close()
+
+    async def aclose(self) -> None:
+        """Close both pools"""
+        self.close()
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+
+def _pooled_anthropic(cls: type, registry: LLMRegistry) -> type:
+    """Subclass ChatAnthropic so its SDK clients use the registry's pools
+
+    ChatAnthropic takes no http_client option and builds its SDK clients on
+    first use; this subclass builds them from the model's public settings
+    instead, without SDK retries since the limiter owns them.
+    """
+    import anthropic
+
+    class Pooled(cls):
+        def _sdk_params(self) -> Dict[str, Any]:
+            params = {
+                "api_key": self.anthropic_api_key.get_secret_value(), "base_url": self.anthropic_api_url,
+                "default_headers": self.default_headers or None, "max_retries": 0,
+            }
+            # as in ChatAnthropic: a timeout <= 0 means "SDK default", None means "no timeout"
+            if self.default_request_timeout is None or self.default_request_timeout > 0:
+                params["timeout"] = self.default_request_timeout
+            return params
+
+        @cached_property
+        def _client(self) -> anthropic.Client:
+            return anthropic.Client(**self._sdk_params(), http_client=registry.http_client)
+
+        @cached_property
+        def _async_client(self) -> anthropic.AsyncClient:
+            return anthropic.AsyncClient(**self._sdk_params(), http_client=registry.async_http_client)
+
+    Pooled.__name__ = Pooled.__qualname__ = cls.__name__
+    Pooled.__module__ = cls.__module__
+    return Pooled
+
+registry = LLMRegistry()
+
+def get_llm(provider: str, model: str, cache: bool = False, **kwargs: Any) -> BaseChatModel:
+    """Get a chat model from the default registry, see LLMRegistry.get"""
+    return registry.get(provider, model, cache, **kwargs)
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Type
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from .cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """Coalesces identical calls that are in flight at the same time
+
+    The first caller for a key (the leader) does the work; callers arriving
+    while it runs (followers) wait for the leader's result instead of repeating
+    the call. Results are handed over through concurrent futures, so leaders
+    and followers may live in different threads or event loops. When the
+    leader is cancelled without a result, followers retry and one of them
+    becomes the new leader.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, Future] = {}
+        self.coalesced = 0
+
+    def join(self, key: str) -> Tuple[Future, bool]:
+        """Join the flight for key
+
+        Returns:
+            Tuple[Future, bool]: The flight's future and whether the caller is its leader
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._flights[key] = Future()
+            return future, True
+
+    def finish(self, key: str, future: Future, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        """Land a flight: hand the result (or error) to the followers
+
+        A flight that ends with neither result nor error, or because the
+        leader was cancelled, is cancelled and its followers retry.
+        """
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        if future.done():
+            return
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit, KeyboardInterrupt)):
+            error = None
+        if error is not None:
+            future.set_exception(error)
+        elif result is None:
+            future.cancel()
+        else:
+            future.set_result(result)
+
+    @staticmethod
+    def wait(future: Future) -> Any:
+        """Wait for the leader's result; None means the leader was cancelled"""
+        try:
+            return future.result()
+        except CancelledError:
+            if future.cancelled():
+                return None
+            raise
+
+    @staticmethod
+    async def await_(future: Future) -> Any:
+        """Wait for the leader's result without blocking the loop, see wait"""
+        try:
+            # shield so that cancelling this follower does not cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return None
+            raise
+
+def _truncated(merged: Optional[ChatGenerationChunk]) -> Optional[ChatGenerationChunk]:
+    """What followers get when the leader's stream is closed early: the partial output, marked as truncated"""
+    if merged is None:
+        return None
+    message = AIMessageChunk(content=merged.message.content, response_metadata={"stop_reason": "max_tokens"})
+    return ChatGenerationChunk(message=message)
+
+def coalescing(cls: Type[BaseChatModel], flights: SingleFlight) -> Type[BaseChatModel]:
+    """Subclass a chat model class so identical concurrent requests share one upstream call
+
+    Requests are identical when the model configuration and the messages
+    match. Whole responses and streams are coalesced separately; followers of
+    a stream receive the leader's complete output as a single chunk.
+
+    Args:
+        cls: Chat model class
+        flights: Registry of in-flight requests
+
+    Returns:
+        Type[BaseChatModel]: The coalescing subclass
+    """
+
+    def flight_key(model: BaseChatModel, kind: str, messages: List[BaseMessage],
+                   stop: Optional[List[str]], kwargs: Dict) -> str:
+        return cache_key(dumps(messages), model._get_llm_string(stop=stop, **kwargs), kind)
+
+    class Coalescing(cls):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+            key = flight_key(self, "generate", messages, stop, kwargs)
+            while True:
+                future, leader = flights.join(key)
+                if leader:
+                    break
+                result = flights.wait(future)
+                if result is not None:
+                    return result.model_copy(deep=True)
+            try:
+                result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except BaseException as e:
+                flights.finish(key, future, error=e)
+                raise
+            flights.finish(key, future, result)
+            return result
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+            key = flight_key(self, "generate", messages, stop, kwargs)
+            while True:
+                future, leader = flights.join(key)
+                if leader:
+                    break
+                result = await flights.await_(future)
+                if result is not None:
+                    return result.model_copy(deep=True)
+            try:
+                result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except BaseException as e:
+                flights.finish(key, future, error=e)
+                raise
+            flights.finish(key, future, result)
+            return result
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+            key = flight_key(self, "stream", messages, stop, kwargs)
+            while True:
+                future, leader = flights.join(key)
+                if leader:
+                    break
+                merged = flights.wait(future)
+                if merged is not None:
+                    yield merged.model_copy(deep=True)
+                    return
+            merged = None
+            try:
+                for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+            except GeneratorExit:
+                flights.finish(key, future, _truncated(merged))
+                raise
+            except BaseException as e:
+                flights.finish(key, future, error=e)
+                raise
+            flights.finish(key, future, merged)
+
+        async def _astream(self, messages, stop=None, run_manager=None,
+                           **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+            key = flight_key(self, "stream", messages, stop, kwargs)
+            while True:
+                future, leader = flights.join(key)
+                if leader:
+                    break
+                merged = await flights.await_(future)
+                if merged is not None:
+                    yield merged.model_copy(deep=True)
+                    return
+            merged = None
+            try:
+                async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+            except GeneratorExit:
+                flights.finish(key, future, _truncated(merged))
+                raise
+            except BaseException as e:
+                flights.finish(key, future, error=e)
+                raise
+            flights.finish(key, future, merged)
+
+    Coalescing.__name__ = Coalescing.__qualname__ = cls.__name__
+    Coalescing.__module__ = cls.__module__
+    return Coalescing
@@ -0,0 +1,57 @@
+import math
+import re
+from functools import lru_cache
+
+# CJK characters: unified ideographs and extension A, compatibility ideographs, kana, hangul syllables
+CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]")
+# Latin words and numbers
+WORD_PATTERN = re.compile(r"[A-Za-z0-9]+(?:['\-][A-Za-z0-9]+)*")
+# Everything that counts towards the length of a text, matched in a single pass
+UNIT_PATTERN = re.compile(f"{CJK_PATTERN.pattern}|{WORD_PATTERN.pattern}")
+WHITESPACE_PATTERN = re.compile(r"\s")
+
+def count_cjk(text: str) -> int:
+    """Count CJK characters in a text"""
+    return len(CJK_PATTERN.findall(text))
+
+def count_words(text: str) -> int:
+    """Count the length of a text the way a reader would
+
+    Each CJK character counts as one word, as does each Latin word or number;
+    punctuation and whitespace are not counted. `len(text.split())` is not a
+    usable measure for Chinese, where a whole chapter splits into a handful of
+    "words".
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Word count
+    """
+    return len(UNIT_PATTERN.findall(text))
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of model tokens in a text
+
+    CJK characters are about one token each; other non-whitespace characters
+    are about four to a token.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        int: Estimated token count
+    """
+    cjk = count_cjk(text)
+    others = len(text) - len(WHITESPACE_PATTERN.findall(text)) - cjk
+    return cjk + math.ceil(max(others, 0) / 4)
+
+@lru_cache(maxsize=1024)
+def cached_word_count(text: str) -> int:
+    """Memoized count_words for static text such as prompt templates"""
+    return count_words(text)
+
+@lru_cache(maxsize=1024)
+def cached_token_estimate(text: str) -> int:
+    """Memoized estimate_tokens for static text such as prompt templates"""
+    return estimate_tokens(text)
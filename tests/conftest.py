@@ -0,0 +1,8 @@
+import os
+import sys
+
+# demo 下的模块按 demo 目录为根导入（from utils.x import ...），src 按仓库根目录导入
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "demo")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import re
+from typing import Any, Callable, List, Tuple, Union
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+Reply = Union[str, Tuple[str, str]]
+
+class ScriptedChatModel(BaseChatModel):
+    """按脚本回复的聊天模型
+
+    respond 接收每次请求的消息列表，返回回复文本，或 (回复文本, stop_reason) 元组，stop_reason 默认为
+    end_turn。流式调用时回复按 chunk_size 个字符切分，stop_reason 放在最后一个片段中。
+    所有请求的消息列表按顺序记录在 calls 中。
+    """
+
+    respond: Callable[[List[BaseMessage]], Reply]
+    chunk_size: int = 7
+    llm_type: str = "scripted"
+    calls: List[List[BaseMessage]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm_type
+
+    def _reply(self, messages: List[BaseMessage]) -> Tuple[str, str]:
+        self.calls.append(messages)
+        reply = self.respond(messages)
+        return (reply, "end_turn") if isinstance(reply, str) else reply
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text, stop_reason = self._reply(messages)
+        message = AIMessage(content=text, response_metadata={"stop_reason": stop_reason})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(0)
+        return self._generate(messages, stop=stop, **kwargs)
+
+    def _chunks(self, messages: List[BaseMessage]) -> List[ChatGenerationChunk]:
+        text, stop_reason = self._reply(messages)
+        chunks = [
+            ChatGenerationChunk(message=AIMessageChunk(content=text[i:i + self.chunk_size]))
+            for i in range(0, len(text), self.chunk_size)
+        ]
+        chunks.append(ChatGenerationChunk(message=AIMessageChunk(
+            content="", response_metadata={"stop_reason": stop_reason}
+        )))
+        return chunks
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        yield from self._chunks(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        for chunk in self._chunks(messages):
+            await asyncio.sleep(0)
+            yield chunk
+
+def scripted(replies: List[Reply], **kwargs: Any) -> ScriptedChatModel:
+    """依次返回 replies 中各项的模型"""
+    queue = list(replies)
+    return ScriptedChatModel(respond=lambda messages: queue.pop(0), calls=[], **kwargs)
+
+def patch_models(monkeypatch, module, model: BaseChatModel):
+    """让 module 中创建的聊天模型都换成 model"""
+    monkeypatch.setattr(module, "get_llm", lambda *args, **kwargs: model)
+
+def respond_outline(messages: List[BaseMessage]) -> str:
+    """按大纲请求的类型回复：每卷两章，每章一个场景，标题中带有上级节点的名称"""
+    text = messages[-1].content
+    if "主题：" in text:
+        return json.dumps({"main_theme": "主题", "description": "描述", "volumes": [
+            {"volume_number": i, "volume_title": f"卷{i}", "volume_description": "", "key_plots": []}
+            for i in (1, 2, 3)
+        ]}, ensure_ascii=False)
+    match = re.search(r"卷号：(\S+)", text)
+    if match:
+        volume = match.group(1)
+        return json.dumps({"chapters": [
+            {"chapter_number": j, "chapter_title": f"卷{volume}-章{j}", "plot_points": [], "word_count": 3000}
+            for j in (1, 2)
+        ]}, ensure_ascii=False)
+    title = re.search(r"章节标题：(\S+)", text).group(1)
+    return json.dumps({"chapter_title": title, "scenes": [{"scene_title": f"{title}-场景"}]}, ensure_ascii=False)
@@ -0,0 +1,61 @@
+import asyncio
+
+from utils.book_writer import BookWriter, stream_to_file
+
+def test_resume_restores_completed_chapters(tmp_path):
+    writer = BookWriter(str(tmp_path))
+    writer.start({"topic": "主题"})
+    writer.save_book_outline({"title": "书名"})
+    writer.save_volume_outline(1, {"chapters": []})
+    writer.append_chapter(1, 1, "第一章\n正文\n", word_count=4)
+
+    resumed = BookWriter(str(tmp_path))
+    assert resumed.exists()
+    resumed.resume()
+    assert resumed.is_completed(1, 1)
+    assert not resumed.is_completed(1, 2)
+    assert resumed.completed_count == 1
+    assert resumed.word_count == 4
+    assert resumed.book_outline == {"title": "书名"}
+    assert resumed.volume_outline(1) == {"chapters": []}
+    assert resumed.manifest["topic"] == "主题"
+
+def test_resume_truncates_unrecorded_output_and_drops_drafts(tmp_path):
+    writer = BookWriter(str(tmp_path))
+    writer.start({})
+    writer.append_chapter(1, 1, "第一章\n")
+    # 写入正文后、更新清单前中断
+    with open(writer.book_path, 'a', encoding='utf-8') as f:
+        f.write("第二章写到一半")
+    with open(writer.part_path(1, 2), 'w', encoding='utf-8') as f:
+        f.write("初稿")
+
+    resumed = BookWriter(str(tmp_path))
+    resumed.resume()
+    with open(resumed.book_path, encoding='utf-8') as f:
+        assert f.read() == "第一章\n"
+    assert not (tmp_path / "chapter_001_002.part").exists()
+
+def test_append_chapter_removes_its_draft(tmp_path):
+    writer = BookWriter(str(tmp_path))
+    writer.start({})
+
+    async def chunks():
+        for chunk in ("第一", "章"):
+            yield chunk
+
+    part_path = writer.part_path(1, 1)
+    assert asyncio.run(stream_to_file(chunks(), part_path)) == "第一章"
+    with open(part_path, encoding='utf-8') as f:
+        assert f.read() == "第一章"
+    writer.append_chapter(1, 1, "第一章")
+    assert not (tmp_path / "chapter_001_001.part").exists()
+
+def test_start_clears_previous_run(tmp_path):
+    writer = BookWriter(str(tmp_path))
+    writer.start({})
+    writer.append_chapter(1, 1, "旧内容")
+    writer.start({})
+    assert writer.completed_count == 0
+    with open(writer.book_path, encoding='utf-8') as f:
+        assert f.read() == ""
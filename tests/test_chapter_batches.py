@@ -0,0 +1,76 @@
+import asyncio
+import json
+import re
+
+import outline_generator
+from fake_chat import ScriptedChatModel, patch_models, respond_outline
+
+def _chapters(count):
+    return [{"chapter_number": i, "chapter_title": f"第{i}章", "plot_points": ["推进"]} for i in range(1, count + 1)]
+
+def _batch_keys(messages):
+    text = messages[-1].content
+    if "请为以下章节分别生成详细大纲" not in text:
+        return None
+    return [chapter["chapter_key"] for chapter in json.loads(text[text.index("["):text.rindex("]") + 1])]
+
+def respond_batch(messages, skip=(), scene_chars=10):
+    """批量请求按 chapter_key 回复（第1章的键写成数字、第3章的键带空格），跳过 skip 中的键"""
+    keys = _batch_keys(messages)
+    if keys is None:
+        return respond_outline(messages)
+    titles = re.findall(r'"chapter_title": "([^"]+)"', messages[-1].content)
+    items = [
+        {
+            "chapter_key": {"1": 1, "3": " 3 "}.get(key, key),
+            "chapter_title": title,
+            "scenes": [{"scene_title": f"{title}-场景", "scene_description": "景" * scene_chars}]
+        }
+        for key, title in zip(keys, titles) if key not in skip
+    ]
+    return json.dumps({"chapters": items}, ensure_ascii=False)
+
+def _generator(monkeypatch, tmp_path, respond, **kwargs):
+    model = ScriptedChatModel(respond=respond, calls=[])
+    patch_models(monkeypatch, outline_generator, model)
+    generator = outline_generator.OutlineGenerator(
+        cache_dir=str(tmp_path / "cache"), base_dir=str(tmp_path), **kwargs
+    )
+    return generator, model
+
+def test_batch_results_map_back_by_chapter_key(monkeypatch, tmp_path):
+    generator, model = _generator(monkeypatch, tmp_path, lambda messages: respond_batch(messages, skip={"2"}))
+    completed = []
+    outlines = generator.generate_chapter_outlines_batch(
+        _chapters(3), on_complete=lambda i, outline: completed.append(i)
+    )
+    assert [o["chapter_title"] for o in outlines] == ["第1章", "第2章", "第3章"]
+    assert all("chapter_key" not in o for o in outlines)
+    # 漏掉的第2章单独补生成
+    assert len(model.calls) == 2
+    assert "章节标题：第2章" in model.calls[1][-1].content
+    assert completed == [0, 1, 2]
+
+def test_batch_size_follows_observed_output_length(monkeypatch, tmp_path):
+    generator, _ = _generator(monkeypatch, tmp_path, respond_outline, max_chapter_batch_size=8)
+    assert generator.chapter_batch_size() == 4
+    generator._chapter_outline_tokens = 100
+    assert generator.chapter_batch_size() == 8
+    generator._chapter_outline_tokens = generator.max_tokens
+    assert generator.chapter_batch_size() == 1
+    # 平滑值与本次观察值取较大者，输出变长时立即缩小批次
+    generator._chapter_outline_tokens = 100
+    long_outline = {"chapters": [{"scenes": [{"scene_description": "字" * 3000}]}]}
+    generator._observe_chapter_tokens(long_outline, 1)
+    assert generator._chapter_outline_tokens >= 3000
+    assert generator.chapter_batch_size() == 2
+
+def test_async_batches_shrink_after_long_outputs(monkeypatch, tmp_path):
+    generator, model = _generator(
+        monkeypatch, tmp_path, lambda messages: respond_batch(messages, scene_chars=2500), max_chapter_batch_size=8
+    )
+    outlines = asyncio.run(generator.agenerate_chapter_outlines(_chapters(10), max_concurrency=1, batch=True))
+    assert [o["chapter_title"] for o in outlines] == [f"第{i}章" for i in range(1, 11)]
+    sizes = [len(_batch_keys(messages)) for messages in model.calls]
+    assert sizes[0] == 4
+    assert sizes[1:] == [2, 2, 2]
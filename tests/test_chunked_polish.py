@@ -0,0 +1,52 @@
+from langchain_core.runnables import RunnableLambda
+
+from utils.chunked_polish import (WindowedPolishChain, merged_labels, parse_labeled_paragraphs,
+                                  reconcile_windows, split_windows)
+from utils.paragraph_patch import number_paragraphs
+
+def test_split_windows_overlap_by_one_paragraph():
+    paragraphs = ["字" * 10] * 7
+    assert split_windows(paragraphs, window_words=30, overlap=1) == [(0, 4), (2, 7), (5, 7)]
+    assert split_windows(paragraphs, window_words=100) == [(0, 7)]
+    assert split_windows([]) == []
+
+def test_long_paragraph_gets_its_own_window():
+    paragraphs = ["短", "长" * 50, "短"]
+    assert split_windows(paragraphs, window_words=10, overlap=0) == [(0, 1), (1, 2), (2, 3)]
+
+def test_parse_labeled_paragraphs_keeps_first_occurrence():
+    text = "说明\n[P3] 第三段\n续行\n[P4] 第四段\n[P3] 重复"
+    assert parse_labeled_paragraphs(text) == {3: "第三段\n续行", 4: "第四段"}
+
+def test_reconcile_prefers_window_centre_and_keeps_missing_paragraphs():
+    paragraphs = [c * 6 for c in "一二三四五"]
+    windows = [(0, 3), (1, 5)]
+    outputs = [
+        f"[P1] {'甲' * 6}\n[P2] {'乙' * 6}\n[P3] {'丙' * 6}",
+        f"[P2] {'子' * 6}\n[P3] {'丑' * 6}\n[P4] {'寅' * 6}"
+    ]
+    # P2 在第一个窗口居中，P3 在第二个窗口离边缘更远，P5 两个窗口都没有输出
+    assert reconcile_windows(paragraphs, windows, outputs) == \
+        ["甲" * 6, "乙" * 6, "丑" * 6, "寅" * 6, "五" * 6]
+
+def test_merged_paragraph_is_not_used():
+    paragraphs = ["甲" * 10, "乙" * 10, "丙" * 10]
+    polished = {1: "甲" * 10 + "乙" * 10, 3: "丙" * 10}
+    assert merged_labels(polished, paragraphs, 0, 3) == {1}
+    merged = reconcile_windows(paragraphs, [(0, 3)], ["[P1] " + "甲" * 10 + "乙" * 10 + "\n[P3] " + "丙" * 10])
+    assert merged == paragraphs
+
+def test_windowed_chain_preserves_layout():
+    def polish(inputs):
+        labeled = parse_labeled_paragraphs(inputs["paragraphs"])
+        return number_paragraphs([labeled[i] + "改" for i in sorted(labeled)], min(labeled))
+
+    chain = WindowedPolishChain(RunnableLambda(polish), window_words=4, overlap=1)
+    content = "　　第一段\n\n　　第二段\n　　第三段\n"
+    assert chain.invoke(content) == "　　第一段改\n\n　　第二段改\n　　第三段改\n"
+
+def test_prompt_tokens_count_every_window():
+    fixed = RunnableLambda(lambda inputs: "")
+    fixed.prompt_tokens = 100
+    chain = WindowedPolishChain(fixed, window_words=4, overlap=0)
+    assert chain.prompt_tokens_for("第一段\n第二段\n第三段") == 300
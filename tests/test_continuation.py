@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from fake_chat import scripted
+from utils.continuation import (CONTINUE_PROMPT, ContinuationChain, is_truncated, merge_continuation)
+from utils.stream_monitor import StreamMonitor
+from src.llm import registry
+
+PROMPT = ChatPromptTemplate.from_messages([("human", "写一段：{topic}")])
+
+@pytest.fixture(autouse=True)
+def no_response_cache():
+    registry.disable_cache()
+    yield
+    registry.disable_cache()
+
+def test_is_truncated_for_both_providers():
+    assert is_truncated(AIMessage(content="", response_metadata={"stop_reason": "max_tokens"}))
+    assert is_truncated(AIMessage(content="", response_metadata={"finish_reason": "length"}))
+    assert not is_truncated(AIMessage(content="", response_metadata={"stop_reason": "end_turn"}))
+    assert not is_truncated(AIMessage(content=""))
+
+def test_merge_continuation_drops_repeated_overlap():
+    assert merge_continuation("他推开门，看见了她。", "看见了她。她在笑。") == "他推开门，看见了她。她在笑。"
+    assert merge_continuation("第一句。", "第二句。") == "第一句。第二句。"
+    assert merge_continuation("啊啊啊", "啊啊啊啊", max_overlap=2) == "啊啊啊啊啊"
+
+def test_prefill_continues_the_assistant_turn():
+    llm = scripted([("开头一段，\n", "max_tokens"), "接着写完。"], llm_type="anthropic-chat")
+    chain = ContinuationChain(PROMPT, llm)
+    assert chain.prefill
+    assert chain.invoke({"topic": "雨夜"}) == "开头一段，接着写完。"
+    continuation = llm.calls[1]
+    # 预填充内容去掉结尾空白，作为最后一条助手消息
+    assert isinstance(continuation[-1], AIMessage)
+    assert continuation[-1].content == "开头一段，"
+    assert len(continuation) == 2
+
+def test_user_turn_continuation_removes_repeated_overlap():
+    llm = scripted([("他推开门，看见了她。", "max_tokens"), ("看见了她。她在笑。", "end_turn")])
+    chain = ContinuationChain(PROMPT, llm)
+    assert not chain.prefill
+    assert chain.invoke({"topic": "重逢"}) == "他推开门，看见了她。她在笑。"
+    continuation = llm.calls[1]
+    assert isinstance(continuation[-2], AIMessage) and continuation[-2].content == "他推开门，看见了她。"
+    assert isinstance(continuation[-1], HumanMessage) and continuation[-1].content == CONTINUE_PROMPT
+
+def test_continuations_are_capped():
+    llm = scripted([(f"第{i}段。", "max_tokens") for i in range(10)], llm_type="anthropic-chat")
+    chain = ContinuationChain(PROMPT, llm, max_continuations=2)
+    assert chain.invoke({"topic": "长文"}) == "第0段。第1段。第2段。"
+    assert len(llm.calls) == 3
+
+def test_tail_chars_limits_the_prefill():
+    llm = scripted([("一二三四五六", "max_tokens"), "七"], llm_type="anthropic-chat")
+    chain = ContinuationChain(PROMPT, llm, tail_chars=3)
+    assert chain.invoke({"topic": "x"}) == "一二三四五六七"
+    assert llm.calls[1][-1].content == "四五六"
+
+def test_stream_joins_continuations_seamlessly():
+    first = "前文" * 120 + "他推开门，看见了她。"
+    llm = scripted([(first, "max_tokens"), "看见了她。她在笑。"], chunk_size=5)
+    chain = ContinuationChain(PROMPT, llm)
+    chunks = list(chain.stream({"topic": "重逢"}))
+    assert "".join(chunks) == first + "她在笑。"
+    assert len(chunks) > 2
+
+def test_astream_joins_prefilled_continuations():
+    llm = scripted([("第一行\n第二行\n", "max_tokens"), "第三行"], llm_type="anthropic-chat", chunk_size=2)
+    chain = ContinuationChain(PROMPT, llm)
+
+    async def collect():
+        return [chunk async for chunk in chain.astream({"topic": "x"})]
+
+    assert "".join(asyncio.run(collect())) == "第一行\n第二行第三行"
+    assert llm.calls[1][-1].content == "第一行\n第二行"
+
+def test_stopped_stream_caches_partial_output_as_truncated(tmp_path):
+    registry.enable_cache(str(tmp_path / "cache.db"))
+    paragraphs = "".join(f"第{i}段" + "字" * (i % 5) + "\n" for i in range(10))
+    llm = scripted([paragraphs, "不应被请求"], chunk_size=3)
+    chain = ContinuationChain(PROMPT, llm, monitor=lambda inputs: StreamMonitor(target_words=6, target_ratio=1.0))
+    first = chain.invoke({"topic": "x"})
+    assert first.count("\n") < 10
+    # 重放时从缓存读出被截断的部分，监控器在同一位置停止，不再请求模型
+    assert chain.invoke({"topic": "x"}) == first
+    assert len(llm.calls) == 1
+
+def test_repetition_stop_is_not_cached(tmp_path):
+    registry.enable_cache(str(tmp_path / "cache.db"))
+    looping = "开头。\n" + "他说好的，然后转身离开了房间。" * 40 + "\n"
+    llm = scripted([looping, "正常的回复。\n"], chunk_size=5)
+    chain = ContinuationChain(PROMPT, llm, monitor=lambda inputs: StreamMonitor(window=100))
+    assert chain.invoke({"topic": "x"}) == "开头。\n"
+    # 复读停止的输出不写入缓存，下次请求重新生成
+    assert chain.invoke({"topic": "x"}) == "正常的回复。\n"
+    assert len(llm.calls) == 2
@@ -0,0 +1,46 @@
+import json
+
+from utils.paragraph_patch import INSERT_OPS, apply_patch_response, expand_inputs, insertion_points
+
+def test_insertion_points_prefer_dialogue_and_skip_last_paragraph():
+    paragraphs = ["叙述"] * 10
+    for i in (2, 5, 9, 10):
+        paragraphs[i - 1] = "“对话。”他说。"
+    points = insertion_points(paragraphs, max_points=4)
+    assert len(points) == 4
+    assert {2, 5, 9} <= set(points)
+    assert 10 not in points
+    assert points == sorted(points)
+
+def test_insertion_points_spread_across_chapter():
+    paragraphs = [f"“第{i}句。”" for i in range(1, 31)]
+    points = insertion_points(paragraphs, max_points=3)
+    assert len(points) == 3
+    assert points[0] <= 10 and 10 < points[1] <= 20 and 20 < points[2] < 30
+
+def test_insertion_points_short_chapter():
+    assert insertion_points(["只有一段"]) == []
+    assert insertion_points(["一", "二"]) == [1]
+
+def test_expand_inputs_splits_missing_words_across_points():
+    content = "\n\n".join(["“你好。”"] * 4 + ["结尾"])
+    paragraphs, inputs = expand_inputs(content, target_words=110, max_points=4)
+    assert len(paragraphs) == 5
+    assert inputs["points"] == "P1、P2、P3、P4"
+    assert inputs["missing_words"] == 100
+    assert inputs["words_per_point"] == 25
+    assert inputs["paragraphs"].startswith("[P1] “你好。”")
+
+def test_expand_inputs_when_already_long_enough():
+    _, inputs = expand_inputs("一二三\n\n四五六", target_words=3)
+    assert inputs["missing_words"] == 0
+    assert inputs["words_per_point"] == 1
+
+def test_insert_only_response_keeps_original_paragraphs():
+    content = "一。\n\n二。"
+    paragraphs, _ = expand_inputs(content, target_words=100)
+    response = json.dumps({"edits": [
+        {"op": "replace", "id": 1, "text": "改写"},
+        {"op": "insert_after", "id": 1, "text": "新增。"}
+    ]}, ensure_ascii=False)
+    assert apply_patch_response(content, paragraphs, response, INSERT_OPS) == "一。\n\n新增。\n\n二。"
@@ -0,0 +1,129 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.llm.hedging import HedgeConfig, Hedger, LatencyHistogram, hedging
+
+def _result(content: str) -> ChatResult:
+    return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def _primed(config: HedgeConfig, kind: str = "generate", seconds: float = 0.05) -> Hedger:
+    """已经记录了足够样本的 Hedger"""
+    hedger = Hedger(config)
+    for _ in range(config.min_samples):
+        hedger.histogram("chain", kind).record(seconds)
+    return hedger
+
+class StallingChatModel(BaseChatModel):
+    """第一次请求输出一半后卡住；以已输出内容作为助手消息前缀时接着输出剩余部分"""
+
+    text: str = "一二三四五六"
+    stall_after: int = 3
+    llm_type: str = "anthropic-chat"
+    prefills: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm_type
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        last = messages[-1]
+        if isinstance(last, AIMessage):
+            self.prefills.append(last.content)
+            remaining = self.text[len(last.content):]
+        else:
+            remaining = self.text
+        for i, piece in enumerate(remaining):
+            if not isinstance(last, AIMessage) and i == self.stall_after:
+                await asyncio.sleep(10)
+            await asyncio.sleep(0.001)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+def test_histogram_quantiles_and_forgetting():
+    histogram = LatencyHistogram(window=100)
+    assert histogram.quantile(0.5) is None
+    for seconds in [1.0] * 90 + [10.0] * 9:
+        histogram.record(seconds)
+    assert histogram.quantile(0.5) == pytest.approx(1.0, rel=0.2)
+    assert histogram.quantile(0.95) == pytest.approx(10.0, rel=0.2)
+    histogram.record(1.0)
+    assert histogram.total == 50
+    assert histogram.samples == 100
+
+def test_slow_request_is_hedged_and_fast_duplicate_wins():
+    hedger = _primed(HedgeConfig(min_delay=0.05))
+    calls = 0
+
+    async def start():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(10 if calls == 1 else 0.01)
+        return _result(f"第{calls}次")
+
+    result = asyncio.run(asyncio.wait_for(hedger.run("chain", start), 5))
+    assert result.generations[0].message.content == "第2次"
+    assert hedger.hedged == 1 and hedger.hedge_wins == 1
+
+@pytest.mark.parametrize("config, congested, samples", [
+    (HedgeConfig(min_delay=0.05), False, 0),
+    (HedgeConfig(min_delay=0.05, max_credit=0.5), False, 20),
+    (HedgeConfig(min_delay=0.05), True, 20),
+])
+def test_no_hedge_without_samples_budget_or_when_congested(config, congested, samples):
+    hedger = Hedger(config)
+    for _ in range(samples):
+        hedger.histogram("chain", "generate").record(0.01)
+    calls = 0
+
+    async def start():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.2)
+        return _result("回复")
+
+    asyncio.run(hedger.run("chain", start, congested=lambda: congested))
+    assert calls == 1 and hedger.hedged == 0
+
+def test_stalled_stream_resumes_from_prefill():
+    hedger = _primed(HedgeConfig(min_stall_delay=0.1), kind="gap", seconds=0.01)
+    model = hedging(StallingChatModel, hedger)(prefills=[])
+
+    async def main():
+        return [chunk.content async for chunk in model.astream("问题", hedge="chain")]
+
+    chunks = asyncio.run(asyncio.wait_for(main(), 5))
+    assert "".join(chunks) == "一二三四五六"
+    assert model.prefills == ["一二三"]
+    assert hedger.hedged == 1 and hedger.hedge_wins == 1
+
+def test_streams_without_prefill_support_are_not_resumed():
+    hedger = _primed(HedgeConfig(min_stall_delay=0.1), kind="gap", seconds=0.01)
+    model = hedging(StallingChatModel, hedger)(llm_type="fake", prefills=[])
+
+    chunks = []
+
+    async def consume():
+        async for chunk in model.astream("问题", hedge="chain"):
+            chunks.append(chunk.content)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(consume(), 0.5))
+    assert chunks == ["一", "二", "三"]
+    assert hedger.hedged == 0
+
+def test_calls_without_hedge_name_pass_through():
+    hedger = Hedger()
+    model = hedging(StallingChatModel, hedger)(stall_after=100, prefills=[])
+
+    async def main():
+        return "".join([chunk.content async for chunk in model.astream("问题")])
+
+    assert asyncio.run(main()) == "一二三四五六"
+    assert hedger.requests == 0
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from utils.json_handler import parse_json_response, repair_json
+
+def test_code_fence_and_surrounding_text_are_dropped():
+    response = '下面是大纲：\n```json\n{"title": "书名", "volumes": []}\n```\n以上。'
+    assert json.loads(repair_json(response)) == {"title": "书名", "volumes": []}
+
+def test_trailing_commas_are_removed():
+    assert json.loads(repair_json('{"a": [1, 2, ], "b": {"c": 3,},}')) == {"a": [1, 2], "b": {"c": 3}}
+
+def test_unescaped_quotes_and_newlines_inside_strings():
+    response = '{"dialogue": "他说："走吧"。", "text": "第一行\n第二行"}'
+    assert json.loads(repair_json(response)) == {"dialogue": '他说："走吧"。', "text": "第一行\n第二行"}
+
+def test_truncated_output_drops_the_incomplete_element():
+    response = '{"chapters": [{"title": "一"}, {"title": "二"}, {"ti'
+    assert json.loads(repair_json(response)) == {"chapters": [{"title": "一"}, {"title": "二"}]}
+    response = '{"chapters": [{"title": "一"}, {"title": "三", "plot": "写到一半'
+    assert json.loads(repair_json(response)) == {"chapters": [{"title": "一"}, {"title": "三"}]}
+
+def test_parse_json_response_repairs_only_when_needed():
+    assert parse_json_response('```json\n{"a": 1}\n```') == {"a": 1}
+    assert parse_json_response('{"a": [1, 2,]}') == {"a": [1, 2]}
+
+def test_parse_json_response_raises_when_unrepairable():
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_response("完全不是JSON")
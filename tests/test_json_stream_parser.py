@@ -0,0 +1,57 @@
+import asyncio
+import json
+
+from utils.json_handler import JsonArrayStreamParser, aiter_json_array, iter_json_array
+
+OUTLINE = {
+    "main_theme": "重生",
+    "volumes": [
+        {"volume_number": "第1卷", "volume_title": "起点 {括号} [方括号]", "key_plots": ["a", "b"]},
+        {"volume_number": "第2卷", "volume_title": "引号\"与转义\\", "key_plots": []},
+        {"volume_number": "第3卷", "volume_title": "终章", "key_plots": ["c"]},
+    ],
+}
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def test_items_are_returned_as_soon_as_they_close():
+    text = "```json\n" + json.dumps(OUTLINE, ensure_ascii=False, indent=2) + "\n```"
+    parser = JsonArrayStreamParser("volumes")
+    first_end = text.rindex("}", 0, text.index("第2卷")) + 1
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [OUTLINE["volumes"][0]]
+    assert parser.feed(text[first_end:]) == OUTLINE["volumes"][1:]
+
+def test_any_chunking_gives_the_same_items():
+    text = json.dumps(OUTLINE, ensure_ascii=False)
+    for size in (1, 3, 7, len(text)):
+        assert list(iter_json_array(chunked(text, size), "volumes")) == OUTLINE["volumes"]
+
+def test_only_the_requested_array_is_parsed():
+    text = json.dumps({"chapters": [{"x": 1}], "volumes": [{"y": {"chapters": [{"z": 2}]}}]})
+    assert list(iter_json_array(chunked(text, 5), "chapters")) == [{"x": 1}]
+    assert list(iter_json_array(chunked(text, 5), "volumes")) == [{"y": {"chapters": [{"z": 2}]}}]
+
+def test_truncated_stream_yields_the_complete_items_only():
+    text = json.dumps(OUTLINE, ensure_ascii=False)
+    cut = text.index("第3卷")
+    assert list(iter_json_array([text[:cut]], "volumes")) == OUTLINE["volumes"][:2]
+
+def test_async_iteration():
+    async def chunks():
+        for chunk in chunked(json.dumps(OUTLINE, ensure_ascii=False), 4):
+            yield chunk
+
+    async def collect():
+        return [item async for item in aiter_json_array(chunks(), "volumes")]
+
+    assert asyncio.run(collect()) == OUTLINE["volumes"]
+
+def test_unparsable_item_is_skipped():
+    text = json.dumps(OUTLINE, ensure_ascii=False).replace('"volume_number": "第2卷",', '"volume_number": "第2卷"')
+    parser = JsonArrayStreamParser("volumes")
+    items = parser.feed(text)
+    assert items == [OUTLINE["volumes"][0], OUTLINE["volumes"][2]]
+    assert parser.failed == 1
+    assert parser.text == text
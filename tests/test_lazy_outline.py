@@ -0,0 +1,69 @@
+import os
+
+import content_generator
+import outline_generator
+from fake_chat import ScriptedChatModel, patch_models, respond_outline
+from utils import outline_store
+from utils.outline_store import OutlineStore
+
+def _outline():
+    return {"main_theme": "主题", "description": "描述", "volumes": [
+        {"volume_number": v, "volume_title": f"卷{v}", "chapters": [
+            {"chapter_number": c, "chapter_title": f"卷{v}-章{c}", "scenes": [{"scene_title": f"场景{v}-{c}"}]}
+            for c in range(1, 6)
+        ]}
+        for v in range(1, 4)
+    ]}
+
+def _count_reads(monkeypatch):
+    reads = []
+    read_json = outline_store._read_json
+    monkeypatch.setattr(outline_store, "_read_json", lambda path: reads.append(os.path.basename(path)) or read_json(path))
+    return reads
+
+def test_content_generator_reads_index_and_one_shard(tmp_path, monkeypatch):
+    OutlineStore(str(tmp_path / "outline")).save(_outline())
+    patch_models(monkeypatch, content_generator, ScriptedChatModel(respond=lambda messages: "", calls=[]))
+    generator = content_generator.ContentGenerator(base_dir=str(tmp_path))
+    reads = _count_reads(monkeypatch)
+    generator.load_outline(str(tmp_path / "outline"))
+    chapter = generator.get_chapter_outline(2, 4)
+    assert chapter["scenes"] == [{"scene_title": "场景2-4"}]
+    assert reads == ["index.json", "chapter_002_004.json"]
+
+def test_single_chapter_resolves_without_other_shards(tmp_path, monkeypatch):
+    root = tmp_path / "outline"
+    OutlineStore(str(root)).save(_outline())
+    for name in os.listdir(root):
+        if name.startswith(("volume_", "chapter_")) and name != "chapter_003_002.json":
+            os.remove(root / name)
+    store = OutlineStore(str(root))
+    assert store.get_chapter(3, 2)["chapter_title"] == "卷3-章2"
+    assert store.get_chapter(3, 1) is None
+
+def _generator(tmp_path, monkeypatch):
+    model = ScriptedChatModel(respond=respond_outline, calls=[])
+    patch_models(monkeypatch, outline_generator, model)
+    generator = outline_generator.OutlineGenerator(cache_dir=str(tmp_path / "cache"), base_dir=str(tmp_path))
+    return generator, model
+
+def test_lazy_outline_expands_only_the_requested_path(tmp_path, monkeypatch):
+    generator, model = _generator(tmp_path, monkeypatch)
+    outline = generator.lazy_outline("主题", "描述")
+    chapter = outline.get_chapter(2, 1)
+    assert chapter["scenes"] == [{"scene_title": "卷2-章1-场景"}]
+    # 书籍、分卷、章节各一次
+    assert len(model.calls) == 3
+    outline.get_chapter(2, 2)
+    assert len(model.calls) == 4
+    assert "chapters" not in outline.to_dict()["volumes"][0]
+
+def test_lazy_outline_reuses_cached_shards(tmp_path, monkeypatch):
+    generator, model = _generator(tmp_path, monkeypatch)
+    generator.lazy_outline("主题", "描述").get_chapter(2, 1)
+    calls = len(model.calls)
+    reads = _count_reads(monkeypatch)
+    chapter = generator.lazy_outline("主题", "描述").get_chapter(2, 1)
+    assert chapter["scenes"] == [{"scene_title": "卷2-章1-场景"}]
+    assert len(model.calls) == calls
+    assert reads == ["index.json", "volume_002.json", "chapter_002_001.json"]
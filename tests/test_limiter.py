@@ -0,0 +1,143 @@
+import asyncio
+import time
+import types
+from typing import Any
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.llm import limiter as limiter_module
+from src.llm.limiter import AdaptiveLimiter, LimitConfig, TokenBucket, limited
+
+class Overloaded(Exception):
+    """模拟服务端返回的 429"""
+
+    status_code = 429
+    response = types.SimpleNamespace(headers={"retry-after": "0"})
+
+def _freeze_clock(monkeypatch):
+    """冻结令牌桶的时钟，桶不会自动补充"""
+    monkeypatch.setattr(limiter_module, "time",
+                        types.SimpleNamespace(monotonic=lambda: 1000.0, sleep=time.sleep))
+
+def _result(content: str = "回复") -> ChatResult:
+    return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def test_token_bucket_goes_into_debt_and_settles(monkeypatch):
+    _freeze_clock(monkeypatch)
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(30) == pytest.approx(30.0)
+    bucket.adjust(-30)
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    bucket.adjust(-1000)
+    assert bucket.level == bucket.capacity
+
+def test_window_bounds_requests_in_flight():
+    limiter = AdaptiveLimiter("fake", LimitConfig(initial_concurrency=2, max_concurrency=2))
+    running, peak = 0, 0
+
+    async def request():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return _result()
+
+    async def main():
+        await asyncio.gather(*(limiter.acall(request, 10) for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+def test_overload_is_retried_and_shrinks_window():
+    limiter = AdaptiveLimiter("fake", LimitConfig(initial_concurrency=8, base_backoff=0.01))
+    attempts = 0
+
+    async def request():
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise Overloaded()
+        return _result()
+
+    assert asyncio.run(limiter.acall(request, 10)).generations[0].message.content == "回复"
+    assert attempts == 2
+    assert limiter.retries == 1
+    # 减半后成功一次，窗口增加 1/窗口
+    assert limiter.window == pytest.approx(4.25)
+
+def test_final_errors_are_not_retried():
+    limiter = AdaptiveLimiter("fake", LimitConfig(max_retries=2, base_backoff=0.01))
+    calls = 0
+
+    async def invalid():
+        nonlocal calls
+        calls += 1
+        raise ValueError("请求无效")
+
+    async def overloaded():
+        raise Overloaded()
+
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.acall(invalid, 10))
+    assert calls == 1
+    with pytest.raises(Overloaded):
+        asyncio.run(limiter.acall(overloaded, 10))
+    assert limiter.retries == 2
+
+def test_closed_stream_settles_partial_usage(monkeypatch):
+    _freeze_clock(monkeypatch)
+    limiter = AdaptiveLimiter("fake", LimitConfig(tokens_per_minute=60000, expected_output_tokens=1000))
+
+    async def chunks():
+        for _ in range(10):
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="字", usage_metadata={"input_tokens": 100, "output_tokens": 5, "total_tokens": 105}
+            ))
+
+    async def main():
+        stream = limiter.astream(chunks, 100)
+        async for _ in stream:
+            break
+        await stream.aclose()
+
+    asyncio.run(main())
+    # 只按已收到的输出结算，被截断的流不影响输出长度的估计
+    assert limiter.tokens.level == pytest.approx(60000 - 100 - 5)
+    assert limiter._expected_output == 1000
+    assert limiter.in_flight == 0
+
+def test_completed_stream_updates_expected_output(monkeypatch):
+    _freeze_clock(monkeypatch)
+    limiter = AdaptiveLimiter("fake", LimitConfig(tokens_per_minute=60000, expected_output_tokens=1000))
+
+    async def chunks():
+        for _ in range(2):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="字字"))
+
+    async def main():
+        return [chunk async for chunk in limiter.astream(chunks, 100)]
+
+    assert len(asyncio.run(main())) == 2
+    # 没有用量信息时按输出内容估算
+    assert limiter._expected_output == pytest.approx(0.8 * 1000 + 0.2 * 4)
+    assert limiter.tokens.level == pytest.approx(60000 - 100 - 4)
+
+def test_limited_model_goes_through_limiter():
+    limiter = AdaptiveLimiter("fake")
+    seen = []
+
+    def limiter_for(model: Any) -> AdaptiveLimiter:
+        seen.append(model)
+        return limiter
+
+    model = limited(FakeListChatModel, limiter_for)(responses=["回复"])
+    assert type(model).__name__ == "FakeListChatModel"
+    assert model.invoke("你好").content == "回复"
+    assert seen == [model]
+    assert limiter.window > LimitConfig().initial_concurrency
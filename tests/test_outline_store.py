@@ -0,0 +1,118 @@
+import json
+import os
+
+from utils import outline_store
+from utils.outline_store import OutlineStore
+
+def _outline():
+    return {
+        "title": "书名",
+        "volumes": [{
+            "volume_number": 1,
+            "volume_title": "第一卷",
+            "chapters": [
+                {"chapter_number": 1, "chapter_title": "开端", "scenes": ["相遇"]},
+                {"chapter_number": 2, "chapter_title": "冲突"}
+            ]
+        }]
+    }
+
+def test_missing_shards_are_stale(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    store.save(_outline())
+    assert not store.is_stale(1)
+    assert not store.is_stale(1, 1)
+    assert store.is_stale(1, 2)
+
+def test_editing_volume_inputs_marks_volume_stale(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    store.save(_outline())
+    outline = _outline()
+    outline["volumes"][0]["volume_title"] = "新的第一卷"
+    store.save_book(outline)
+    assert store.is_stale(1)
+    assert not store.is_stale(1, 1)
+
+def test_editing_chapter_plan_marks_only_that_chapter_stale(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    outline = _outline()
+    outline["volumes"][0]["chapters"][1]["scenes"] = ["对峙"]
+    store.save(outline)
+    volume = store.read_volume(1)
+    volume["chapters"][0]["chapter_title"] = "新的开端"
+    store.save_volume(1, volume)
+    assert store.is_stale(1, 1)
+    assert not store.is_stale(1, 2)
+
+def test_prompt_version_change_marks_everything_stale(tmp_path):
+    OutlineStore(str(tmp_path), version="v1").save(_outline())
+    store = OutlineStore(str(tmp_path), version="v2")
+    assert store.is_stale(1)
+    assert store.is_stale(1, 1)
+
+def _strip_hash(path):
+    """去掉分片中的输入哈希，模拟早期版本写入的分片"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    data.pop(OutlineStore.HASH_KEY)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+def test_shards_written_before_hashes_existed_are_fresh(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    store.save(_outline())
+    _strip_hash(store.volume_path(1))
+    _strip_hash(store.chapter_path(1, 1))
+    store = OutlineStore(str(tmp_path), version="v2")
+    assert not store.is_stale(1)
+    assert not store.is_stale(1, 1)
+
+def test_legacy_hashes_file_is_still_honoured(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    store.save(_outline())
+    (tmp_path / OutlineStore.HASHES_FILE).write_text(json.dumps({
+        "volume_001.json": store.volume_input_hash(1)
+    }), encoding="utf-8")
+    _strip_hash(store.volume_path(1))
+    _strip_hash(store.chapter_path(1, 1))
+    store = OutlineStore(str(tmp_path))
+    assert not store.is_stale(1)
+    # hashes.json 中没有记录的分片（写入哈希前中断）需要重新生成
+    assert store.is_stale(1, 1)
+
+def test_shrinking_a_volume_removes_old_chapter_shards(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    outline = _outline()
+    outline["volumes"][0]["chapters"][1]["scenes"] = ["对峙"]
+    store.save(outline)
+    volume = store.read_volume(1)
+    store.save_volume(1, {"chapters": volume["chapters"][:1]})
+    assert not os.path.exists(store.chapter_path(1, 2))
+    assert os.path.exists(store.chapter_path(1, 1))
+    # 之后重新增加章节时，第2章需要重新生成
+    store.save_volume(1, volume)
+    assert store.is_stale(1, 2)
+
+def test_save_reads_each_shard_at_most_once(tmp_path, monkeypatch):
+    outline = {"title": "书名", "volumes": [{
+        "volume_number": 1,
+        "chapters": [{"chapter_number": i, "chapter_title": f"第{i}章", "scenes": []} for i in range(1, 21)]
+    }]}
+    store = OutlineStore(str(tmp_path))
+    reads, writes = [], []
+    read_json, write_json = outline_store._read_json, outline_store._write_json
+    monkeypatch.setattr(outline_store, "_read_json", lambda path: reads.append(path) or read_json(path))
+    monkeypatch.setattr(outline_store, "_write_json", lambda path, data: writes.append(path) or write_json(path, data))
+    store.save(outline)
+    assert store.volume_path(1) not in reads
+    # 21个分片，索引写入两次（书籍信息和最终的章节目录）
+    assert len(writes) == 21 + 2
+    assert not any(path.endswith(OutlineStore.HASHES_FILE) for path in writes)
+
+def test_load_round_trips_saved_outline(tmp_path):
+    store = OutlineStore(str(tmp_path))
+    store.save(_outline())
+    loaded = OutlineStore(str(tmp_path)).load()
+    assert loaded["volumes"][0]["chapters"][0]["scenes"] == ["相遇"]
+    assert "scenes" not in loaded["volumes"][0]["chapters"][1]
+    assert OutlineStore(str(tmp_path)).get_chapter(1, 1)["chapter_title"] == "开端"
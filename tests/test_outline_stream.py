@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import outline_generator
+from fake_chat import ScriptedChatModel, patch_models, respond_outline
+
+VOLUMES = [
+    {"volume_number": i, "volume_title": f"卷{i}", "volume_description": "", "key_plots": []}
+    for i in (1, 2, 3)
+]
+BOOK = {"main_theme": "主题", "description": "描述", "volumes": VOLUMES}
+# 第2卷条目缺少逗号，本地修复无法补救
+BROKEN_BOOK = json.dumps(BOOK, ensure_ascii=False).replace('"volume_number": 2,', '"volume_number": 2')
+
+def _respond(messages, book_replies):
+    """书籍大纲依次使用 book_replies，其余请求按 respond_outline 回复"""
+    if "主题：" in messages[-1].content:
+        return book_replies.pop(0)
+    return respond_outline(messages)
+
+def _generator(monkeypatch, tmp_path, book_replies):
+    model = ScriptedChatModel(respond=lambda messages: _respond(messages, book_replies), calls=[])
+    patch_models(monkeypatch, outline_generator, model)
+    generator = outline_generator.OutlineGenerator(cache_dir=str(tmp_path / "cache"), base_dir=str(tmp_path))
+    return generator, model
+
+def _book_requests(model):
+    return sum("主题：" in messages[-1].content for messages in model.calls)
+
+def test_streamed_outline_expands_every_node(monkeypatch, tmp_path):
+    generator, model = _generator(monkeypatch, tmp_path, [json.dumps(BOOK, ensure_ascii=False)])
+    outline = asyncio.run(generator.agenerate_complete_outline("主题", "描述", save=False, stream=True))
+    assert [v["volume_number"] for v in outline["volumes"]] == [1, 2, 3]
+    assert outline["volumes"][2]["chapters"][1]["scenes"] == [{"scene_title": "卷3-章2-场景"}]
+    assert _book_requests(model) == 1
+
+def test_unparsable_streamed_item_falls_back_to_plain_request(monkeypatch, tmp_path):
+    generator, model = _generator(monkeypatch, tmp_path, [BROKEN_BOOK, json.dumps(BOOK, ensure_ascii=False)])
+
+    async def main():
+        outline = await generator.agenerate_complete_outline("主题", "描述", save=False, stream=True)
+        return outline, len(asyncio.all_tasks())
+
+    outline, tasks = asyncio.run(main())
+    assert _book_requests(model) == 2
+    assert [v["volume_title"] for v in outline["volumes"]] == ["卷1", "卷2", "卷3"]
+    assert all(len(v["chapters"]) == 2 for v in outline["volumes"])
+    assert all("scenes" in c for v in outline["volumes"] for c in v["chapters"])
+    # 据流式响应启动的下游任务都已取消，只剩当前任务
+    assert tasks == 1
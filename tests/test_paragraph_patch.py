@@ -0,0 +1,63 @@
+import json
+
+from utils.paragraph_patch import (EDIT_OPS, INSERT_OPS, apply_edits, apply_patch_response,
+                                   join_paragraphs, parse_edits, patch_inputs, split_layout)
+
+def test_split_layout_round_trips_original_text():
+    text = "\n　　第一段。\n\n　　第二段。\n第三段。  \n"
+    paragraphs, separators = split_layout(text)
+    assert paragraphs == ["第一段。", "第二段。", "第三段。"]
+    assert len(separators) == len(paragraphs) + 1
+    assert join_paragraphs(paragraphs, separators) == text
+
+def test_edits_refer_to_original_numbering():
+    paragraphs = ["一", "二", "三"]
+    edits = [
+        {"op": "insert_after", "id": 0, "text": "序"},
+        {"op": "insert_after", "id": 1, "text": "一点五"},
+        {"op": "replace", "id": 2, "text": "二改"},
+        {"op": "replace", "id": 3, "text": "三改"},
+        {"op": "replace", "id": 3, "text": "三再改"}
+    ]
+    assert apply_edits(paragraphs, edits) == ["序", "一", "一点五", "二改", "三再改"]
+
+def test_out_of_range_and_duplicate_insertions_are_ignored():
+    edits = [
+        {"op": "replace", "id": 5, "text": "越界"},
+        {"op": "insert_after", "id": 1, "text": "插入"},
+        {"op": "insert_after", "id": 1, "text": "插入"}
+    ]
+    assert apply_edits(["一", "二"], edits) == ["一", "插入", "二"]
+
+def test_parse_edits_drops_malformed_and_disallowed_entries():
+    response = json.dumps({"edits": [
+        {"op": "replace", "id": "2", "text": " 新 "},
+        {"op": "delete", "id": 1, "text": "x"},
+        {"op": "replace", "id": "abc", "text": "x"},
+        {"op": "insert_after", "id": 1},
+        {"op": "insert_after", "id": 1, "text": "  "}
+    ]}, ensure_ascii=False)
+    assert parse_edits(response, EDIT_OPS) == [{"op": "replace", "id": 2, "text": "新"}]
+    assert parse_edits(response, INSERT_OPS) == []
+
+def test_patch_inputs_number_paragraphs_and_list_flags():
+    paragraphs, chain_input = patch_inputs("一。\n\n二。", [2], ["重复句子比例 10%"])
+    assert paragraphs == ["一。", "二。"]
+    assert chain_input == {"paragraphs": "[P1] 一。\n\n[P2] 二。", "flagged": "P2", "issues": "重复句子比例 10%"}
+    assert patch_inputs("一。", [], [])[1]["flagged"] == "无"
+
+def test_apply_patch_response_preserves_layout():
+    content = "　　一。\n　　二。\n　　三。"
+    paragraphs, _ = split_layout(content)
+    response = json.dumps({"edits": [
+        {"op": "replace", "id": 2, "text": "二改。"},
+        {"op": "insert_after", "id": 3, "text": "四。"}
+    ]}, ensure_ascii=False)
+    assert apply_patch_response(content, paragraphs, response) == "　　一。\n　　二改。\n　　三。\n　　四。"
+
+def test_apply_patch_response_keeps_draft_on_bad_response():
+    content = "一。\n\n二。"
+    paragraphs, _ = split_layout(content)
+    assert apply_patch_response(content, paragraphs, "不是JSON") == content
+    assert apply_patch_response(content, paragraphs, '{"edits": "不是列表"}') == content
+    assert apply_patch_response(content, paragraphs, '{"edits": []}') == content
@@ -0,0 +1,50 @@
+from utils.pass_controller import PassController
+from utils.text_metrics import count_words, estimate_tokens
+
+DIALOGUE = "“你来了，”她说。\n“嗯，”他点点头，把伞收了起来。"
+
+def test_count_words_on_mixed_cjk_and_latin_text():
+    assert count_words("他打开了 iPhone 15，看见 Alice's 消息。") == 11
+    assert count_words("state-of-the-art 模型") == 3
+    assert count_words("，。！  \n") == 0
+    assert count_words("中文 text " * 100) == 300
+    assert len("中文abc 123".split()) == 2
+    assert count_words("中文abc 123") == 4
+
+def test_estimate_tokens_counts_cjk_separately():
+    assert estimate_tokens("中文") == 2
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("中文 abcde") == 4
+
+def test_expand_runs_only_when_short_of_target():
+    controller = PassController(expand_ratio=0.9)
+    assert controller.should_run("expand", "字" * 80, target_words=100)
+    assert not controller.should_run("expand", "字" * 90, target_words=100)
+    assert not controller.should_run("expand", "word " * 95, target_words=100)
+    assert controller.should_run("generate", "", target_words=100)
+
+def test_enhance_runs_only_on_quality_issues():
+    controller = PassController()
+    assert not controller.should_run("enhance", DIALOGUE)
+    assert controller.quality_issues("他走在路上。" * 3 + "“好，”她说。") == ["重复句子比例 67%"]
+    assert controller.quality_issues("他一个人走在路上，什么也没有说。") == ["对话比例 0%"]
+    assert controller.should_run("enhance", DIALOGUE + "\n" + "长" * 601)
+    assert controller.flag_paragraphs(DIALOGUE + "\n" + "长" * 601) == [3]
+
+def test_skipped_passes_are_reported_as_saved_tokens():
+    controller = PassController()
+    controller.record_run("generate", "大纲", "正文" * 50)
+    controller.record_skip("expand", "正文" * 50, target_words=200)
+    report = controller.report()
+    assert report["passes_run"] == {"generate": 1, "expand": 0, "enhance": 0}
+    assert report["passes_skipped"] == {"generate": 0, "expand": 1, "enhance": 0}
+    assert report["tokens_spent"] == 2 + 100
+    assert report["tokens_saved"] == 100 + 200
+
+def test_skipped_target_words_are_converted_to_tokens():
+    controller = PassController()
+    text = "hello world " * 50
+    assert count_words(text) == 100 and estimate_tokens(text) == 125
+    controller.record_skip("expand", text, target_words=200)
+    # 输出按目标字数 200 × 每字 1.25 token 估算
+    assert controller.tokens_saved == 125 + 250
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from utils.pipeline import ReorderBuffer, run_pipeline, run_worker_pool
+
+def test_reorder_buffer_releases_contiguous_prefix():
+    ready = []
+    buffer = ReorderBuffer(ready.append)
+    buffer.put(2, "c")
+    buffer.put(1, "b")
+    assert ready == [] and buffer.pending == 2
+    buffer.put(0, "a")
+    assert ready == ["a", "b", "c"] and buffer.pending == 0
+
+def test_worker_pool_respects_concurrency_and_order():
+    running, peak, ready = 0, 0, []
+
+    async def worker(index, item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        # 后面的项先完成
+        await asyncio.sleep(0.01 * (5 - index))
+        running -= 1
+        return item * 2
+
+    results = asyncio.run(run_worker_pool([1, 2, 3, 4, 5], worker, max_concurrency=2,
+                                          on_ready=ready.append))
+    assert results == [2, 4, 6, 8, 10]
+    assert ready == results
+    assert peak == 2
+
+def test_worker_pool_cancels_remaining_tasks_on_error():
+    cancelled = []
+
+    async def worker(index, item):
+        if index == 0:
+            raise ValueError("失败")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_worker_pool([0, 1, 2], worker, max_concurrency=3))
+    assert sorted(cancelled) == [1, 2]
+
+def test_pipeline_bounds_producer_and_keeps_order():
+    produced, consumed = [], []
+
+    async def producer():
+        for i in range(6):
+            produced.append(i)
+            yield i
+
+    async def consumer(item):
+        # 生产者最多领先已处理项 max_pending + 消费者数量 + 1
+        assert len(produced) - len(consumed) <= 5
+        await asyncio.sleep(0.01 * (item % 3))
+        consumed.append(item)
+        return item * item
+
+    results = asyncio.run(run_pipeline(producer(), consumer, num_workers=2, max_pending=2))
+    assert results == [0, 1, 4, 9, 16, 25]
+
+def test_pipeline_consumer_error_does_not_hang_producer():
+    async def producer():
+        for i in range(100):
+            yield i
+
+    async def consumer(item):
+        if item == 1:
+            raise RuntimeError("失败")
+        return item
+
+    async def main():
+        return await asyncio.wait_for(run_pipeline(producer(), consumer, max_pending=1), 5)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from src.llm.registry import LLMRegistry, PoolConfig, _LoopLocalTransport
+
+def test_identical_settings_share_one_model():
+    registry = LLMRegistry()
+    llm = registry.get("anthropic", "claude-test", api_key="key", temperature=0.7)
+    assert registry.get("anthropic", "claude-test", api_key="key", temperature=0.7) is llm
+    assert registry.get("anthropic", "claude-test", api_key="key", temperature=0.2) is not llm
+    assert registry.get("anthropic", "claude-other", api_key="key", temperature=0.7) is not llm
+    with pytest.raises(ValueError):
+        registry.get("unknown", "model")
+
+def test_models_send_requests_through_the_shared_clients():
+    registry = LLMRegistry()
+    first = registry.get("anthropic", "claude-test", api_key="key")
+    second = registry.get("anthropic", "claude-other", api_key="key")
+    assert first._client._client is second._client._client is registry.http_client
+    assert first._async_client._client is second._async_client._client is registry.async_http_client
+
+def test_pool_settings_are_fixed_once_a_client_exists():
+    registry = LLMRegistry()
+    registry.configure(PoolConfig(max_connections=4))
+    registry.http_client
+    with pytest.raises(RuntimeError):
+        registry.configure(PoolConfig(max_connections=8))
+
+def test_async_transport_keeps_one_pool_per_event_loop():
+    transport = _LoopLocalTransport()
+
+    async def pools():
+        return transport._pool(), transport._pool()
+
+    first, again = asyncio.run(pools())
+    second, _ = asyncio.run(pools())
+    assert first is again
+    assert second is not first
+
+def test_anthropic_clients_follow_model_settings():
+    registry = LLMRegistry()
+    llm = registry.get("anthropic", "claude-test", api_key="key", default_request_timeout=30)
+    assert llm._client.api_key == llm._async_client.api_key == "key"
+    assert llm._client.timeout == 30
+    # 重试由限流器负责
+    assert llm._client.max_retries == llm._async_client.max_retries == 0
@@ -0,0 +1,68 @@
+import itertools
+import types
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.llm import cache as cache_module
+from src.llm.cache import ChatModelCache, ResponseCache, refresh_cache
+
+def _clock(monkeypatch):
+    """每次取时间都前进一秒，最近使用顺序不受时钟精度影响"""
+    ticks = itertools.count(1)
+    monkeypatch.setattr(cache_module, "time", types.SimpleNamespace(time=lambda: float(next(ticks))))
+
+def test_get_put_and_stats(tmp_path):
+    store = ResponseCache(str(tmp_path / "cache.db"))
+    assert store.get("a") is None
+    store.put("a", "回复")
+    assert store.get("a") == "回复"
+    assert store.stats() == {"hits": 1, "misses": 1, "entries": 1, "bytes": len("回复".encode("utf-8"))}
+
+def test_totals_follow_overwrites_and_clear(tmp_path):
+    path = str(tmp_path / "cache.db")
+    store = ResponseCache(path)
+    store.put("a", "x" * 10)
+    store.put("a", "x" * 4)
+    store.put("b", "x" * 6)
+    assert store.stats()["bytes"] == 10 and store.stats()["entries"] == 2
+    # 另一个进程打开同一个数据库时读到相同的统计
+    assert ResponseCache(path).stats()["bytes"] == 10
+    store.clear()
+    assert store.stats()["bytes"] == 0 and store.stats()["entries"] == 0
+
+def test_evicts_least_recently_used_down_to_share_of_limit(tmp_path, monkeypatch):
+    _clock(monkeypatch)
+    store = ResponseCache(str(tmp_path / "cache.db"), max_entries=4)
+    for key in "abcd":
+        store.put(key, key)
+    store.get("a")
+    store.put("e", "e")
+    # 超过4条后淘汰到 4 * 0.9 条以内，a 刚被使用过因此保留
+    assert [key for key in "abcde" if store.get(key) is not None] == ["a", "d", "e"]
+
+def test_evicts_by_size(tmp_path, monkeypatch):
+    _clock(monkeypatch)
+    store = ResponseCache(str(tmp_path / "cache.db"), max_bytes=100)
+    for key in "abc":
+        store.put(key, "x" * 40)
+    assert store.get("a") is None
+    assert store.get("c") is not None
+    assert store.stats()["bytes"] <= 90
+
+def test_chat_model_cache_serves_repeated_calls(tmp_path):
+    store = ResponseCache(str(tmp_path / "cache.db"))
+    llm = FakeListChatModel(responses=["第一次", "第二次", "第三次"], cache=ChatModelCache(lambda: store))
+    assert llm.invoke("你好").content == "第一次"
+    assert llm.invoke("你好").content == "第一次"
+    with refresh_cache():
+        assert llm.invoke("你好").content == "第二次"
+    # 刷新得到的回复覆盖了旧的缓存
+    assert llm.invoke("你好").content == "第二次"
+    assert llm.invoke("别的问题").content == "第三次"
+
+def test_prompt_version_and_disabled_store(tmp_path):
+    store = ResponseCache(str(tmp_path / "cache.db"))
+    ChatModelCache(lambda: store, prompt_version="v1").update("p", "llm", [])
+    assert ChatModelCache(lambda: store, prompt_version="v2").lookup("p", "llm") is None
+    assert ChatModelCache(lambda: store, prompt_version="v1").lookup("p", "llm") == []
+    assert ChatModelCache(lambda: None).lookup("p", "llm") is None
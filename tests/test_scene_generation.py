@@ -0,0 +1,79 @@
+import asyncio
+import re
+
+import content_generator
+from fake_chat import ScriptedChatModel, patch_models
+
+SCENES = [
+    {"scene_title": "雨夜", "scene_description": "主角回到旧宅"},
+    {"scene_title": "密信", "scene_description": "发现父亲留下的信", "expected_words": "50"},
+    {"scene_title": "出城", "scene_description": "连夜离开"},
+]
+CHAPTER = {"chapter_title": "归来", "summary": "主角回到故乡", "scenes": SCENES}
+
+def _scene_title(messages):
+    match = re.search(r'"scene_title": "([^"]+)"', messages[-1].content)
+    return match.group(1) if match else None
+
+def _scene_text(title: str) -> str:
+    return f"“快走，”{title}里的少年低声说道，转身没入夜色之中。"
+
+STITCHED = "\n\n".join(_scene_text(scene["scene_title"]) for scene in SCENES)
+
+def _respond(messages) -> str:
+    title = _scene_title(messages)
+    return _scene_text(title) if title else "润色后的正文"
+
+class SlowFirstModel(ScriptedChatModel):
+    """越靠前的场景返回越慢，使各场景按相反的顺序完成"""
+
+    async def _delay(self, messages):
+        titles = [scene["scene_title"] for scene in SCENES]
+        title = _scene_title(messages)
+        if title:
+            await asyncio.sleep(0.01 * (len(titles) - titles.index(title)))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._delay(messages)
+        return self._generate(messages, stop=stop, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._delay(messages)
+        async for chunk in super()._astream(messages, stop=stop, **kwargs):
+            yield chunk
+
+def _generator(tmp_path, monkeypatch, model, **kwargs):
+    patch_models(monkeypatch, content_generator, model)
+    return content_generator.ContentGenerator(base_dir=str(tmp_path), scene_parallel=True, **kwargs)
+
+def test_scene_inputs_split_target_words_and_handoff(tmp_path, monkeypatch):
+    generator = _generator(tmp_path, monkeypatch, ScriptedChatModel(respond=_respond, calls=[]))
+    inputs = generator._scene_inputs(CHAPTER, 90)
+    assert [i["target_words"] for i in inputs] == [30, "50", 30]
+    assert "本场景是章节开头" in inputs[0]["handoff"]
+    assert "下一场景《密信》：发现父亲留下的信" in inputs[0]["handoff"]
+    assert "上一场景《雨夜》：主角回到旧宅" in inputs[1]["handoff"]
+    assert "本场景是章节结尾" in inputs[2]["handoff"]
+    assert all('"scene_titles"' in i["chapter_context"] and '"scenes"' not in i["chapter_context"] for i in inputs)
+
+def test_single_scene_chapter_is_not_split(tmp_path, monkeypatch):
+    generator = _generator(tmp_path, monkeypatch, ScriptedChatModel(respond=_respond, calls=[]))
+    assert generator._use_scenes(CHAPTER)
+    assert not generator._use_scenes({**CHAPTER, "scenes": SCENES[:1]})
+    generator.scene_parallel = False
+    assert not generator._use_scenes(CHAPTER)
+
+def test_scenes_are_stitched_in_outline_order(tmp_path, monkeypatch):
+    model = ScriptedChatModel(respond=_respond, calls=[])
+    generator = _generator(tmp_path, monkeypatch, model)
+    content = generator._generate_content(CHAPTER, target_words=30)
+    assert {_scene_title(messages) for messages in model.calls} == {"雨夜", "密信", "出城"}
+    assert content == STITCHED
+    assert generator.pass_controller.report()["passes_run"] == {"generate": 1, "expand": 0, "enhance": 0}
+
+def test_async_scenes_keep_order_when_finishing_out_of_order(tmp_path, monkeypatch):
+    model = SlowFirstModel(respond=_respond, calls=[])
+    generator = _generator(tmp_path, monkeypatch, model)
+    content = asyncio.run(generator._agenerate_content(CHAPTER, target_words=30))
+    assert [_scene_title(messages) for messages in model.calls] == ["出城", "密信", "雨夜"]
+    assert content == STITCHED
@@ -0,0 +1,109 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.llm.singleflight import SingleFlight, coalescing
+
+class SlowChatModel(BaseChatModel):
+    """回复固定内容、每次调用都记录下来的慢速模型"""
+
+    reply: str = "回复"
+    delay: float = 0.05
+    fail: bool = False
+    calls: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self.calls.append(messages[-1].content)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("上游出错")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        self.calls.append(messages[-1].content)
+        for piece in self.reply:
+            await asyncio.sleep(self.delay / len(self.reply))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+def _model(**kwargs) -> BaseChatModel:
+    return coalescing(SlowChatModel, SingleFlight())(calls=[], **kwargs)
+
+def test_identical_concurrent_requests_share_one_call():
+    model = _model()
+
+    async def main():
+        return await asyncio.gather(model.ainvoke("问题"), model.ainvoke("问题"), model.ainvoke("别的"))
+
+    results = asyncio.run(main())
+    assert [r.content for r in results] == ["回复"] * 3
+    assert sorted(model.calls) == ["别的", "问题"]
+
+def test_followers_receive_the_leaders_error():
+    model = _model(fail=True)
+
+    async def main():
+        return await asyncio.gather(model.ainvoke("问题"), model.ainvoke("问题"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert model.calls == ["问题"]
+
+def test_follower_takes_over_when_leader_is_cancelled():
+    model = _model()
+
+    async def main():
+        leader = asyncio.create_task(model.ainvoke("问题"))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(model.ainvoke("问题"))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()).content == "回复"
+    assert model.calls == ["问题", "问题"]
+
+def test_stream_followers_get_the_whole_output_at_once():
+    model = _model(reply="一二三")
+
+    async def collect():
+        return [chunk.content async for chunk in model.astream("问题")]
+
+    async def main():
+        return await asyncio.gather(collect(), collect())
+
+    leader, follower = asyncio.run(main())
+    assert leader == ["一", "二", "三"]
+    assert follower == ["一二三"]
+    assert model.calls == ["问题"]
+
+def test_finish_without_result_cancels_flight():
+    flights = SingleFlight()
+    future, leader = flights.join("key")
+    same, follower_leads = flights.join("key")
+    assert leader and not follower_leads and same is future
+    assert flights.coalesced == 1
+    flights.finish("key", future, error=asyncio.CancelledError())
+    assert SingleFlight.wait(future) is None
+    # 航班结束后新的调用重新成为领头者
+    assert flights.join("key")[1]
+
+def test_finish_hands_over_result_and_error():
+    flights = SingleFlight()
+    future, _ = flights.join("a")
+    flights.finish("a", future, "结果")
+    assert SingleFlight.wait(future) == "结果"
+    future, _ = flights.join("b")
+    flights.finish("b", future, error=ValueError("错误"))
+    with pytest.raises(ValueError):
+        SingleFlight.wait(future)
@@ -0,0 +1,50 @@
+from utils.stream_monitor import StreamMonitor, json_monitor, prose_monitor
+
+def _paragraph(seed: int, length: int = 40) -> str:
+    """内容互不重复的段落"""
+    return "".join(chr(0x4e00 + seed * length + i) for i in range(length))
+
+def test_releases_only_complete_paragraphs():
+    monitor = StreamMonitor()
+    first = _paragraph(0)
+    assert monitor.feed(first[:10]) == ""
+    assert monitor.feed(first[10:] + "\n" + _paragraph(1)[:5]) == first + "\n"
+    assert monitor.flush() == _paragraph(1)[:5]
+    assert not monitor.stopped
+
+def test_stops_at_paragraph_boundary_after_target_length():
+    monitor = StreamMonitor(target_words=100, target_ratio=1.1)
+    released = "".join(monitor.feed(_paragraph(i) + "\n") for i in range(5))
+    assert monitor.stop_reason == "length"
+    assert released == "".join(_paragraph(i) + "\n" for i in range(3))
+    assert monitor.words == 120
+    assert monitor.feed(_paragraph(9) + "\n") == ""
+    assert monitor.flush() == ""
+
+def test_repeated_paragraph_is_withheld():
+    monitor = StreamMonitor()
+    assert monitor.feed(_paragraph(0) + "\n" + _paragraph(1) + "\n") != ""
+    assert monitor.feed(_paragraph(0) + "\n") == ""
+    assert monitor.stop_reason == "repetition"
+
+def test_loop_inside_unfinished_paragraph_stops():
+    monitor = StreamMonitor(window=200)
+    loop = _paragraph(0, 12)
+    for _ in range(20):
+        assert monitor.feed(loop) == ""
+        if monitor.stopped:
+            break
+    assert monitor.stop_reason == "repetition"
+
+def test_json_mode_releases_closed_objects_only():
+    monitor = json_monitor({})
+    assert monitor.feed('{"chapters": [{"title": "一"}, {"ti') == '{"chapters": [{"title": "一"}'
+    assert monitor.feed('tle": "二"}') == ', {"title": "二"}'
+    assert monitor.flush() == ""
+
+def test_prose_monitor_reads_target_from_inputs():
+    assert prose_monitor("target_words")({"target_words": " 3000 "}).target_words == 3000
+    assert prose_monitor("target_words")({"target_words": "约三千"}).target_words == 0
+    assert prose_monitor()({}).target_words == 0
+    monitor = prose_monitor(source_key="content", source_ratio=1.5)({"content": "一二三四"})
+    assert monitor.target_words == 4 and monitor.target_ratio == 1.5
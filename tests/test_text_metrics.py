@@ -0,0 +1,17 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+from src.utils import text_metrics as shared
+from utils import text_metrics
+
+def test_demo_reuses_the_shared_counters():
+    for name in ("CJK_PATTERN", "count_cjk", "count_words", "estimate_tokens", "cached_token_estimate"):
+        assert getattr(text_metrics, name) is getattr(shared, name)
+
+def test_cached_counters_match_uncached():
+    text = "第一章 Chapter One：开始"
+    assert shared.cached_word_count(text) == shared.count_words(text) == 7
+    assert shared.cached_token_estimate(text) == shared.estimate_tokens(text)
+
+def test_prompt_tokens_counts_only_template_text():
+    prompt = ChatPromptTemplate.from_messages([("system", "你是作家"), ("human", "写{topic}")])
+    assert text_metrics.prompt_tokens(prompt) == shared.estimate_tokens("你是作家") + shared.estimate_tokens("写{topic}")